@@ -4,8 +4,9 @@
 #
 # License: BSD 3 clause
 
-from ._decision_tree import demo, demo_from_scratch, demo_metrics, decision_tree_classifier, Gini_impurity, Entropy, decision_tree_classifier_from_scratch
+from ._decision_tree import demo, demo_from_scratch, demo_metrics, demo_compile, decision_tree_classifier, Gini_impurity, Entropy, decision_tree_classifier_from_scratch, decision_stump_classifier_from_scratch
 from ._decision_tree import decision_tree_regressor, decision_tree_regressor_from_scratch
+from ._histogram import histogram_bin_mapper
 
 # this is for "from <package_name>.decision_tree import *"
-__all__ = ["demo", "demo_from_scratch", "demo_metrics", "decision_tree_classifier", "Gini_impurity", "Entropy", "decision_tree_classifier_from_scratch", "decision_tree_regressor", "decision_tree_regressor_from_scratch", ]
+__all__ = ["demo", "demo_from_scratch", "demo_metrics", "demo_compile", "decision_tree_classifier", "Gini_impurity", "Entropy", "decision_tree_classifier_from_scratch", "decision_stump_classifier_from_scratch", "decision_tree_regressor", "decision_tree_regressor_from_scratch", "histogram_bin_mapper", ]
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+# Author: Daniel Yang <daniel.yj.yang@gmail.com>
+#
+# License: BSD 3 clause
+
+import numpy as np
+
+
+# Native categorical splits for the from-scratch trees: a categorical feature holds integer codes 0, 1, 2, ... (e.g., from pd.factorize),
+# and a split sends a subset of the categories to the left child. In each node, the categories are ordered by their rate of one class
+# (with two classes, the best subset is a prefix of this order), and then swept as the sorted values of a numeric feature.
+# The subset is kept as a bitset (bit c of byte c // 8 is set if category c goes left); unseen categories go right.
+
+def _check_categorical_features(categorical_features, X, n_features, columns=None):
+    """
+    Returns the sorted indices of the categorical features, from column indices, column names (with columns, those of a pd.DataFrame X),
+    or a boolean mask; and the number of categories (the largest code + 1) of each feature (0 for the numeric ones).
+    Raises ValueError if a categorical feature is not made of non-negative integer codes.
+    """
+    categorical_features = np.asarray([] if categorical_features is None else categorical_features)
+    if categorical_features.dtype == bool:
+        if categorical_features.shape != (n_features,):
+            raise ValueError(f"a boolean categorical_features must have one entry per feature ({n_features})")
+        categorical_features = np.flatnonzero(categorical_features)
+    elif categorical_features.dtype.kind in 'OUS':
+        if columns is None:
+            raise ValueError('categorical_features can only be column names when X is a pd.DataFrame')
+        columns = list(columns)
+        categorical_features = np.array([columns.index(name) for name in categorical_features], dtype=np.intp)
+    categorical_features = np.unique(categorical_features.astype(np.intp))
+    if categorical_features.size and (categorical_features[0] < 0 or categorical_features[-1] >= n_features):
+        raise ValueError(f"categorical_features must be between 0 and {n_features - 1}")
+
+    n_categories = np.zeros(shape=(n_features,), dtype=np.intp)
+    for feature_i in categorical_features:
+        x = np.asarray(X[:, feature_i], dtype=float)
+        if not (np.all(np.isfinite(x)) and np.all(x >= 0) and np.all(x == np.floor(x))):
+            raise ValueError(f"the categorical feature {feature_i} must be encoded as non-negative integers, e.g., with pd.factorize()")
+        n_categories[feature_i] = int(x.max()) + 1 if x.size else 0
+    return categorical_features, n_categories
+
+
+def _category_ranks_in_segments(codes, y_encoded, sample_weight, segment_ids, n_segments, n_classes):
+    """
+    Orders the categories in each node (codes and segment_ids as in _find_best_splits_in_segments()) by their weighted rate of one class:
+    the second class with two classes, otherwise the heaviest class of the node; ties go to the smaller category.
+    Only the (node, category) pairs that occur are kept, i.e., O(n_rows) memory whatever the number of categories.
+
+    Returns the rank of the category of each row within its node (as floats, to be swept as x), and the (node, category, rank) pairs
+    """
+    n_categories = int(codes.max()) + 1 if codes.size else 1
+    pair_ids, row_pairs = np.unique(segment_ids * n_categories + codes, return_inverse=True)
+    pair_segment_ids, pair_categories = np.divmod(pair_ids, n_categories)
+
+    if n_classes == 2:
+        is_target_class = (y_encoded == 1)
+    else:
+        segment_class_weights = np.bincount(segment_ids * n_classes + y_encoded, weights=sample_weight, minlength=n_segments * n_classes).reshape(n_segments, n_classes)
+        is_target_class = (y_encoded == np.argmax(segment_class_weights, axis=1)[segment_ids])
+    pair_weights = np.bincount(row_pairs, weights=sample_weight, minlength=len(pair_ids))
+    pair_target_weights = np.bincount(row_pairs, weights=sample_weight * is_target_class, minlength=len(pair_ids))
+    pair_rates = np.divide(pair_target_weights, pair_weights, out=np.zeros_like(pair_weights), where=pair_weights > 0)
+
+    order = np.lexsort((pair_categories, pair_rates, pair_segment_ids)) # by node, then by rate, then by category
+    # pair_ids are sorted by node, so the first pair of each node is at the same position before and after the sort
+    pair_ranks = np.empty(shape=(len(pair_ids),))
+    pair_ranks[order] = np.arange(len(pair_ids)) - np.searchsorted(pair_segment_ids, pair_segment_ids, side='left')
+    return pair_ranks[row_pairs], (pair_segment_ids, pair_categories, pair_ranks)
+
+
+def _set_bits(bitsets, bitset_indices, codes):
+    """
+    sets, in place, the bit of category codes[k] in the bitset bitsets[bitset_indices[k]], for every k
+    """
+    np.bitwise_or.at(bitsets, (bitset_indices, codes >> 3), np.left_shift(1, codes & 7).astype(np.uint8))
+
+
+def _bitset_contains(bitsets, bitset_indices, x):
+    """
+    whether the category x[k] is in the bitset bitsets[bitset_indices[k]], for every k; out of range or NaN codes are not
+    """
+    x = np.asarray(x, dtype=float)
+    in_range = np.isfinite(x) & (x >= 0) & (x < bitsets.shape[1] * 8)
+    codes = np.where(in_range, x, 0).astype(np.intp)
+    return in_range & (((bitsets[bitset_indices, codes >> 3] >> (codes & 7)) & 1) == 1)
+
+
+def _categories_in_bitset(bitset):
+    """
+    the sorted category codes whose bit is set
+    """
+    return np.flatnonzero(np.unpackbits(bitset, bitorder='little'))
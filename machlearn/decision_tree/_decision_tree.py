@@ -11,6 +11,11 @@ import numpy as np
 import pandas as pd
 
 from ..base import classifier
+from ..utils import effective_n_jobs
+from ._histogram import histogram_bin_mapper, _build_histograms, _build_histograms_of_nodes, _sibling_histograms, _grow_histogram_tree
+from ._segments import _segment_positions, _partition_segments, _segment_starts_and_lengths, _segment_sums_at, _first_minimum_per_segment
+from ._sparse import _is_sparse, _to_csr, _stored_entries_by_feature, _values_at
+from ._categorical import _check_categorical_features, _category_ranks_in_segments, _set_bits, _bitset_contains, _categories_in_bitset
 
 # Reduction in uncertainty = gain in information
 #def Information_Gain(y, X):
@@ -27,66 +32,126 @@ def Entropy(splitted_sample=[]):
     For example: [194, 106]
     Entropy is a measure of disorder/uncertainty (= low purity, a lack of dominant class)
     Entropy vs. Gini impurity: both of them involve p_j * p_j, but Entropy takes the form of S = k_b*ln(Ω)
-    """
-
-    import math
 
-    denominator = sum(splitted_sample)
-    if denominator == 0:
-        return 0
-    Entropy_index = 0
-    for numerator_i in range(len(splitted_sample)):
-        p_i = splitted_sample[numerator_i]/denominator
-        if p_i != 0:
-            Entropy_index -= p_i * math.log2(p_i)
-        #Entropy_index -= p_i * ma.array(ma.log2(p_i)).filled(0) # handle log2(0) warning
-    return Entropy_index
+    splitted_sample may also be a matrix of shape (n_candidates, n_classes), e.g., [[194, 106], [3, 0]], one entropy per row
+    """
+    splitted_sample = np.asarray(splitted_sample, dtype=float)
+    if splitted_sample.ndim == 2:
+        return _impurity_of_class_sums(splitted_sample, impurity_measure='entropy')
+    return float(_impurity_of_class_sums(splitted_sample[np.newaxis], impurity_measure='entropy')[0])
 
 
 def Gini_impurity(splitted_sample=[]):
     """
     For example: [194, 106]
     note: summation( p_j * (1 - p_j) ) = 1 - summation( p_j^2 )
+    p_j * (1 - p_j) is the likelihood of misclassifying a new instance
+
+    splitted_sample may also be a matrix of shape (n_candidates, n_classes), as in Entropy()
     """
-    denominator = sum(splitted_sample)
-    if denominator == 0:
-        return 0
-    Gini_index = 0
-    for numerator_i in range(len(splitted_sample)):
-        p_i = splitted_sample[numerator_i]/denominator
-        # p_j * (1 - p_j) is the likelihood of misclassifying a new instance
-        Gini_index += p_i * (1 - p_i)
-    return Gini_index
+    splitted_sample = np.asarray(splitted_sample, dtype=float)
+    if splitted_sample.ndim == 2:
+        return _impurity_of_class_sums(splitted_sample, impurity_measure='gini_impurity')
+    return float(_impurity_of_class_sums(splitted_sample[np.newaxis], impurity_measure='gini_impurity')[0])
 
 
 def impurity_measure_with_sample_weight(y_class0_value=0, y_class1_value=1, y=[], sample_weight=None, impurity_func=Entropy):
     """
     For example: y=[0,1,1,0,0,1], sample_weight=[0.1, 0.1, 0.2, 0.1, 0.1, 0.1]
     """
-
-    y_class0_sample_weighted_sum = 0
-    y_class1_sample_weighted_sum = 0
-
+    y = np.asarray(y)
     length_y = len(y)
     if length_y == 0:
         return 0
 
     if sample_weight is None:
         sample_weight = np.ones(shape=(length_y,))
-
-    #print(f"{sample_weight}")
+    sample_weight = np.asarray(sample_weight)
 
     if length_y != len(sample_weight):
         raise ValueError("unequal inputs of y[] and sample_weight[]")
 
-    y_class0_sample_weighted_sum = np.sum(sample_weight[y == y_class0_value])
-    y_class1_sample_weighted_sum = np.sum(sample_weight[y == y_class1_value])
+    y_is_class0, y_is_class1 = (y == y_class0_value), (y == y_class1_value)
+    is_invalid = ~(y_is_class0 | y_is_class1)
+    if is_invalid.any():
+        i = int(np.argmax(is_invalid))
+        raise ValueError(f"y[{i}]=[{y[i]}] must be either y_class0_value=[{y_class0_value}] or y_class1_value=[{y_class1_value}]")
+
+    return impurity_func(splitted_sample=[np.sum(sample_weight[y_is_class0]), np.sum(sample_weight[y_is_class1])])
+
+
+def _impurity_of_class_sums(class_sums, impurity_measure='entropy'):
+    """
+    The vectorized Entropy() and Gini_impurity(), on all the candidate splits at once.
+
+    class_sums: (n_candidates, n_classes) (weighted) class counts, e.g., [[194, 106], [3, 0]]
+    Returns an array of shape (n_candidates,); a row summing to 0 has an impurity of 0, and 0*log2(0) is taken as 0.
+    """
+    class_sums = np.asarray(class_sums, dtype=float)
+    denominator = class_sums.sum(axis=1, keepdims=True)
+    p = np.divide(class_sums, denominator, out=np.zeros_like(class_sums), where=denominator > 0)
+    if impurity_measure == 'entropy':
+        log2_p = np.log2(p, out=np.zeros_like(p), where=p > 0)
+        return 0.0 - np.sum(p * log2_p, axis=1) # 0.0 - rather than a unary minus, to avoid -0.0
+    if impurity_measure == 'gini_impurity':
+        return np.sum(p * (1 - p), axis=1)
+    raise ValueError('invalid impurity_measure value')
+
+
+def _encode_class_labels(y, classes=None):
+    """
+    Validates and encodes the class labels once, in fit(): y must be 1-D (or a single column), non-empty, and without NaN.
+    Returns (classes, y_encoded): the sorted distinct labels (or the given classes, which must include every label of y),
+    and y as np.intp codes 0, ..., n_classes - 1 into classes, which the splitters count with np.bincount.
+    """
+    if type(y) in [pd.DataFrame, pd.Series]:
+        y = y.to_numpy()
+    y = np.asarray(y)
+    if y.ndim == 2 and y.shape[1] == 1:
+        y = y.ravel()
+    if y.ndim != 1:
+        raise ValueError(f"y must be 1-D, but its shape is {y.shape}")
+    if len(y) == 0:
+        raise ValueError("y must not be empty")
+    if y.dtype.kind in 'fc' and np.isnan(y).any():
+        raise ValueError("y must not contain NaN")
+    if classes is not None:
+        classes = np.asarray(classes)
+        return classes, _encode_against_classes(y, classes)
+    classes, y_encoded = np.unique(y, return_inverse=True)
+    return classes, y_encoded.astype(np.intp)
+
+
+def _encode_against_classes(y, classes):
+    """
+    y as np.intp codes into classes (a sorted array of labels, e.g., the classes_ of a tree or a forest), which must hold every label of y
+    """
+    y = np.asarray(y)
+    y_encoded = np.minimum(np.searchsorted(classes, y), len(classes) - 1)
+    is_invalid = (classes[y_encoded] != y)
+    if is_invalid.any():
+        i = int(np.argmax(is_invalid))
+        raise ValueError(f"y[{i}]=[{y[i]}] must be one of the classes {list(classes)}")
+    return y_encoded.astype(np.intp)
+
+
+def _one_hot(y_encoded, n_classes, weights=None):
+    """
+    an array of shape (n_rows, n_classes) holding weights[i] (or 1) at [i, y_encoded[i]], and 0 elsewhere;
+    its cumulative sums along a sorted order are the (weighted) class counts left of every cutoff
+    """
+    one_hot = np.zeros(shape=(len(y_encoded), n_classes))
+    one_hot[np.arange(len(y_encoded)), y_encoded] = 1.0 if weights is None else weights
+    return one_hot
 
-    for i in range(length_y):
-        if y[i] not in [y_class0_value, y_class1_value]:
-            raise ValueError(f"y[{i}]=[{y[i]}] must be either y_class0_value=[{y_class0_value}] or y_class1_value=[{y_class1_value}]")
 
-    return impurity_func(splitted_sample=[y_class0_sample_weighted_sum, y_class1_sample_weighted_sum])
+def _dominant_class_codes(class_probs):
+    """
+    the most probable class of each row of class_probs (n_rows, n_classes); the last one in ties,
+    so that with two classes, class 1 is predicted when its probability is >= 0.50
+    """
+    n_classes = class_probs.shape[-1]
+    return n_classes - 1 - np.argmax(class_probs[..., ::-1], axis=-1)
 
 
 def Impurity_plot():
@@ -107,14 +172,10 @@ def Impurity_plot():
         plt.ylim([0, 1.1])
         plt.show()
 
-    measure = np.empty_like(X)
-    for i in range(len(X)):
-        measure[i] = Gini_impurity([X[i], Y[i]])
+    measure = Gini_impurity(np.column_stack((X, Y)))
     plot(measure, X, index_name="Gini Impurity", title="Gini Impurity Plot (highest = 0.5 for two classes)", y_ref=0.5)
 
-    measure = np.empty_like(X)
-    for i in range(len(X)):
-        measure[i] = Entropy([X[i], Y[i]])
+    measure = Entropy(np.column_stack((X, Y)))
     plot(measure, X, index_name="Entropy",       title="Entropy Plot (highest = 1.0 for two classes)",       y_ref=1.0)
 
 
@@ -125,48 +186,343 @@ def demo_metrics():
     Impurity_plot()
 
 
-class decision_tree_classifier_node(object):
-    def __init__(self, curr_depth=None, curr_impurity=None, curr_sample_size=None, curr_y_distribution={}, best_split_feature_i=None, best_x_cutoff_value=None, y_class0_value=0, y_class1_value=1):
-        self.curr_depth = curr_depth
-        self.curr_impurity = curr_impurity
-        self.curr_sample_size = curr_sample_size
-        self.curr_y_distribution = curr_y_distribution
+class _feature_thread_pool(object):
+    """
+    A context manager yielding a ThreadPoolExecutor of effective_n_jobs(n_jobs) threads, or None if that is 1.
+    The split kernels (NumPy sorts, cumulative sums, bincounts) release the GIL.
+    """
 
-        y_class0_n = curr_y_distribution.get(y_class0_value)
-        y_class1_n = curr_y_distribution.get(y_class1_value)
-        y_classes_count = len(curr_y_distribution)
+    def __init__(self, n_jobs=1):
+        self.n_threads = effective_n_jobs(n_jobs)
+        self.thread_pool = None
 
-        if y_classes_count == 0:
-            self.y_dominant_class = None
-            self.y_class1_prob = None
-
-        if y_classes_count == 1:
-            self.y_dominant_class = list(curr_y_distribution.keys())[0]
-            if self.y_dominant_class == y_class0_value:
-                self.y_class1_prob = 0
-            elif self.y_dominant_class == y_class1_value:
-                self.y_class1_prob = 1
+    def __enter__(self):
+        if self.n_threads > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            self.thread_pool = ThreadPoolExecutor(max_workers=self.n_threads)
+        return self.thread_pool
+
+    def __exit__(self, *exc_info):
+        if self.thread_pool is not None:
+            self.thread_pool.shutdown()
+            self.thread_pool = None
+        return False
+
+
+class decision_tree_arrays(object):
+    """
+    A fitted tree as parallel arrays, node i at position i (the root is node 0):
+        - feature[i], threshold[i]: a row goes to left[i] if x[feature[i]] <= threshold[i], else to right[i]
+        - left[i], right[i]: the children of node i; both are -1 if node i is a leaf
+        - value[i]: what node i predicts; (n_nodes,) for a regressor, (n_nodes, n_classes) probabilities for a classifier
+        - category_bitset_i[i]: for a categorical split, the row of category_bitsets holding the categories going left
+          (threshold[i] is then unused); -1 for a numeric split
+
+    apply() routes a whole batch of rows level by level; compile() generates Python code for scoring a single row.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, category_bitset_i=None, category_bitsets=None):
+        self.feature = np.asarray(feature, dtype=np.intp)
+        self.threshold = np.asarray(threshold, dtype=float)
+        self.left = np.asarray(left, dtype=np.intp)
+        self.right = np.asarray(right, dtype=np.intp)
+        self.value = np.asarray(value, dtype=float)
+        self.category_bitset_i = np.full(shape=self.feature.shape, fill_value=-1, dtype=np.intp) if category_bitset_i is None else np.asarray(category_bitset_i, dtype=np.intp)
+        self.category_bitsets = np.zeros(shape=(0, 0), dtype=np.uint8) if category_bitsets is None else np.asarray(category_bitsets, dtype=np.uint8)
+        self.compiled_functions = {} # the functions generated by compile(), cached by the fitted estimators
+
+    @classmethod
+    def from_nodes(cls, root_node, split_of, value_of):
+        """
+        split_of(node): returns (feature_i, x_cutoff_value[, category_bitset or None]), or None if the node is a leaf
+        value_of(node): returns what the node predicts
+        """
+        feature, threshold, left, right, value, category_bitset_i, category_bitsets = [], [], [], [], [], [], []
+        stack = [(root_node, -1, False)] # pre-order traversal with an explicit stack
+        while stack:
+            node, parent_i, is_left_child = stack.pop()
+            node_i = len(feature)
+            if parent_i >= 0:
+                (left if is_left_child else right)[parent_i] = node_i
+            split = split_of(node)
+            feature.append(split[0] if split is not None else -1)
+            threshold.append(split[1] if split is not None else np.nan)
+            left.append(-1)
+            right.append(-1)
+            value.append(value_of(node))
+            category_bitset = split[2] if split is not None and len(split) > 2 else None
+            category_bitset_i.append(len(category_bitsets) if category_bitset is not None else -1)
+            if category_bitset is not None:
+                category_bitsets.append(category_bitset)
+            if split is not None:
+                stack.append((node.right, node_i, False))
+                stack.append((node.left,  node_i, True))
+        return cls(feature=feature, threshold=threshold, left=left, right=right, value=value, category_bitset_i=category_bitset_i,
+                   category_bitsets=np.array(category_bitsets, dtype=np.uint8) if category_bitsets else None)
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    def apply(self, X):
+        """
+        returns the index of the leaf node that each row of X ends up in (X may be a scipy.sparse matrix)
+        """
+        if type(X) in [pd.DataFrame, pd.Series]:
+            X = X.to_numpy()
+        elif _is_sparse(X):
+            X = X.tocsr()
+        return self._route(X, node_indices=np.zeros(shape=(X.shape[0],), dtype=np.intp), row_indices=np.arange(X.shape[0]))
+
+    def _route(self, X, node_indices, row_indices):
+        """
+        advances node_indices[k], the current node of the row row_indices[k] of X, down to a leaf (in place), one level per pass
+        """
+        active_pairs = np.arange(len(node_indices))
+        while active_pairs.size:
+            active_nodes = node_indices[active_pairs]
+            not_yet_at_leaf = self.left[active_nodes] != -1
+            active_pairs, active_nodes = active_pairs[not_yet_at_leaf], active_nodes[not_yet_at_leaf]
+            x = _values_at(X, row_indices[active_pairs], self.feature[active_nodes])
+            go_left = x <= self.threshold[active_nodes]
+            if len(self.category_bitsets):
+                bitset_i = self.category_bitset_i[active_nodes]
+                is_categorical = bitset_i >= 0
+                go_left[is_categorical] = _bitset_contains(self.category_bitsets, bitset_i[is_categorical], x[is_categorical])
+            node_indices[active_pairs] = np.where(go_left, self.left[active_nodes], self.right[active_nodes])
+        return node_indices
+
+    @property
+    def max_depth(self):
+        node_depths = np.zeros(shape=(self.n_nodes,), dtype=np.intp)
+        for node_i in range(self.n_nodes): # children always come after their parent
+            if self.left[node_i] != -1:
+                node_depths[[self.left[node_i], self.right[node_i]]] = node_depths[node_i] + 1
+        return int(node_depths.max())
+
+    def _categories_going_left(self, node_i):
+        """
+        the category codes going left at node_i, or None if its split is numeric
+        """
+        if self.category_bitset_i[node_i] < 0:
+            return None
+        return _categories_in_bitset(self.category_bitsets[self.category_bitset_i[node_i]]).tolist()
+
+    def to_python_source(self, function_name='predict_row'):
+        """
+        the source of f(x) of one row x (a list, a tuple, or a 1-D array), nested if/else returning leaf_outputs[the leaf of x]
+        """
+        lines = [f"def {function_name}(x):"]
+        stack = [(0, 1)] # (node, indent), or (a line of code, indent)
+        while stack:
+            node_i, indent = stack.pop()
+            if isinstance(node_i, str):
+                lines.append('    ' * indent + node_i)
+            elif self.left[node_i] == -1:
+                lines.append('    ' * indent + f"return leaf_outputs[{node_i}]")
+            elif self.category_bitset_i[node_i] >= 0: # a set literal, which Python compiles into a frozenset constant
+                lines.append('    ' * indent + f"if x[{self.feature[node_i]}] in {set(self._categories_going_left(node_i))!r}:")
+                stack.extend([(self.right[node_i], indent + 1), ('else:', indent), (self.left[node_i], indent + 1)])
             else:
-                raise ValueError(f"unexpected y_dominant_class (should be either {y_class0_value} or {y_class1_value})")
+                lines.append('    ' * indent + f"if x[{self.feature[node_i]}] <= {float(self.threshold[node_i])!r}:")
+                stack.extend([(self.right[node_i], indent + 1), ('else:', indent), (self.left[node_i], indent + 1)])
+        return '\n'.join(lines) + '\n'
 
-        if y_classes_count == 2:
-            # must be {y_class0_value: sample_size_associated_with_y=y_class0_value, y_class1_value: sample_size_associated_with_y=y_class1_value}
-            self.y_class1_prob = y_class1_n / (y_class1_n + y_class0_n)
-            if self.y_class1_prob >= 0.50:
-                self.y_dominant_class = y_class1_value
+    def to_numpy_source(self, function_name='predict_batch'):
+        """
+        the source of f(X) of a 2-D array X, a bottom-up cascade of np.where over the split nodes returning leaf_outputs[the leaves of the rows];
+        every split is evaluated on every row, so that it suits small trees
+        """
+        lines = [f"def {function_name}(X):"]
+        def leaf_of(node_i):
+            return f"leaf_{node_i}" if self.left[node_i] != -1 else str(node_i)
+        for node_i in range(self.n_nodes - 1, -1, -1): # children always come after their parent
+            if self.left[node_i] != -1 and self.category_bitset_i[node_i] >= 0:
+                lines.append(f"    leaf_{node_i} = np.where(np.isin(X[:, {self.feature[node_i]}], {self._categories_going_left(node_i)!r}), {leaf_of(self.left[node_i])}, {leaf_of(self.right[node_i])})")
+            elif self.left[node_i] != -1:
+                lines.append(f"    leaf_{node_i} = np.where(X[:, {self.feature[node_i]}] <= {float(self.threshold[node_i])!r}, {leaf_of(self.left[node_i])}, {leaf_of(self.right[node_i])})")
+        if self.left[0] == -1:
+            lines.append("    leaf_0 = np.zeros(shape=(X.shape[0],), dtype=np.intp)")
+        lines.append("    return leaf_outputs[leaf_0]")
+        return '\n'.join(lines) + '\n'
+
+    def compile(self, leaf_outputs=None, batch=False):
+        """
+        Generates and compiles a function specialized to this tree (see to_python_source() and to_numpy_source()).
+        leaf_outputs: what the function returns for each node, e.g., self.value or the predicted classes; None = the leaf index
+        batch: False for f(x) of one row, with nested if/else; True for f(X) of a 2-D array, with a cascade of np.where
+        """
+        if leaf_outputs is None:
+            leaf_outputs = np.arange(self.n_nodes)
+        leaf_outputs = np.array(leaf_outputs)
+        leaf_outputs.flags.writeable = False # the same output objects are returned on every call
+        if batch:
+            source, function_name, namespace = self.to_numpy_source(), 'predict_batch', {'np': np, 'leaf_outputs': leaf_outputs}
+        else:
+            if self.max_depth > 90:
+                raise ValueError('the tree is too deep to be compiled into nested if/else (Python allows at most 100 levels of indentation); use batch=True or predict()')
+            # plain Python scalars (or read-only rows) are returned, which is faster than indexing a NumPy array
+            source, function_name, namespace = self.to_python_source(), 'predict_row', {'leaf_outputs': leaf_outputs.tolist() if leaf_outputs.ndim == 1 else list(leaf_outputs)}
+        exec(compile(source, filename=f"<compiled decision tree of {self.n_nodes} nodes>", mode='exec'), namespace)
+        return namespace[function_name]
+
+
+class decision_forest_arrays(decision_tree_arrays):
+    """
+    The flat arrays of many fitted trees, concatenated: tree t starts at node roots[t], with its children indices offset accordingly.
+    apply() advances every (row, tree) pair together, level by level, rather than tree by tree.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, roots, category_bitset_i=None, category_bitsets=None):
+        super().__init__(feature=feature, threshold=threshold, left=left, right=right, value=value, category_bitset_i=category_bitset_i, category_bitsets=category_bitsets)
+        self.roots = np.asarray(roots, dtype=np.intp)
+
+    @classmethod
+    def from_trees(cls, trees):
+        """
+        trees: a list of decision_tree_arrays, e.g., the tree_ of each fitted tree
+        """
+        roots = np.cumsum([0] + [tree.n_nodes for tree in trees[:-1]])
+        def offset_children(children, root):
+            return np.where(children != -1, children + root, -1)
+        # the category bitsets of all the trees, stacked and zero-padded to the widest
+        bitset_offsets = np.cumsum([0] + [len(tree.category_bitsets) for tree in trees[:-1]])
+        n_bitset_bytes = max([tree.category_bitsets.shape[1] for tree in trees], default=0)
+        category_bitsets = np.zeros(shape=(sum(len(tree.category_bitsets) for tree in trees), n_bitset_bytes), dtype=np.uint8)
+        for tree, bitset_offset in zip(trees, bitset_offsets):
+            category_bitsets[bitset_offset:bitset_offset + len(tree.category_bitsets), :tree.category_bitsets.shape[1]] = tree.category_bitsets
+        return cls(feature=np.concatenate([tree.feature for tree in trees]), threshold=np.concatenate([tree.threshold for tree in trees]),
+                   left=np.concatenate([offset_children(tree.left, root) for tree, root in zip(trees, roots)]),
+                   right=np.concatenate([offset_children(tree.right, root) for tree, root in zip(trees, roots)]),
+                   value=np.concatenate([tree.value for tree in trees]), roots=roots,
+                   category_bitset_i=np.concatenate([offset_children(tree.category_bitset_i, bitset_offset) for tree, bitset_offset in zip(trees, bitset_offsets)]),
+                   category_bitsets=category_bitsets)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def apply(self, X, max_pairs_per_chunk=2**20):
+        """
+        returns the leaf node (in these arrays) of each row in each tree, of shape (n_rows, n_trees);
+        the rows are processed in chunks of at most max_pairs_per_chunk (row, tree) pairs
+        """
+        if type(X) in [pd.DataFrame, pd.Series]:
+            X = X.to_numpy()
+        elif _is_sparse(X):
+            X = X.tocsr()
+        n_rows = X.shape[0]
+        node_indices = np.empty(shape=(n_rows, self.n_trees), dtype=np.intp)
+        chunk_size = max(max_pairs_per_chunk // max(self.n_trees, 1), 1)
+        for chunk_start in range(0, n_rows, chunk_size):
+            chunk_rows = np.arange(chunk_start, min(chunk_start + chunk_size, n_rows))
+            node_indices[chunk_rows] = self._route(X, node_indices=np.tile(self.roots, len(chunk_rows)), row_indices=np.repeat(chunk_rows, self.n_trees)).reshape(len(chunk_rows), self.n_trees)
+        return node_indices
+
+
+class additive_tree_model(object):
+    """
+    A boosted model, F(x) = intercept + sum over the trees t of weight[t] * (the leaf value of x in tree t), packed into arrays
+    so that a batch of rows is scored at once rather than learner by learner:
+        - if every tree is a stump (or a single leaf), as in AdaBoost: feature, threshold, left_value, right_value per stump
+        - otherwise: a decision_forest_arrays of all the trees
+
+    trees: a list of decision_tree_arrays with one value per node (shape (n_nodes,))
+    tree_weights: the weight of each tree
+    tree_outputs: the output (e.g., the class of a raw score) that each tree adds to; None for a single output
+    intercept: the starting point of F, a scalar or one value per output
+    """
+
+    def __init__(self, trees, tree_weights, tree_outputs=None, intercept=0.0):
+        self.intercept = np.asarray(intercept, dtype=float)
+        n_outputs = 1 if tree_outputs is None else max(self.intercept.size, max(tree_outputs, default=0) + 1)
+        self.n_outputs = n_outputs if tree_outputs is not None else None
+        # the weights as a (n_trees, n_outputs) matrix, so that summing into several outputs is one matrix product
+        self.weights = np.zeros(shape=(len(trees), n_outputs))
+        self.weights[np.arange(len(trees)), np.zeros(shape=(len(trees),), dtype=np.intp) if tree_outputs is None else np.asarray(tree_outputs, dtype=np.intp)] = tree_weights
+        self.is_stumps = all(tree.n_nodes <= 3 and len(tree.category_bitsets) == 0 for tree in trees)
+        if self.is_stumps:
+            is_leaf = [tree.left[0] == -1 for tree in trees]
+            self.feature = np.array([0 if leaf else tree.feature[0] for tree, leaf in zip(trees, is_leaf)], dtype=np.intp)
+            self.threshold = np.array([np.inf if leaf else tree.threshold[0] for tree, leaf in zip(trees, is_leaf)])
+            self.left_value = np.array([tree.value[0] if leaf else tree.value[tree.left[0]] for tree, leaf in zip(trees, is_leaf)], dtype=float)
+            self.right_value = np.array([tree.value[0] if leaf else tree.value[tree.right[0]] for tree, leaf in zip(trees, is_leaf)], dtype=float)
+        else:
+            self.forest_ = decision_forest_arrays.from_trees(trees)
+
+    @property
+    def n_trees(self):
+        return len(self.weights)
+
+    def decision_function(self, X, max_pairs_per_chunk=2**20):
+        """
+        F(X): shape (n_rows,) for a single output, or (n_rows, n_outputs); in chunks of at most max_pairs_per_chunk (row, tree) pairs
+        """
+        if type(X) in [pd.DataFrame, pd.Series]:
+            X = X.to_numpy()
+        n_rows = X.shape[0]
+        F = np.empty(shape=(n_rows, self.weights.shape[1]))
+        chunk_size = max(max_pairs_per_chunk // max(self.n_trees, 1), 1)
+        for chunk_start in range(0, n_rows, chunk_size):
+            X_chunk = X[chunk_start:chunk_start + chunk_size]
+            if self.is_stumps:
+                leaf_values = np.where(X_chunk[:, self.feature] <= self.threshold, self.left_value, self.right_value)
             else:
-                self.y_dominant_class = y_class0_value
+                leaf_values = self.forest_.value[self.forest_.apply(X_chunk)]
+            F[chunk_start:chunk_start + chunk_size] = leaf_values @ self.weights
+        F += self.intercept
+        return F[:, 0] if self.n_outputs is None else F
+
 
-        if y_classes_count > 2:
-            raise ValueError('more than 2 classes in y detected')
+class decision_tree_classifier_node(object):
+    def __init__(self, curr_depth=None, curr_impurity=None, curr_sample_size=None, curr_y_class_counts=None, best_split_feature_i=None, best_x_cutoff_value=None, y_classes=(0, 1)):
+        """
+        curr_y_class_counts: the number of rows of each class in this node, aligned with y_classes (the classes_ of the tree)
+
+        A categorical split has best_x_cutoff_value = NaN, and best_category_bitset holds the categories going left.
+        """
+        self.curr_depth = curr_depth
+        self.curr_impurity = curr_impurity
+        self.curr_sample_size = curr_sample_size
+        self.y_classes = y_classes
+        self.curr_y_class_counts = curr_y_class_counts
+
+        if curr_y_class_counts is None or curr_y_class_counts.sum() == 0:
+            self.y_class_probs = None
+            self.y_dominant_class = None
+        else:
+            self.y_class_probs = curr_y_class_counts / curr_y_class_counts.sum()
+            self.y_dominant_class = y_classes[_dominant_class_codes(self.y_class_probs)]
 
         self.best_split_feature_i = best_split_feature_i
         self.best_x_cutoff_value = best_x_cutoff_value
+        self.best_category_bitset = None
         self.left = None
         self.right = None
-    
+
+    @property
+    def curr_y_distribution(self):
+        """
+        {class: the number of rows}, over the classes present in this node
+        """
+        from sortedcontainers import SortedDict
+        if self.curr_y_class_counts is None:
+            return SortedDict()
+        return SortedDict((self.y_classes[code], int(y_count)) for code, y_count in enumerate(self.curr_y_class_counts) if y_count > 0)
+
+    @property
+    def y_class1_prob(self):
+        """
+        with two classes, the probability of the second one
+        """
+        return None if self.y_class_probs is None else self.y_class_probs[1]
+
     def to_dict(self):
-        return {'curr_depth': self.curr_depth, 'curr_impurity': f"{self.curr_impurity:.3f}" if self.curr_impurity is not None else None, 'curr_sample_size': self.curr_sample_size, 'curr_y_distribution': self.curr_y_distribution, 'curr_dominant_y_class': self.y_dominant_class, 'curr_y_class1_prob': f"{self.y_class1_prob:.3f}" if self.y_class1_prob is not None else None, 'best_split_feature_i': self.best_split_feature_i if self.best_x_cutoff_value is not None else None, 'best_x_cutoff_value': f"{self.best_x_cutoff_value:.3f}" if self.best_x_cutoff_value is not None else None}
+        class_probs = {'curr_y_class1_prob': f"{self.y_class1_prob:.3f}" if self.y_class1_prob is not None else None} if len(self.y_classes) == 2 else \
+                      {'curr_y_class_probs': [f"{y_class_prob:.3f}" for y_class_prob in self.y_class_probs] if self.y_class_probs is not None else None}
+        split = {'best_x_categories': _categories_in_bitset(self.best_category_bitset).tolist()} if self.best_category_bitset is not None else \
+                {'best_x_cutoff_value': f"{self.best_x_cutoff_value:.3f}" if self.best_x_cutoff_value is not None else None}
+        return {'curr_depth': self.curr_depth, 'curr_impurity': f"{self.curr_impurity:.3f}" if self.curr_impurity is not None else None, 'curr_sample_size': self.curr_sample_size, 'curr_y_distribution': self.curr_y_distribution, 'curr_dominant_y_class': self.y_dominant_class, **class_probs, 'best_split_feature_i': self.best_split_feature_i if self.best_x_cutoff_value is not None else None, **split}
 
 
 class decision_tree_classifier_from_scratch(classifier):
@@ -176,12 +532,68 @@ class decision_tree_classifier_from_scratch(classifier):
     (2) we may be asking too trivial questions at the greater depths (e.g., > 5 or 6-depth)
     """
 
-    def __init__(self, max_depth = 10, impurity_measure='entropy', features_indices_actually_used='all', annotation=None, verbose=False):
+    def __init__(self, max_depth = 10, impurity_measure='entropy', features_indices_actually_used='all', splitter='best', max_bins=255, grow_policy='depth_first',
+                 max_leaf_nodes=None, min_samples_split=2, min_samples_leaf=1, min_impurity_decrease=0.0, n_jobs=1, random_state=None, categorical_features=None, annotation=None, verbose=False):
         """
         "features_indices_actually_used": limits the analysis on only these feature indices if not 'all'
             for example, if there are 30 features, then "features_indices_actually_used" = [2, 15] means that only the 3th and 16th features will be used for analysis
+
+        splitter: how the cutoffs are searched
+            - 'best': every cutoff between two distinct x values (a sorted sweep per feature per node)
+            - 'hist': only the edges of at most max_bins quantile bins of each feature (X is binned once into uint8 codes);
+                      a feature costs O(max_bins) from per-bin class-count histograms
+            - 'random': extremely randomized trees; one cutoff per feature, drawn uniformly between the node's min and max x,
+                        of which the best is taken; no sorting is needed. The draws depend on grow_policy.
+
+        grow_policy: the order in which the nodes are grown
+            - 'depth_first': one node at a time, from an explicit stack
+            - 'level_wise': all the nodes of a depth at a time, each feature being swept (or binned) once per level;
+                            the same tree as depth-first (up to rounding in exact ties, with non-integer sample weights)
+            - 'best_first': the open node with the largest impurity decrease is split next, up to max_leaf_nodes leaves;
+                            the same tree as depth-first if max_leaf_nodes is None
+
+        The stopping rules (a node becomes a leaf if any one of them applies):
+            - max_depth: the maximum depth of the tree (None = unlimited)
+            - max_leaf_nodes: the maximum number of leaves, only with grow_policy='best_first' (None = unlimited)
+            - min_samples_split: the minimum number of samples in a node for it to be split
+            - min_samples_leaf: the minimum number of samples in each child of a split
+            - min_impurity_decrease: the minimum of (node weight / total weight) * (node impurity - weighted children impurity)
+
+        n_jobs: the number of threads scoring the features of a node (-1 = all the CPUs); the tree does not depend on it
+
+        random_state: only used with splitter='random'; an int, a np.random.SeedSequence, or a np.random.Generator
+
+        categorical_features: the features (column indices, column names of a pd.DataFrame X, or a boolean mask) holding
+            category codes 0, 1, 2, ... (e.g., from pd.factorize), split natively on subsets of categories (see _categorical.py);
+            only with splitter='best' or 'random', and a dense X
         """
         super().__init__()
+        self.n_jobs = n_jobs
+        self.thread_pool = None
+        self.random_state = random_state
+        self.categorical_features = categorical_features
+        if splitter not in ['best', 'hist', 'random']:
+            raise ValueError('splitter must be best, hist, or random')
+        self.splitter = splitter
+        if grow_policy not in ['depth_first', 'level_wise', 'best_first']:
+            raise ValueError('grow_policy must be depth_first, level_wise, or best_first')
+        self.grow_policy = grow_policy
+        if max_leaf_nodes is not None:
+            if grow_policy != 'best_first':
+                raise ValueError("max_leaf_nodes requires grow_policy='best_first'")
+            if max_leaf_nodes < 2:
+                raise ValueError('max_leaf_nodes must be at least 2')
+        if min_samples_split < 2:
+            raise ValueError('min_samples_split must be at least 2')
+        if min_samples_leaf < 1:
+            raise ValueError('min_samples_leaf must be at least 1')
+        if min_impurity_decrease < 0:
+            raise ValueError('min_impurity_decrease must be non-negative')
+        self.max_leaf_nodes = max_leaf_nodes
+        self.min_samples_split = min_samples_split
+        self.min_samples_leaf = min_samples_leaf
+        self.min_impurity_decrease = min_impurity_decrease
+        self.max_bins = max_bins
         self.features_indices_actually_used = features_indices_actually_used  # limits the analysis on only these feature indices
         self.max_depth = max_depth
         self.verbose=verbose
@@ -195,10 +607,15 @@ class decision_tree_classifier_from_scratch(classifier):
             self.impurity_func = Gini_impurity
         self.annotation = annotation
         # default values
+        self.classes_ = np.array([0, 1])
         self.y_class0_value = 0
         self.y_class1_value = 1
 
     def find_best_split_in_one_specific_feature(self, x, y_true, sample_weight=None):
+        """
+        a sorted sweep: x is argsorted once, and the (weighted) class sums on either side of every cutoff
+        are read off cumulative sums along that order, i.e., O(n log n) rather than O(n^2) per feature
+        """
 
         if type(x) in [pd.DataFrame, pd.Series]:
             x = x.to_numpy()
@@ -209,69 +626,61 @@ class decision_tree_classifier_from_scratch(classifier):
         if sample_weight is None:
             sample_weight = np.ones(shape=(len(y_true),))
 
-        best_impurity = float('Inf')
-
-        from sortedcontainers import SortedSet
-
-        y_classes_values = list(SortedSet(y_true))
-        if len(y_classes_values) != 2:
-            raise ValueError("y must be binary")
-
-        from collections import Counter
-
-        #y_counts = Counter(y_true)
-        #before_split_impurity = self.impurity_func([ y_counts[y_classes_values[0]], y_counts[y_classes_values[1]] ])
-        before_split_impurity = impurity_measure_with_sample_weight(y_class0_value=self.y_class0_value, y_class1_value=self.y_class1_value, y=y_true, sample_weight=sample_weight, impurity_func=self.impurity_func)
-
-        x_values_array = list(SortedSet(x))
-        x_values_array_length = len(x_values_array)
-
-        for value_i, this_x_value in enumerate(x_values_array):  # iterating through each value in this feature
-
-            if value_i < (x_values_array_length-1):
-                this_x_cutoff_value = (this_x_value + x_values_array[value_i+1]) / 2
-            else:
-                this_x_cutoff_value = this_x_value
-
-            # let's say we split y on this value of x
-            y_pred_left_node_list = y_true[x <= this_x_cutoff_value]
-            y_pred_left_node_counts = Counter(y_pred_left_node_list)
-            left_node_y_true_array  = [ y_pred_left_node_counts[y_classes_values[0]],  y_pred_left_node_counts[ y_classes_values[1]] ]
-            #left_node_impurity  = self.impurity_func(left_node_y_true_array)
-            left_node_impurity = impurity_measure_with_sample_weight(y_class0_value=self.y_class0_value, y_class1_value=self.y_class1_value, y=y_pred_left_node_list, sample_weight=sample_weight[x <= this_x_cutoff_value], impurity_func=self.impurity_func)
-            left_node_n = sum(y_pred_left_node_counts.values())
-            
-            y_pred_right_node_list = y_true[x > this_x_cutoff_value]
-            y_pred_right_node_counts = Counter(y_pred_right_node_list)
-            right_node_y_true_array = [ y_pred_right_node_counts[y_classes_values[0]], y_pred_right_node_counts[y_classes_values[1]] ]
-            #right_node_impurity = self.impurity_func(right_node_y_true_array)
-            right_node_impurity = impurity_measure_with_sample_weight(y_class0_value=y_classes_values[0], y_class1_value=y_classes_values[1], y=y_pred_right_node_list, sample_weight=sample_weight[x > this_x_cutoff_value], impurity_func=self.impurity_func)
-            right_node_n = sum(y_pred_right_node_counts.values())
-
-            this_y_true_split_array = [left_node_y_true_array, right_node_y_true_array]
-
-            total_n = left_node_n + right_node_n
-            if total_n != len(y_true):
-                raise ValueError("internal inconsistency")
-
-            this_weighted_impurity = (left_node_impurity * left_node_n / total_n) + (right_node_impurity * right_node_n / total_n)
-            this_information_gain = before_split_impurity - this_weighted_impurity
-
-            if self.verbose:
-                print(f"#{value_i:3d}: x_cutoff_value = {this_x_cutoff_value: .3f}, impurity = {this_weighted_impurity:.3f}, information_gain = {this_information_gain:.3f}, split_y_true_array = {this_y_true_split_array}")
+        y_encoded = _encode_against_classes(y_true, self.classes_) # fit() encodes y once instead
+        return self._find_best_split_in_one_feature(x=x, class_counts=_one_hot(y_encoded, len(self.classes_)), class_weights=_one_hot(y_encoded, len(self.classes_), weights=sample_weight))
 
-            if this_weighted_impurity < best_impurity:
-                best_impurity = this_weighted_impurity
-                best_information_gain = this_information_gain
-                best_x_cutoff_value = this_x_cutoff_value
-                best_y_true_split_array = this_y_true_split_array
+    def _find_best_split_in_one_feature(self, x, class_counts, class_weights):
+        """
+        class_counts, class_weights: _one_hot() of the encoded labels of the rows, without and with their sample weights
+        """
+        before_split_impurity = _impurity_of_class_sums(class_weights.sum(axis=0)[np.newaxis], impurity_measure=self.impurity_measure)[0]
+
+        sorted_indices = np.argsort(x, kind='mergesort')
+        x_sorted = x[sorted_indices]
+        class_counts_sorted = class_counts[sorted_indices]
+        class_weights_sorted = class_weights[sorted_indices]
+
+        # the left node of a cutoff holds everything up to (and including) the last occurrence of a distinct x value
+        last_positions = np.flatnonzero(np.append(x_sorted[1:] != x_sorted[:-1], True))
+        x_values_array = x_sorted[last_positions]
+        x_cutoff_values = np.append((x_values_array[:-1] + x_values_array[1:]) / 2, x_values_array[-1:])
+
+        def cumulative_sums(values, from_the_right=False):
+            # the sums of every class left (prefix sums) or right (suffix sums) of every cutoff
+            if from_the_right:
+                return np.append(np.cumsum(values[::-1], axis=0)[::-1], np.zeros(shape=(1, values.shape[1])), axis=0)[last_positions+1]
+            return np.cumsum(values, axis=0)[last_positions]
+
+        left_node_n  = last_positions + 1
+        right_node_n = len(x) - left_node_n
+        left_node_n_by_class  = cumulative_sums(class_counts_sorted).astype(np.intp)
+        right_node_n_by_class = cumulative_sums(class_counts_sorted, from_the_right=True).astype(np.intp)
+        left_node_class_sums  = cumulative_sums(class_weights_sorted)
+        right_node_class_sums = cumulative_sums(class_weights_sorted, from_the_right=True)
+
+        left_node_impurity  = _impurity_of_class_sums(left_node_class_sums,  impurity_measure=self.impurity_measure)
+        right_node_impurity = _impurity_of_class_sums(right_node_class_sums, impurity_measure=self.impurity_measure)
+
+        total_n = len(x)
+        weighted_impurity = (left_node_impurity * left_node_n / total_n) + (right_node_impurity * right_node_n / total_n)
+        # a cutoff leaving fewer than min_samples_leaf rows on one side is not a candidate, except the last one (no split)
+        weighted_impurity = np.where(((left_node_n >= self.min_samples_leaf) & (right_node_n >= self.min_samples_leaf)) | (right_node_n == 0), weighted_impurity, np.inf)
+        information_gain = before_split_impurity - weighted_impurity
+
+        def y_true_split_array(value_i):
+            return [left_node_n_by_class[value_i].tolist(), right_node_n_by_class[value_i].tolist()]
 
-            if best_impurity == 0: # a perfect split was found
-                break
+        if self.verbose:
+            for value_i in range(len(x_cutoff_values)):
+                print(f"#{value_i:3d}: x_cutoff_value = {x_cutoff_values[value_i]: .3f}, impurity = {weighted_impurity[value_i]:.3f}, information_gain = {information_gain[value_i]:.3f}, split_y_true_array = {y_true_split_array(value_i)}")
 
-        return best_x_cutoff_value, best_impurity, best_information_gain, best_y_true_split_array
+        best_value_i = np.argmin(weighted_impurity) # the first one in the case of ties, as in a left-to-right scan
+        return x_cutoff_values[best_value_i], weighted_impurity[best_value_i], information_gain[best_value_i], y_true_split_array(best_value_i)
 
-    def find_best_split_across_all_features(self, X, y_true, sample_weight=None):
+    def find_best_split_across_all_features(self, X, y_true, sample_weight=None, sample_indices=None):
+        """
+        sample_indices: if not None, only these rows of X, y_true, and sample_weight are considered (X is not copied)
+        """
 
         if type(X) in [pd.DataFrame, pd.Series]:
             X = X.to_numpy()
@@ -282,9 +691,18 @@ class decision_tree_classifier_from_scratch(classifier):
         if sample_weight is None:
             sample_weight = np.ones(shape=(len(y_true),))
 
+        if sample_indices is not None:
+            y_true, sample_weight = y_true[sample_indices], sample_weight[sample_indices]
+
+        y_encoded = _encode_against_classes(y_true, self.classes_)
+        return self._find_best_split_across_all_features(X=X, class_counts=_one_hot(y_encoded, len(self.classes_)), class_weights=_one_hot(y_encoded, len(self.classes_), weights=sample_weight), sample_indices=sample_indices)
+
+    def _find_best_split_across_all_features(self, X, class_counts, class_weights, sample_indices=None):
+        """
+        class_counts, class_weights: as in _find_best_split_in_one_feature(), already restricted to sample_indices
+        """
         best_impurity = float('Inf')
 
-        n_samples = X.shape[0]        
         n_features = X.shape[1]
 
         if self.features_indices_actually_used == 'all':
@@ -292,8 +710,13 @@ class decision_tree_classifier_from_scratch(classifier):
         else:
             features_indices_actually_used = self.features_indices_actually_used
 
-        for this_feature_i in features_indices_actually_used:
-            x_cutoff_value, impurity, information_gain, y_true_split_array = self.find_best_split_in_one_specific_feature(x=X[:,this_feature_i], y_true=y_true, sample_weight=sample_weight)
+        def find_best_split_in_this_feature(this_feature_i):
+            x = X[:,this_feature_i] if sample_indices is None else X[sample_indices, this_feature_i]
+            return self._find_best_split_in_one_feature(x=x, class_counts=class_counts, class_weights=class_weights)
+
+        # the features may be scored in parallel, but are compared in feature order, so that ties break as in serial mode
+        map_over_features = map if self.thread_pool is None else self.thread_pool.map
+        for this_feature_i, (x_cutoff_value, impurity, information_gain, y_true_split_array) in zip(features_indices_actually_used, map_over_features(find_best_split_in_this_feature, features_indices_actually_used)):
             if self.verbose:
                 print(f"feature # {this_feature_i: 2d}, x_cutoff_value = {x_cutoff_value: .3f}, impurity = {impurity:.3f}, information_gain = {information_gain:.3f}, y_true_split_array = {y_true_split_array}")
             if impurity == 0:  # a perfect split was found
@@ -306,66 +729,527 @@ class decision_tree_classifier_from_scratch(classifier):
 
         return best_split_feature_i, best_x_cutoff_value, best_impurity, best_information_gain, best_y_true_split_array
 
-    def fit(self, X, y, depth=0, sample_weight=None):
+    def fit(self, X, y, sample_weight=None, X_binned=None, bin_mapper=None, classes=None):
+        """
+        y: two or more classes, all in a single tree (no one-vs-rest)
 
-        y_true = y
-        
-        # init
-        if depth == 0:
-            from sortedcontainers import SortedSet
-            y_classes_values = list(SortedSet(y_true))
-            if len(y_classes_values) != 2:
-                raise ValueError("y must be binary")
-            else:
-                self.y_class0_value = y_classes_values[0]
-                self.y_class1_value = y_classes_values[1]
+        X_binned, bin_mapper: only used when splitter='hist'; X binned once by a histogram_bin_mapper (or a row subset of it),
+        e.g., shared by the trees of an ensemble, in which case X may be None.
 
-        if sample_weight is None:
-            sample_weight = np.ones(shape=(len(y_true),))
+        classes: the sorted class labels to encode y against, e.g., those of a whole forest, even if some are absent from y;
+        None = the classes found in y
 
-        from collections import Counter
-        
-        if self.verbose:
-            print(f"depth={depth}")
+        X may also be a scipy.sparse matrix (splitter='best' or 'random'), converted to CSR once;
+        the best splitter then only visits the nonzero entries of a node's rows.
+        """
 
+        if self.categorical_features is not None and self.splitter == 'hist':
+            raise ValueError("categorical_features requires splitter='best' or 'random'")
+        columns = X.columns if type(X) == pd.DataFrame else None
         if type(X) in [pd.DataFrame, pd.Series]:
             X = X.to_numpy()
+        elif _is_sparse(X):
+            if self.splitter == 'hist':
+                raise ValueError("sparse X requires splitter='best' or 'random'")
+            if self.categorical_features is not None:
+                raise ValueError('categorical_features requires a dense X')
+            X = _to_csr(X)
+
+        self.categorical_features_, self.n_categories_ = _check_categorical_features(self.categorical_features, X, n_features=(X if X is not None else X_binned).shape[1], columns=columns)
+        self.n_category_bytes_ = (int(self.n_categories_.max()) + 7) // 8 if self.categorical_features_.size else 0 # bitset width
+
+        # init: y is validated and encoded once; the splitters only see its codes
+        self.classes_, y_encoded = _encode_class_labels(y, classes=classes)
+        if len(self.classes_) < 2:
+            raise ValueError("y must have at least 2 classes")
+        self.n_classes_ = len(self.classes_)
+        if self.n_classes_ == 2:
+            self.y_class0_value, self.y_class1_value = self.classes_
 
-        if type(y_true) in [pd.DataFrame, pd.Series]:
-            y_true = y_true.to_numpy()
+        if sample_weight is None:
+            sample_weight = np.ones(shape=(len(y_encoded),))
+
+        if self.splitter == 'hist':
+            if bin_mapper is None:
+                bin_mapper = histogram_bin_mapper(max_bins=self.max_bins).fit(X)
+            if X_binned is None:
+                X_binned = bin_mapper.transform(X)
+
+        if self.splitter == 'random':
+            self.random_generator = np.random.default_rng(self.random_state)
+
+        grow = {'depth_first': self._grow_depth_first, 'level_wise': self._grow_level_wise, 'best_first': self._grow_best_first}[self.grow_policy]
+        with _feature_thread_pool(self.n_jobs) as self.thread_pool:
+            self.root_node = grow(X=X, y_encoded=y_encoded, sample_weight=sample_weight, X_binned=X_binned, bin_mapper=bin_mapper)
+        self.thread_pool = None
+        self.tree_ = decision_tree_arrays.from_nodes(root_node=self.root_node,
+                                                     split_of=lambda node: (node.best_split_feature_i, node.best_x_cutoff_value, node.best_category_bitset) if node.best_x_cutoff_value is not None else None,
+                                                     value_of=lambda node: node.y_class_probs)
+        return self # return the fitted estimator
+
+    def _make_node(self, y_encoded, sample_weight, depth):
+        """
+        a node with the statistics of these encoded labels and sample weights; the split is filled in later
+        """
+        y_counts = np.bincount(y_encoded, minlength=self.n_classes_)
+        curr_impurity = _impurity_of_class_sums(np.bincount(y_encoded, weights=sample_weight, minlength=self.n_classes_)[np.newaxis], impurity_measure=self.impurity_measure)[0]
+        return decision_tree_classifier_node(curr_depth = depth, curr_impurity = curr_impurity, curr_sample_size = len(y_encoded), curr_y_class_counts = y_counts, best_split_feature_i = None, best_x_cutoff_value = None, y_classes = self.classes_)
+
+    def _find_best_splits_from_histograms(self, histograms):
+        """
+        histograms: (n_nodes, n_features, n_bins, 2 * n_classes), the per-bin [n of each class, weight of each class] of each node
+        Returns, for each node, the (feature position, bin) of the best split 'bin <= b' (the first one in ties), and its impurity.
+        """
+        n_nodes, n_features, n_bins = histograms.shape[:3]
+        n_classes = histograms.shape[3] // 2
+        total_stats = histograms[:, 0].sum(axis=1)[:, np.newaxis, np.newaxis, :]
+        left_stats = np.cumsum(histograms, axis=2)
+        right_stats = total_stats - left_stats
+        right_stats[..., n_classes:] = np.where(right_stats[..., :n_classes] == 0, 0.0, right_stats[..., n_classes:]) # rounding residue
+        total_n = total_stats[..., :n_classes].sum(axis=-1)
+        left_node_n = left_stats[..., :n_classes].sum(axis=-1)
+        right_node_n = total_n - left_node_n
+        left_node_impurity  = _impurity_of_class_sums(left_stats[..., n_classes:].reshape(-1, n_classes),  impurity_measure=self.impurity_measure).reshape(left_node_n.shape)
+        right_node_impurity = _impurity_of_class_sums(right_stats[..., n_classes:].reshape(-1, n_classes), impurity_measure=self.impurity_measure).reshape(left_node_n.shape)
+        weighted_impurity = (left_node_impurity * left_node_n / total_n) + (right_node_impurity * right_node_n / total_n)
+        weighted_impurity = np.where(((left_node_n >= self.min_samples_leaf) & (right_node_n >= self.min_samples_leaf)) | (right_node_n == 0), weighted_impurity, np.inf).reshape(n_nodes, -1)
+        best_cells = np.argmin(weighted_impurity, axis=1)
+        best_feature_positions, best_bins = np.unravel_index(best_cells, (n_features, n_bins))
+        return best_feature_positions, best_bins, weighted_impurity[np.arange(n_nodes), best_cells]
+
+    def _find_best_splits_in_segments(self, X, y_encoded, sample_weight, rows, segment_ids, n_segments):
+        """
+        The sorted sweep of find_best_split_in_one_specific_feature(), for many nodes at once: rows are those of all the nodes,
+        concatenated by node, and segment_ids the node of each row; each feature is sorted once by (node, x).
+        Returns, for each node, the best feature, its cutoff, and the weighted impurity, as find_best_split_across_all_features() would.
+        """
+        if _is_sparse(X):
+            return self._find_best_splits_in_sparse_segments(X, y_encoded, sample_weight, rows, segment_ids, n_segments)
+        class_counts = _one_hot(y_encoded[rows], self.n_classes_)
+        class_weights = _one_hot(y_encoded[rows], self.n_classes_, weights=sample_weight[rows])
+
+        if self.features_indices_actually_used == 'all':
+            features_indices_actually_used = range(X.shape[1])
+        else:
+            features_indices_actually_used = self.features_indices_actually_used
 
-        curr_sample_size = len(y_true)
-        if curr_sample_size == 0:  # no data left to be split
+        def find_best_splits_in_this_feature(this_feature_i):
+            x, category_pairs = X[rows, this_feature_i], None
+            if self.n_categories_[this_feature_i]: # swept in the order of their class rate in each node
+                x, category_pairs = _category_ranks_in_segments(x.astype(np.intp), y_encoded[rows], sample_weight[rows], segment_ids, n_segments, self.n_classes_)
+            sorted_indices = np.lexsort((x, segment_ids)) # by node, then by x (stable)
+            return self._find_best_cutoffs_in_sorted_segments(x[sorted_indices], segment_ids, class_counts[sorted_indices], class_weights[sorted_indices], n_segments) + (category_pairs,)
+
+        best_split_feature_i = np.zeros(shape=(n_segments,), dtype=np.intp)
+        best_x_cutoff_value = np.zeros(shape=(n_segments,))
+        best_impurity = np.full(shape=(n_segments,), fill_value=np.inf)
+        category_pairs_of = {}
+        # the features are compared in order, with a strict <, as in find_best_split_across_all_features()
+        map_over_features = map if self.thread_pool is None else self.thread_pool.map
+        for this_feature_i, (x_cutoff_value, impurity, category_pairs) in zip(features_indices_actually_used, map_over_features(find_best_splits_in_this_feature, features_indices_actually_used)):
+            is_better = impurity < best_impurity
+            best_split_feature_i[is_better], best_x_cutoff_value[is_better], best_impurity[is_better] = this_feature_i, x_cutoff_value[is_better], impurity[is_better]
+            if category_pairs is not None:
+                category_pairs_of[this_feature_i] = category_pairs
+        return best_split_feature_i, best_x_cutoff_value, best_impurity, self._category_bitsets_of_splits(best_split_feature_i, best_x_cutoff_value, category_pairs_of, n_segments)
+
+    def _category_bitsets_of_splits(self, best_split_feature_i, best_x_cutoff_value, category_pairs_of, n_segments):
+        """
+        The bitsets (one row per node) of the categories going left in the nodes split on a categorical feature, i.e., those ranked
+        at or below the cutoff; the best_x_cutoff_value of these nodes is then set to NaN. None if no feature is categorical.
+        """
+        if not self.n_category_bytes_:
             return None
+        category_bitsets = np.zeros(shape=(n_segments, self.n_category_bytes_), dtype=np.uint8)
+        for this_feature_i, (pair_segment_ids, pair_categories, pair_ranks) in category_pairs_of.items():
+            goes_left = (best_split_feature_i[pair_segment_ids] == this_feature_i) & (pair_ranks <= best_x_cutoff_value[pair_segment_ids])
+            _set_bits(category_bitsets, pair_segment_ids[goes_left], pair_categories[goes_left])
+        best_x_cutoff_value[self.n_categories_[best_split_feature_i] > 0] = np.nan
+        return category_bitsets
+
+    def _go_left(self, X, rows, segment_ids, best_split_feature_i, best_x_cutoff_value, category_bitsets):
+        """
+        whether each row goes to the left child of the split of its node (segment_ids[k] is the node of rows[k])
+        """
+        split_feature_i = best_split_feature_i[segment_ids]
+        x = _values_at(X, rows, split_feature_i)
+        go_left = x <= best_x_cutoff_value[segment_ids]
+        if category_bitsets is not None:
+            is_categorical = self.n_categories_[split_feature_i] > 0
+            go_left[is_categorical] = _bitset_contains(category_bitsets, segment_ids[is_categorical], x[is_categorical])
+        return go_left
+
+    def _find_best_cutoffs_in_sorted_segments(self, x_sorted, segment_ids, class_counts_sorted, class_weights_sorted, n_segments):
+        """
+        The sweep over the entries of one feature in many nodes, sorted by (node, x); an entry is a row, or, with sparse X,
+        the block of the rows at 0 in a node, with the class counts and weights of all its rows.
+        Returns, for each node, the best cutoff (the first one in x order in ties), and its weighted impurity.
+        """
+        segment_starts, segment_lengths = _segment_starts_and_lengths(segment_ids, n_segments)
+        last_positions = np.flatnonzero(np.append((x_sorted[1:] != x_sorted[:-1]) | (segment_ids[1:] != segment_ids[:-1]), True))
+        candidate_segment_ids = segment_ids[last_positions]
+        x_values_array = x_sorted[last_positions]
+        has_next_value = np.append(candidate_segment_ids[1:] == candidate_segment_ids[:-1], False)
+        x_cutoff_values = np.where(has_next_value, (x_values_array + np.append(x_values_array[1:], 0)) / 2, x_values_array)
+
+        def sums_at_cutoffs(values):
+            return _segment_sums_at(values, last_positions, candidate_segment_ids, segment_starts, segment_lengths)
+
+        left_node_n_by_class, right_node_n_by_class = sums_at_cutoffs(class_counts_sorted)
+        left_node_class_sums, right_node_class_sums = sums_at_cutoffs(class_weights_sorted)
+        left_node_n, right_node_n = left_node_n_by_class.sum(axis=1), right_node_n_by_class.sum(axis=1)
+        total_n = left_node_n + right_node_n
+        # clear the rounding residue of the differences of cumulative sums where a class is absent
+        left_node_class_sums  = np.where(left_node_n_by_class == 0, 0.0, left_node_class_sums)
+        right_node_class_sums = np.where(right_node_n_by_class == 0, 0.0, right_node_class_sums)
+
+        left_node_impurity  = _impurity_of_class_sums(left_node_class_sums,  impurity_measure=self.impurity_measure)
+        right_node_impurity = _impurity_of_class_sums(right_node_class_sums, impurity_measure=self.impurity_measure)
+        weighted_impurity = (left_node_impurity * left_node_n / total_n) + (right_node_impurity * right_node_n / total_n)
+        weighted_impurity = np.where(((left_node_n >= self.min_samples_leaf) & (right_node_n >= self.min_samples_leaf)) | (right_node_n == 0), weighted_impurity, np.inf)
+
+        best_impurity, best_candidates = _first_minimum_per_segment(weighted_impurity, candidate_segment_ids, n_segments)
+        return x_cutoff_values[best_candidates], best_impurity
+
+    def _find_best_splits_in_sparse_segments(self, X, y_encoded, sample_weight, rows, segment_ids, n_segments, max_pairs_per_chunk=2**18):
+        """
+        _find_best_splits_in_segments() for a CSR X. Only the stored entries of the nodes' rows are visited,
+        and the rows at 0 of a feature in a node are one more entry (the node's class counts minus those of its nonzero rows).
+        The features are swept in chunks, each (feature, node) pair being one segment of a single sweep,
+        so that a node costs O(its nnz) plus O(1) per feature; the splits are the same as with the dense X.
+        """
+        n_classes = self.n_classes_
+        segment_class_ids = segment_ids * n_classes + y_encoded[rows]
+        segment_class_counts = np.bincount(segment_class_ids, minlength=n_segments * n_classes).reshape(n_segments, n_classes).astype(float)
+        segment_class_weights = np.bincount(segment_class_ids, weights=sample_weight[rows], minlength=n_segments * n_classes).reshape(n_segments, n_classes)
+        stored_positions, stored_x, feature_starts = _stored_entries_by_feature(X, rows)
 
-        from sortedcontainers import SortedDict
-        curr_y_distribution = SortedDict(Counter(y_true))
+        if self.features_indices_actually_used == 'all':
+            features_indices_actually_used = np.arange(X.shape[1])
+        else:
+            features_indices_actually_used = np.asarray(self.features_indices_actually_used, dtype=np.intp)
+        chunk_size = max(max_pairs_per_chunk // n_segments, 1)
+
+        def find_best_splits_in_these_features(chunk_start):
+            features = features_indices_actually_used[chunk_start:chunk_start + chunk_size]
+            n_pairs = len(features) * n_segments
+            lengths = feature_starts[features + 1] - feature_starts[features]
+            entries = np.repeat(feature_starts[features] - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            positions, x_stored = stored_positions[entries], stored_x[entries]
+            pair_ids = np.repeat(np.arange(len(features)), lengths) * n_segments + segment_ids[positions] # (feature, node)
+            pair_class_ids = pair_ids * n_classes + y_encoded[rows[positions]]
+            # the block of the rows at 0 of each (feature, node) pair that has any
+            zero_class_counts = np.tile(segment_class_counts, (len(features), 1)) - np.bincount(pair_class_ids, minlength=n_pairs * n_classes).reshape(n_pairs, n_classes)
+            zero_class_weights = np.tile(segment_class_weights, (len(features), 1)) - \
+                                 np.bincount(pair_class_ids, weights=sample_weight[rows[positions]], minlength=n_pairs * n_classes).reshape(n_pairs, n_classes)
+            zero_class_weights = np.where(zero_class_counts == 0, 0.0, zero_class_weights)
+            has_zeros = zero_class_counts.sum(axis=1) > 0
+
+            entry_pair_ids = np.concatenate((pair_ids, np.flatnonzero(has_zeros)))
+            entry_x = np.concatenate((x_stored, np.zeros(shape=(has_zeros.sum(),))))
+            class_counts = np.concatenate((_one_hot(y_encoded[rows[positions]], n_classes), zero_class_counts[has_zeros]))
+            class_weights = np.concatenate((_one_hot(y_encoded[rows[positions]], n_classes, weights=sample_weight[rows[positions]]), zero_class_weights[has_zeros]))
+            sorted_indices = np.lexsort((entry_x, entry_pair_ids))
+            x_cutoff_value, impurity = self._find_best_cutoffs_in_sorted_segments(entry_x[sorted_indices], entry_pair_ids[sorted_indices],
+                                                                                class_counts[sorted_indices], class_weights[sorted_indices], n_pairs)
+            return features, x_cutoff_value.reshape(len(features), n_segments), impurity.reshape(len(features), n_segments)
+
+        best_split_feature_i = np.zeros(shape=(n_segments,), dtype=np.intp)
+        best_x_cutoff_value = np.zeros(shape=(n_segments,))
+        best_impurity = np.full(shape=(n_segments,), fill_value=np.inf)
+        # the first best feature in each chunk, then a strict < across the chunks, as feature by feature
+        map_over_chunks = map if self.thread_pool is None else self.thread_pool.map
+        for features, x_cutoff_value, impurity in map_over_chunks(find_best_splits_in_these_features, range(0, len(features_indices_actually_used), chunk_size)):
+            best_positions = np.argmin(impurity, axis=0)
+            chunk_impurity = impurity[best_positions, np.arange(n_segments)]
+            is_better = chunk_impurity < best_impurity
+            best_split_feature_i[is_better], best_x_cutoff_value[is_better] = features[best_positions[is_better]], x_cutoff_value[best_positions[is_better], np.flatnonzero(is_better)]
+            best_impurity[is_better] = chunk_impurity[is_better]
+        return best_split_feature_i, best_x_cutoff_value, best_impurity, None # no categorical feature with a sparse X
+
+    def _find_random_splits_in_segments(self, X, y_encoded, sample_weight, rows, segment_ids, n_segments):
+        """
+        splitter='random', for many nodes at once (as in _find_best_splits_in_segments()): for each node and each feature,
+        one cutoff is drawn uniformly in [min x, max x) of the node, and the rows are counted on either side of it.
+        Returns, for each node, the best feature, its cutoff, and the weighted impurity (np.inf if every feature is constant).
+        """
+        segment_starts, segment_lengths = _segment_starts_and_lengths(segment_ids, n_segments)
+        segment_class_ids = segment_ids * self.n_classes_ + y_encoded[rows] # the (node, class) of each row
+        weight = sample_weight[rows]
 
-        #curr_impurity = self.impurity_func(list(Counter(y_true).values()))
-        curr_impurity = impurity_measure_with_sample_weight(y_class0_value=self.y_class0_value, y_class1_value=self.y_class1_value, y=y_true, sample_weight=sample_weight, impurity_func=self.impurity_func)
+        if self.features_indices_actually_used == 'all':
+            features_indices_actually_used = range(X.shape[1])
+        else:
+            features_indices_actually_used = self.features_indices_actually_used
+        # drawn up front, in feature order, so that the tree does not depend on n_jobs
+        uniform_draws = self.random_generator.random(size=(len(features_indices_actually_used), n_segments))
+
+        def find_random_splits_in_this_feature(feature_position):
+            x, category_pairs = _values_at(X, rows, features_indices_actually_used[feature_position]), None
+            if self.n_categories_[features_indices_actually_used[feature_position]]: # drawn among the ranked categories
+                x, category_pairs = _category_ranks_in_segments(x.astype(np.intp), y_encoded[rows], weight, segment_ids, n_segments, self.n_classes_)
+            x_min, x_max = np.minimum.reduceat(x, segment_starts), np.maximum.reduceat(x, segment_starts)
+            x_cutoff_values = x_min + uniform_draws[feature_position] * (x_max - x_min)
+            go_left = x <= x_cutoff_values[segment_ids]
+
+            def class_sums(side):
+                return np.bincount(segment_class_ids[side], weights=weight[side], minlength=n_segments * self.n_classes_).reshape(n_segments, self.n_classes_)
+            left_node_n = np.bincount(segment_ids[go_left], minlength=n_segments)
+            right_node_n = segment_lengths - left_node_n
+            left_node_impurity  = _impurity_of_class_sums(class_sums(go_left),  impurity_measure=self.impurity_measure)
+            right_node_impurity = _impurity_of_class_sums(class_sums(~go_left), impurity_measure=self.impurity_measure)
+            weighted_impurity = (left_node_impurity * left_node_n / segment_lengths) + (right_node_impurity * right_node_n / segment_lengths)
+            weighted_impurity = np.where((x_max > x_min) & (left_node_n >= self.min_samples_leaf) & (right_node_n >= self.min_samples_leaf), weighted_impurity, np.inf)
+            return x_cutoff_values, weighted_impurity, category_pairs
+
+        best_split_feature_i = np.zeros(shape=(n_segments,), dtype=np.intp)
+        best_x_cutoff_value = np.zeros(shape=(n_segments,))
+        best_impurity = np.full(shape=(n_segments,), fill_value=np.inf)
+        category_pairs_of = {}
+        map_over_features = map if self.thread_pool is None else self.thread_pool.map
+        for this_feature_i, (x_cutoff_value, impurity, category_pairs) in zip(features_indices_actually_used, map_over_features(find_random_splits_in_this_feature, range(len(features_indices_actually_used)))):
+            is_better = impurity < best_impurity
+            best_split_feature_i[is_better], best_x_cutoff_value[is_better], best_impurity[is_better] = this_feature_i, x_cutoff_value[is_better], impurity[is_better]
+            if category_pairs is not None:
+                category_pairs_of[this_feature_i] = category_pairs
+        return best_split_feature_i, best_x_cutoff_value, best_impurity, self._category_bitsets_of_splits(best_split_feature_i, best_x_cutoff_value, category_pairs_of, n_segments)
+
+    def _histogram_stats(self, y_encoded, sample_weight):
+        """
+        with splitter='hist': the per-row stats [is of each class, weight if of each class] that the histograms sum,
+        and the positions of the features used (None = all)
+        """
+        stats = np.column_stack((_one_hot(y_encoded, self.n_classes_), _one_hot(y_encoded, self.n_classes_, weights=sample_weight)))
+        features_indices = None if self.features_indices_actually_used == 'all' else np.asarray(self.features_indices_actually_used)
+        return stats, features_indices
 
-        if curr_impurity == 0 or depth >= self.max_depth: # curr_impurity = 0 means already perfect, no need to split
-            curr_node = decision_tree_classifier_node(curr_depth = depth, curr_impurity = curr_impurity, curr_sample_size = curr_sample_size, curr_y_distribution = curr_y_distribution, best_split_feature_i = None, best_x_cutoff_value = None, y_class0_value=self.y_class0_value, y_class1_value=self.y_class1_value)
-            return curr_node
+    def _histogram_count_stats(self):
+        """
+        the (count stat, weight stat) pairs of the histograms of _histogram_stats(), for _sibling_histograms()
+        """
+        return tuple((class_i, self.n_classes_ + class_i) for class_i in range(self.n_classes_))
+
+    def _is_to_be_split(self, node, depth):
+        """
+        the stopping rules known before any split is searched; curr_impurity = 0 means already perfect, no need to split
+        """
+        return node.curr_impurity != 0 and (self.max_depth is None or depth < self.max_depth) and node.curr_sample_size >= self.min_samples_split
 
-        best_split_feature_i, best_x_cutoff_value, best_impurity, best_information_gain, best_y_true_split_array = self.find_best_split_across_all_features(X=X, y_true=y_true, sample_weight=sample_weight)
-        left_rows = X[:, best_split_feature_i] <= best_x_cutoff_value
-        right_rows = X[:, best_split_feature_i] > best_x_cutoff_value
-        X_left, X_right = X[left_rows], X[right_rows]
-        y_true_left, y_true_right = y_true[left_rows], y_true[right_rows]
-        sample_weight_left, sample_weight_right = sample_weight[left_rows], sample_weight[right_rows]
-        curr_node = decision_tree_classifier_node(curr_depth = depth, curr_impurity = curr_impurity, curr_sample_size = curr_sample_size, curr_y_distribution = curr_y_distribution, best_split_feature_i = best_split_feature_i, best_x_cutoff_value = best_x_cutoff_value, y_class0_value=self.y_class0_value, y_class1_value=self.y_class1_value)
-        # adding left and right children nodes into the node dict
-        curr_node.left  = self.fit( X=X_left,  y=y_true_left,  sample_weight=sample_weight_left,  depth=depth+1)
-        curr_node.right = self.fit( X=X_right, y=y_true_right, sample_weight=sample_weight_right, depth=depth+1)
-        #print(parent_node)
-
-        if depth == 0:
-            self.root_node = curr_node
-            return self # return the fitted estimator
+    def _find_split_of_node(self, node, X, y_encoded, sample_weight, node_sample_indices, X_binned=None, bin_mapper=None, stats=None, features_indices=None, histograms=None):
+        """
+        Returns (best_split_feature_i, best_x_cutoff_value, impurity decrease, go_left, histograms, category_bitset) of the best split of a node:
+        go_left marks the rows of node_sample_indices going left, the impurity decrease is as in min_impurity_decrease,
+        and category_bitset holds the categories going left (None for a numeric split);
+        or None if no split would leave data on both sides, or if the decrease would be below min_impurity_decrease.
+        """
+        category_bitset = None
+        if self.splitter == 'hist':
+            if histograms is None:
+                histograms = _build_histograms(X_binned, node_sample_indices, stats, bin_mapper.n_bins_, features_indices, thread_pool=self.thread_pool)
+            best_feature_position, best_bin_i, best_impurity = (values[0] for values in self._find_best_splits_from_histograms(histograms[np.newaxis]))
+            best_split_feature_i = best_feature_position if features_indices is None else features_indices[best_feature_position]
+            go_left = X_binned[node_sample_indices, best_split_feature_i] <= best_bin_i
+        elif self.splitter == 'random' or _is_sparse(X) or self.n_category_bytes_:
+            # the node as the single segment of the splitters of grow_policy='level_wise'
+            find_splits_in_segments = self._find_random_splits_in_segments if self.splitter == 'random' else self._find_best_splits_in_segments
+            segment_ids = np.zeros(shape=(len(node_sample_indices),), dtype=np.intp)
+            best_split_feature_i, best_x_cutoff_value, best_impurity, category_bitsets = find_splits_in_segments(X=X, y_encoded=y_encoded, sample_weight=sample_weight, rows=node_sample_indices, segment_ids=segment_ids, n_segments=1)
+            if best_impurity[0] == np.inf: # e.g., every feature is constant in this node
+                return None
+            go_left = self._go_left(X, node_sample_indices, segment_ids, best_split_feature_i, best_x_cutoff_value, category_bitsets)
+            if category_bitsets is not None and self.n_categories_[best_split_feature_i[0]]:
+                category_bitset = category_bitsets[0]
+            best_split_feature_i, best_x_cutoff_value, best_impurity = best_split_feature_i[0], best_x_cutoff_value[0], best_impurity[0]
         else:
+            best_split_feature_i, best_x_cutoff_value, best_impurity, best_information_gain, best_y_true_split_array = self._find_best_split_across_all_features(X=X, class_counts=_one_hot(y_encoded[node_sample_indices], self.n_classes_),
+                                                                                                                                                       class_weights=_one_hot(y_encoded[node_sample_indices], self.n_classes_, weights=sample_weight[node_sample_indices]), sample_indices=node_sample_indices)
+            go_left = X[node_sample_indices, best_split_feature_i] <= best_x_cutoff_value
+        n_left = int(go_left.sum())
+        if n_left == 0 or n_left == len(node_sample_indices): # one side would be empty, so this stays a leaf
+            return None
+        impurity_decrease = sample_weight[node_sample_indices].sum() / sample_weight.sum() * (node.curr_impurity - best_impurity)
+        if impurity_decrease < self.min_impurity_decrease:
+            return None
+        if self.splitter == 'hist':
+            best_x_cutoff_value = bin_mapper.bin_threshold(best_split_feature_i, best_bin_i)
+        return best_split_feature_i, best_x_cutoff_value, impurity_decrease, go_left, histograms, category_bitset
+
+    def _split_node(self, node, split, sample_indices, start, end, depth, X_binned=None, bin_mapper=None, stats=None, features_indices=None):
+        """
+        Records the split on the node and partitions its segment [start:end] of sample_indices in place into [left rows | right rows].
+        Returns n_left, and with splitter='hist', the histograms of the two children.
+        """
+        best_split_feature_i, best_x_cutoff_value, _, go_left, histograms, category_bitset = split
+        node.best_split_feature_i, node.best_x_cutoff_value, node.best_category_bitset = best_split_feature_i, best_x_cutoff_value, category_bitset
+        node_sample_indices = sample_indices[start:end]
+        n_left = int(go_left.sum())
+        sample_indices[start:end] = np.concatenate((node_sample_indices[go_left], node_sample_indices[~go_left]))
+
+        left_histograms, right_histograms = None, None
+        if self.splitter == 'hist' and (self.max_depth is None or depth + 1 < self.max_depth):
+            if n_left <= (end - start - n_left):
+                left_histograms = _build_histograms(X_binned, sample_indices[start:start + n_left], stats, bin_mapper.n_bins_, features_indices, thread_pool=self.thread_pool)
+                right_histograms = _sibling_histograms(histograms, left_histograms, count_stats=self._histogram_count_stats())
+            else:
+                right_histograms = _build_histograms(X_binned, sample_indices[start + n_left:end], stats, bin_mapper.n_bins_, features_indices, thread_pool=self.thread_pool)
+                left_histograms = _sibling_histograms(histograms, right_histograms, count_stats=self._histogram_count_stats())
+        return n_left, left_histograms, right_histograms
+
+    def _grow_depth_first(self, X, y_encoded, sample_weight, X_binned=None, bin_mapper=None):
+        """
+        Nodes are grown depth-first from an explicit stack, so that deep trees cannot hit the recursion limit.
+        Rather than copying X, y_encoded, and sample_weight for every child, each node owns the segment [start:end]
+        of a single array of sample indices, which splitting the node partitions in place into [left rows | right rows].
+
+        With splitter='hist', a node's class histograms travel with it on the stack; only the smaller child's are built from its rows.
+        """
+        sample_indices = np.arange(len(y_encoded))
+        stats, features_indices = self._histogram_stats(y_encoded, sample_weight) if self.splitter == 'hist' else (None, None)
+
+        root_node = None
+        stack = [(0, len(y_encoded), 0, None, None, None)] # (start, end, depth, parent, 'left' or 'right', histograms)
+        while stack:
+            start, end, depth, parent_node, side, histograms = stack.pop()
+            node_sample_indices = sample_indices[start:end]
+
+            if self.verbose:
+                print(f"depth={depth}")
+
+            curr_node = self._make_node(y_encoded=y_encoded[node_sample_indices], sample_weight=sample_weight[node_sample_indices], depth=depth)
+            if parent_node is None:
+                root_node = curr_node
+            else:
+                setattr(parent_node, side, curr_node)
+
+            if not self._is_to_be_split(curr_node, depth):
+                continue
+            split = self._find_split_of_node(curr_node, X, y_encoded, sample_weight, node_sample_indices, X_binned, bin_mapper, stats, features_indices, histograms)
+            if split is None:
+                continue
+
+            n_left, left_histograms, right_histograms = self._split_node(curr_node, split, sample_indices, start, end, depth, X_binned, bin_mapper, stats, features_indices)
+            stack.append((start + n_left, end, depth+1, curr_node, 'right', right_histograms))
+            stack.append((start, start + n_left, depth+1, curr_node, 'left', left_histograms))
+
+        return root_node
+
+    def _grow_best_first(self, X, y_encoded, sample_weight, X_binned=None, bin_mapper=None):
+        """
+        Nodes are grown best-first: the split of an open node is found when the node is made, and the node waits in a heap
+        keyed on its weighted impurity decrease; the largest is split next, until max_leaf_nodes leaves or no open node.
+        With max_leaf_nodes=None, the tree is the same as depth-first.
+        """
+        import heapq
+        from itertools import count
+        sample_indices = np.arange(len(y_encoded))
+        stats, features_indices = self._histogram_stats(y_encoded, sample_weight) if self.splitter == 'hist' else (None, None)
+
+        heap = [] # (-impurity decrease, order of arrival (ties go to the older node), start, end, depth, node, split)
+        order_of_arrival = count()
+
+        def make_node(start, end, depth, parent_node, side, histograms):
+            node_sample_indices = sample_indices[start:end]
+            curr_node = self._make_node(y_encoded=y_encoded[node_sample_indices], sample_weight=sample_weight[node_sample_indices], depth=depth)
+            if parent_node is not None:
+                setattr(parent_node, side, curr_node)
+            if self._is_to_be_split(curr_node, depth):
+                split = self._find_split_of_node(curr_node, X, y_encoded, sample_weight, node_sample_indices, X_binned, bin_mapper, stats, features_indices, histograms)
+                if split is not None:
+                    heapq.heappush(heap, (-split[2], next(order_of_arrival), start, end, depth, curr_node, split))
             return curr_node
 
+        root_node = make_node(0, len(y_encoded), 0, None, None, None)
+        n_leaves = 1
+        while heap and (self.max_leaf_nodes is None or n_leaves < self.max_leaf_nodes):
+            _, _, start, end, depth, curr_node, split = heapq.heappop(heap)
+            if self.verbose:
+                print(f"depth={depth}, weighted impurity decrease={split[2]:.4f}")
+            n_left, left_histograms, right_histograms = self._split_node(curr_node, split, sample_indices, start, end, depth, X_binned, bin_mapper, stats, features_indices)
+            make_node(start, start + n_left, depth+1, curr_node, 'left', left_histograms)
+            make_node(start + n_left, end, depth+1, curr_node, 'right', right_histograms)
+            n_leaves += 1 # a leaf became two
+
+        return root_node
+
+    def _grow_level_wise(self, X, y_encoded, sample_weight, X_binned=None, bin_mapper=None):
+        """
+        Nodes are grown one depth at a time: the nodes of a level are scored together (each feature sorted once by (node, x),
+        or, with splitter='hist', the histograms of the level built in one pass), and then partitioned together in one stable sort.
+        """
+        sample_indices = np.arange(len(y_encoded))
+        stats, features_indices = self._histogram_stats(y_encoded, sample_weight) if self.splitter == 'hist' else (None, None)
+
+        root_node = None
+        level = [(0, len(y_encoded), None, None)] # (start, end, parent node, 'left' or 'right')
+        level_histograms = None # those of the nodes in level, stacked along axis 0
+        depth = 0
+        while level:
+            if self.verbose:
+                print(f"depth={depth}, {len(level)} nodes")
+
+            nodes_to_split = [] # (node, start, end, position in level)
+            for level_i, (start, end, parent_node, side) in enumerate(level):
+                node_sample_indices = sample_indices[start:end]
+                curr_node = self._make_node(y_encoded=y_encoded[node_sample_indices], sample_weight=sample_weight[node_sample_indices], depth=depth)
+                if parent_node is None:
+                    root_node = curr_node
+                else:
+                    setattr(parent_node, side, curr_node)
+                if self._is_to_be_split(curr_node, depth):
+                    nodes_to_split.append((curr_node, start, end, level_i))
+            if not nodes_to_split:
+                break
+
+            segments = np.array([(start, end) for _, start, end, _ in nodes_to_split], dtype=np.intp)
+            positions, segment_ids = _segment_positions(segments)
+            rows = sample_indices[positions]
+            if self.splitter == 'hist':
+                if level_histograms is None:
+                    histograms = _build_histograms_of_nodes(X_binned, sample_indices, segments, stats, bin_mapper.n_bins_, features_indices, thread_pool=self.thread_pool)
+                else:
+                    histograms = level_histograms[[level_i for _, _, _, level_i in nodes_to_split]]
+                best_feature_positions, best_bins, best_impurity = self._find_best_splits_from_histograms(histograms)
+                best_split_feature_i = best_feature_positions if features_indices is None else features_indices[best_feature_positions]
+                go_left = X_binned[rows, best_split_feature_i[segment_ids]] <= best_bins[segment_ids]
+                category_bitsets = None
+            else:
+                find_splits_in_segments = self._find_random_splits_in_segments if self.splitter == 'random' else self._find_best_splits_in_segments
+                best_split_feature_i, best_x_cutoff_value, best_impurity, category_bitsets = find_splits_in_segments(X=X, y_encoded=y_encoded, sample_weight=sample_weight, rows=rows, segment_ids=segment_ids, n_segments=len(segments))
+                go_left = self._go_left(X, rows, segment_ids, best_split_feature_i, best_x_cutoff_value, category_bitsets)
+            # the nodes whose split would be below min_impurity_decrease stay leaves, and their rows stay where they are
+            node_weights = np.bincount(segment_ids, weights=sample_weight[rows], minlength=len(segments))
+            impurity_decrease = node_weights / sample_weight.sum() * (np.array([curr_node.curr_impurity for curr_node, _, _, _ in nodes_to_split]) - best_impurity)
+            is_leaf_node = impurity_decrease < self.min_impurity_decrease
+            n_left = _partition_segments(sample_indices, positions, segment_ids, go_left | is_leaf_node[segment_ids], len(segments))
+
+            next_level, smaller_children, larger_children = [], [], []
+            for k, (curr_node, start, end, _) in enumerate(nodes_to_split):
+                if is_leaf_node[k] or n_left[k] == 0 or n_left[k] == (end - start): # one side would be empty
+                    continue
+                curr_node.best_split_feature_i = int(best_split_feature_i[k])
+                curr_node.best_x_cutoff_value = bin_mapper.bin_threshold(best_split_feature_i[k], best_bins[k]) if self.splitter == 'hist' else best_x_cutoff_value[k]
+                if category_bitsets is not None and self.n_categories_[best_split_feature_i[k]]:
+                    curr_node.best_category_bitset = category_bitsets[k]
+                left_is_smaller = n_left[k] <= (end - start - n_left[k])
+                smaller_children.append((start, start + n_left[k]) if left_is_smaller else (start + n_left[k], end))
+                larger_children.append((k, len(next_level) + int(left_is_smaller)))
+                next_level.append((start, start + n_left[k], curr_node, 'left'))
+                next_level.append((start + n_left[k], end, curr_node, 'right'))
+
+            # with splitter='hist', the histograms of the next level; only the smaller children's are built from their rows
+            level_histograms = None
+            if self.splitter == 'hist' and next_level and (self.max_depth is None or depth + 1 < self.max_depth):
+                smaller_histograms = _build_histograms_of_nodes(X_binned, sample_indices, np.array(smaller_children, dtype=np.intp), stats, bin_mapper.n_bins_, features_indices, thread_pool=self.thread_pool)
+                larger_histograms = _sibling_histograms(histograms[[k for k, _ in larger_children]], smaller_histograms, count_stats=self._histogram_count_stats())
+                level_histograms = np.empty(shape=(len(next_level),) + histograms.shape[1:])
+                larger_positions = np.array([level_i for _, level_i in larger_children], dtype=np.intp)
+                level_histograms[larger_positions] = larger_histograms
+                level_histograms[larger_positions ^ 1] = smaller_histograms
+            level = next_level
+            depth += 1
+
+        return root_node
+
     def _order(self, curr_node, type="Inorder"):
         # Recursive travesal
         if curr_node:
@@ -393,34 +1277,59 @@ class decision_tree_classifier_from_scratch(classifier):
 
     def _predict(self, one_X_row, proba=False):
         curr_node = self.root_node
-        while curr_node.best_x_cutoff_value: # not a leaf node yet
-            if one_X_row[ curr_node.best_split_feature_i ] <= curr_node.best_x_cutoff_value:
+        while curr_node.best_x_cutoff_value is not None: # not a leaf node yet
+            if curr_node.best_category_bitset is not None:
+                goes_left = _bitset_contains(curr_node.best_category_bitset[np.newaxis], [0], [one_X_row[ curr_node.best_split_feature_i ]])[0]
+            else:
+                goes_left = one_X_row[ curr_node.best_split_feature_i ] <= curr_node.best_x_cutoff_value
+            if goes_left:
                 curr_node = curr_node.left  # but what if curr_node.left = None?
             else:
                 curr_node = curr_node.right # but what if curr_node.right = None?
         # arriving at a leaf node now
         if proba:
-            return np.array([1-curr_node.y_class1_prob, curr_node.y_class1_prob])
+            return curr_node.y_class_probs
         else:
             return np.array([curr_node.y_dominant_class])
 
     def predict(self, X, proba=False):
+        """
+        the most probable class of the leaf of each row (the later one in ties), or, if proba, the class probabilities of that leaf
+        """
         if type(X) in [pd.DataFrame, pd.Series]:
             X = X.to_numpy()
+        elif _is_sparse(X):
+            X = X.tocsr()
 
-        n_rows = X.shape[0]
+        # the whole batch is routed through the flat arrays at once
+        y_class_probs = self.tree_.value[self.tree_.apply(X)]
         if proba:
-            prediction = np.zeros(shape=(n_rows, 2))
+            return y_class_probs
         else:
-            prediction = np.zeros(shape=(n_rows,))
-
-        for this_row_i in range(n_rows):
-            prediction[this_row_i] = self._predict(X[this_row_i,:], proba=proba)
-        return prediction
+            return self.classes_[_dominant_class_codes(y_class_probs)]
      
     def predict_proba(self, X):
         return self.predict(X, proba=True)
 
+    def compile(self, batch=False, proba=False):
+        """
+        Returns a prediction function generated from the fitted tree, cached until the next fit:
+            - batch=False: f(x) of one row x, nested if/else, for low-latency scoring;
+                           it returns the predicted class (or, if proba, the class probabilities)
+            - batch=True: f(X) of a 2-D array, the same as predict(X, proba=proba)
+        """
+        key = ('predict_proba' if proba else 'predict', batch)
+        if key not in self.tree_.compiled_functions:
+            leaf_outputs = self.tree_.value if proba else self.classes_[_dominant_class_codes(self.tree_.value)]
+            self.tree_.compiled_functions[key] = self.tree_.compile(leaf_outputs=leaf_outputs, batch=batch)
+        return self.tree_.compiled_functions[key]
+
+    def apply(self, X):
+        """
+        returns the index (in self.tree_) of the leaf node that each row of X ends up in
+        """
+        return self.tree_.apply(X)
+
     def score(self, X_test, y_test):
         if type(X_test) in [pd.DataFrame, pd.Series]:
             X_test = X_test.to_numpy()
@@ -432,6 +1341,114 @@ class decision_tree_classifier_from_scratch(classifier):
         return accuracy
 
 
+class decision_stump_classifier_from_scratch(classifier):
+    """
+    A depth-1 decision_tree_classifier_from_scratch (the same split, the same leaves), for boosting.
+
+    The columns of X are argsorted once (presort()) and passed to every fit(), which then scores all the cutoffs
+    from weighted cumulative sums along these orders, in O(n_samples * n_features) without sorting.
+    """
+
+    def __init__(self, impurity_measure='entropy'):
+        super().__init__()
+        if impurity_measure not in ['entropy', 'gini_impurity']:
+            raise ValueError('invalid impurity_measure value')
+        self.impurity_measure = impurity_measure
+        self.y_class0_value = 0
+        self.y_class1_value = 1
+
+    @staticmethod
+    def presort(X):
+        """
+        the stable argsort of each column of X, to be passed to fit() as sorted_indices
+        """
+        if type(X) in [pd.DataFrame, pd.Series]:
+            X = X.to_numpy()
+        return np.argsort(X, axis=0, kind='mergesort')
+
+    def fit(self, X, y, sample_weight=None, sorted_indices=None, encoded_classes=None):
+        """
+        sorted_indices: presort(X), or None to compute it here
+        encoded_classes: the two classes of y, if y already holds their codes 0 and 1; None = encode y here
+        """
+        if type(X) in [pd.DataFrame, pd.Series]:
+            X = X.to_numpy()
+        if encoded_classes is None:
+            self.classes_, y_encoded = _encode_class_labels(y)
+        else:
+            self.classes_, y_encoded = np.asarray(encoded_classes), np.asarray(y)
+        if len(self.classes_) != 2:
+            raise ValueError("y must be binary")
+        self.y_class0_value, self.y_class1_value = self.classes_
+        if sample_weight is None:
+            sample_weight = np.ones(shape=(len(y_encoded),))
+        if sorted_indices is None:
+            sorted_indices = self.presort(X)
+
+        n_samples, n_features = X.shape
+        y_is_class1 = (y_encoded == 1)
+        total_n_class1 = int(y_is_class1.sum())
+
+        def leaf_value(n, n_class1):
+            return [1 - n_class1 / n, n_class1 / n]
+
+        # the root is a leaf only if it is pure or if no cutoff exists;
+        # otherwise the stump always splits, as the original max_depth=1 tree did
+        root_impurity = _impurity_of_class_sums([[np.sum(sample_weight[~y_is_class1]), np.sum(sample_weight[y_is_class1])]], impurity_measure=self.impurity_measure)[0]
+        self.tree_ = decision_tree_arrays(feature=[-1], threshold=[np.nan], left=[-1], right=[-1], value=[leaf_value(n_samples, total_n_class1)])
+        if root_impurity == 0:
+            return self
+
+        # column j of the arrays below is feature j in its sorted order
+        X_sorted = np.take_along_axis(X, sorted_indices, axis=0)
+        y_is_class1_sorted = y_is_class1[sorted_indices]
+        sample_weight_sorted = sample_weight[sorted_indices]
+
+        def cumulative_sums(values, from_the_right=False):
+            # the sums left (prefix sums) or right (suffix sums) of the cutoff after each position
+            if from_the_right:
+                return np.append(np.cumsum(values[::-1], axis=0)[::-1], np.zeros(shape=(1, n_features)), axis=0)[1:]
+            return np.cumsum(values, axis=0)
+
+        # a cutoff goes after the last occurrence of each distinct x value, but the largest one (no split)
+        is_cutoff = np.append(X_sorted[1:] != X_sorted[:-1], np.zeros(shape=(1, n_features), dtype=bool), axis=0)
+        left_node_n = np.arange(1, n_samples + 1)[:, np.newaxis]
+        right_node_n = n_samples - left_node_n
+        left_node_class_sums  = np.stack((cumulative_sums(sample_weight_sorted * ~y_is_class1_sorted), cumulative_sums(sample_weight_sorted * y_is_class1_sorted)), axis=-1)
+        right_node_class_sums = np.stack((cumulative_sums(sample_weight_sorted * ~y_is_class1_sorted, from_the_right=True), cumulative_sums(sample_weight_sorted * y_is_class1_sorted, from_the_right=True)), axis=-1)
+        left_node_impurity  = _impurity_of_class_sums(left_node_class_sums.reshape(-1, 2),  impurity_measure=self.impurity_measure).reshape(n_samples, n_features)
+        right_node_impurity = _impurity_of_class_sums(right_node_class_sums.reshape(-1, 2), impurity_measure=self.impurity_measure).reshape(n_samples, n_features)
+        weighted_impurity = np.where(is_cutoff, (left_node_impurity * left_node_n / n_samples) + (right_node_impurity * right_node_n / n_samples), np.inf)
+
+        # the first lowest one in feature order, and then in x order, as in decision_tree_classifier_from_scratch
+        best_feature_i, best_position = np.unravel_index(np.argmin(weighted_impurity.T), (n_features, n_samples))
+        if not is_cutoff[best_position, best_feature_i]: # no valid cutoff
+            return self
+        x_cutoff_value = (X_sorted[best_position, best_feature_i] + X_sorted[best_position + 1, best_feature_i]) / 2
+        left_n, left_n_class1 = best_position + 1, int(y_is_class1_sorted[:best_position + 1, best_feature_i].sum())
+        self.tree_ = decision_tree_arrays(feature=[best_feature_i, -1, -1], threshold=[x_cutoff_value, np.nan, np.nan], left=[1, -1, -1], right=[2, -1, -1],
+                                          value=[leaf_value(n_samples, total_n_class1), leaf_value(left_n, left_n_class1), leaf_value(n_samples - left_n, total_n_class1 - left_n_class1)])
+        return self
+
+    def predict(self, X, proba=False):
+        if type(X) in [pd.DataFrame, pd.Series]:
+            X = X.to_numpy()
+        y_class1_prob = self.tree_.value[self.tree_.apply(X)]
+        if proba:
+            return y_class1_prob
+        return np.where(y_class1_prob[:, 1] >= 0.50, self.y_class1_value, self.y_class0_value)
+
+    def predict_proba(self, X):
+        return self.predict(X, proba=True)
+
+    def score(self, X_test, y_test):
+        if type(X_test) in [pd.DataFrame, pd.Series]:
+            X_test = X_test.to_numpy()
+        if type(y_test) in [pd.DataFrame, pd.Series]:
+            y_test = y_test.to_numpy()
+        return np.mean(self.predict(X_test) == y_test)
+
+
 def decision_tree_classifier(*args, **kwargs):
     """
     """
@@ -441,9 +1458,10 @@ def decision_tree_classifier(*args, **kwargs):
 #######################################################################################################################################
 
 class decision_tree_regressor_node(object):
-    def __init__(self, X, y, subset_sample_indices, min_samples_leaf=5, max_depth=None, curr_depth=0):
+    def __init__(self, X, y, subset_sample_indices, min_samples_leaf=5, max_depth=None, curr_depth=0, thread_pool=None):
         """
         min_samples_leaf: The minimum number of samples required to be at a leaf node.
+        thread_pool: if not None, a concurrent.futures.ThreadPoolExecutor over which the features are scored in parallel
         """
         self.X = X 
         self.y = y
@@ -451,6 +1469,7 @@ class decision_tree_regressor_node(object):
         self.min_samples_leaf = min_samples_leaf
         self.max_depth = max_depth
         self.curr_depth = curr_depth
+        self.thread_pool = thread_pool
         self.n_samples = len(subset_sample_indices)
         self.n_features = X.shape[1]
         self.predicted_value = np.mean(y[subset_sample_indices]) # the decision (prediction) is based on the value the node holds.
@@ -462,53 +1481,65 @@ class decision_tree_regressor_node(object):
             self.find_best_feature_to_split()
         
     def find_best_feature_to_split(self):
-        for feature_index in range(self.n_features):
-            self.check_if_better_split_feature_and_its_value(feature_index)
+        # the features may be scored in parallel, but are compared in feature order, as in serial mode
+        map_over_features = map if self.thread_pool is None else self.thread_pool.map
+        for feature_index, (after_split_purity_score, split_feature_value) in enumerate(map_over_features(self.find_best_split_value_of_feature, range(self.n_features))):
+            if after_split_purity_score < self.best_after_split_purity_score:
+                # a better split has been found
+                self.best_split_feature_index = feature_index
+                self.best_after_split_purity_score = after_split_purity_score
+                self.best_split_feature_value = split_feature_value
         if self.is_leaf_node:
             return
         best_split_feature_x_series = self.best_split_feature_x_series
         best_split_left_node_series_indices  = np.nonzero(best_split_feature_x_series <= self.best_split_feature_value)[0]
         best_split_right_node_series_indices = np.nonzero(best_split_feature_x_series >  self.best_split_feature_value)[0]
         # recursively find all the left and right children nodes
-        self.left  = decision_tree_regressor_node(X=self.X, y=self.y, subset_sample_indices=self.subset_sample_indices[best_split_left_node_series_indices],  min_samples_leaf=self.min_samples_leaf, max_depth=self.max_depth, curr_depth=self.curr_depth+1)
-        self.right = decision_tree_regressor_node(X=self.X, y=self.y, subset_sample_indices=self.subset_sample_indices[best_split_right_node_series_indices], min_samples_leaf=self.min_samples_leaf, max_depth=self.max_depth, curr_depth=self.curr_depth+1)
+        self.left  = decision_tree_regressor_node(X=self.X, y=self.y, subset_sample_indices=self.subset_sample_indices[best_split_left_node_series_indices],  min_samples_leaf=self.min_samples_leaf, max_depth=self.max_depth, curr_depth=self.curr_depth+1, thread_pool=self.thread_pool)
+        self.right = decision_tree_regressor_node(X=self.X, y=self.y, subset_sample_indices=self.subset_sample_indices[best_split_right_node_series_indices], min_samples_leaf=self.min_samples_leaf, max_depth=self.max_depth, curr_depth=self.curr_depth+1, thread_pool=self.thread_pool)
         
-    def check_if_better_split_feature_and_its_value(self, feature_index):
+    def find_best_split_value_of_feature(self, feature_index):
         """
-        try to see if this feature and a certain value of the feature is a better split;
-        criterion: a lower "weighted averages of the standard deviations", which is equivalent to minimizing RMSE.
-        """      
-        specific_x_series = self.X[self.subset_sample_indices, feature_index]
+        Returns (the lowest after-split purity score, its split value), or (inf, None) if no split leaves min_samples_leaf on both sides.
+        It does not modify the node, so that features can be scored in parallel.
 
-        for this_row in range(self.n_samples):
-            specific_x_value_in_this_row = specific_x_series[this_row]
-            left_node_series_indices  = specific_x_series <= specific_x_value_in_this_row # left_node  holds those in specific_x_series smaller than (or equal to) specific_x_value_in_this_row
-            right_node_series_indices = specific_x_series >  specific_x_value_in_this_row # right_node holds those in specific_x_series larger than                specific_x_value_in_this_row
-            n_samples_in_left_node  = left_node_series_indices.sum() # a shorthand way to count
-            n_samples_in_right_node = right_node_series_indices.sum()
-            # the leaf nodes must have at least n = "min_samples_left" samples
-            if (n_samples_in_right_node < self.min_samples_leaf) or (n_samples_in_left_node < self.min_samples_leaf):
-                continue
-
-            # this_row is now a candidate as it satisfies the condition that the leaf nodes must have at least n = "min_samples_left" samples
-            curr_after_split_purity_score = self.find_after_split_purity_score(left_node_series_indices, right_node_series_indices)
-            if curr_after_split_purity_score < self.best_after_split_purity_score: 
-                # a better split has been found
-                self.best_split_feature_index = feature_index
-                self.best_after_split_purity_score = curr_after_split_purity_score
-                self.best_split_feature_value = specific_x_value_in_this_row
-    
-    def find_after_split_purity_score(self, left_node_indices, right_node_indices):
-        """
-        the weighted sum of the variance of y within left and right nodes
+        A sorted sweep: n * variance = sum(y^2) - sum(y)^2 / n on each side of every candidate value
+        is read off the prefix sums of y and y^2 along the sorted feature, in O(n log n) rather than O(n^2).
         """
+        specific_x_series = self.X[self.subset_sample_indices, feature_index]
         y_subset = self.y[self.subset_sample_indices]
-        left_node_variance  = y_subset[left_node_indices].var()
-        right_node_variance = y_subset[right_node_indices].var()
-        n_samples_in_left_node  = left_node_indices.sum()
-        n_samples_in_right_node = right_node_indices.sum()
-        return (left_node_variance * n_samples_in_left_node) + (right_node_variance * n_samples_in_right_node)
-                
+        y_subset = y_subset - y_subset.mean() # centered, for numerical stability
+
+        sorted_indices = np.argsort(specific_x_series, kind='mergesort')
+        x_sorted = specific_x_series[sorted_indices]
+        y_sorted = y_subset[sorted_indices]
+
+        # left_node holds those smaller than (or equal to) a candidate value, i.e., up to its last occurrence
+        last_positions = np.flatnonzero(np.append(x_sorted[1:] != x_sorted[:-1], True))
+        first_positions = np.append(0, last_positions[:-1] + 1)
+        n_samples_in_left_node  = last_positions + 1
+        n_samples_in_right_node = self.n_samples - n_samples_in_left_node
+
+        # the leaf nodes must have at least n = "min_samples_left" samples
+        is_candidate = (n_samples_in_left_node >= self.min_samples_leaf) & (n_samples_in_right_node >= self.min_samples_leaf)
+        if not is_candidate.any():
+            return float('inf'), None
+
+        y_cumsum = np.cumsum(y_sorted)
+        y_squared_cumsum = np.cumsum(y_sorted ** 2)
+        left_node_sum, left_node_squared_sum = y_cumsum[last_positions], y_squared_cumsum[last_positions]
+        right_node_sum, right_node_squared_sum = y_cumsum[-1] - left_node_sum, y_squared_cumsum[-1] - left_node_squared_sum
+        with np.errstate(divide='ignore', invalid='ignore'):
+            after_split_purity_score = (left_node_squared_sum - left_node_sum ** 2 / n_samples_in_left_node) + (right_node_squared_sum - right_node_sum ** 2 / n_samples_in_right_node)
+        after_split_purity_score = np.where(is_candidate, np.maximum(after_split_purity_score, 0), float('inf'))
+
+        # ties go to the value that appears first in the rows, as in a row-by-row scan
+        best_score = after_split_purity_score.min()
+        first_rows = np.minimum.reduceat(sorted_indices, first_positions)
+        best_value_i = np.flatnonzero(after_split_purity_score == best_score)[np.argmin(first_rows[after_split_purity_score == best_score])]
+
+        return best_score, x_sorted[last_positions[best_value_i]]
+
     @property
     def best_split_feature_x_series(self):
         return self.X[self.subset_sample_indices, self.best_split_feature_index]
@@ -529,17 +1560,41 @@ class decision_tree_regressor_node(object):
 
 class decision_tree_regressor_from_scratch(object):
 
-    def __init__(self, min_samples_leaf=5, max_depth=None):
+    def __init__(self, min_samples_leaf=5, max_depth=None, splitter='best', max_bins=255, grow_policy='depth_first', n_jobs=1):
         """
         min_samples_leaf: The minimum number of samples required to be at a leaf node.
+
+        splitter: how the split values are searched
+            - 'best': every distinct x value (a sorted sweep per feature per node)
+            - 'hist': only the edges of at most max_bins quantile bins of each feature, as in decision_tree_classifier_from_scratch;
+                      DT_root_node is then not built, only self.tree_
+
+        grow_policy: the order in which the nodes are grown
+            - 'depth_first': one node at a time (through decision_tree_regressor_node, or from a stack with splitter='hist')
+            - 'level_wise': all the nodes of a depth at a time, each feature being swept (or binned) once per level;
+                            DT_root_node is then not built, and the nodes in self.tree_ are numbered level by level.
+                            The splits are the same as depth-first, up to rounding in near-ties with splitter='best'.
+
+        n_jobs: same as in decision_tree_classifier_from_scratch
         """
+        if splitter not in ['best', 'hist']:
+            raise ValueError('splitter must be either best or hist')
+        if grow_policy not in ['depth_first', 'level_wise']:
+            raise ValueError('grow_policy must be either depth_first or level_wise')
+        self.grow_policy = grow_policy
+        self.n_jobs = n_jobs
         self.X_train = None
         self.y_train = None
         self.DT_root_node = None
         self.min_samples_leaf = min_samples_leaf
         self.max_depth = max_depth
+        self.splitter = splitter
+        self.max_bins = max_bins
 
-    def fit(self, X, y):
+    def fit(self, X, y, X_binned=None, bin_mapper=None):
+        """
+        X_binned, bin_mapper: only used when splitter='hist'; same as in decision_tree_classifier_from_scratch.fit()
+        """
         self.X_train = X
         self.y_train = y
         if type(self.X_train) in [pd.DataFrame, pd.Series]:
@@ -547,14 +1602,144 @@ class decision_tree_regressor_from_scratch(object):
         if type(self.y_train) in [pd.DataFrame, pd.Series]:
             self.y_train = self.y_train.to_numpy()
         n_samples = len(self.y_train)
-        self.DT_root_node = decision_tree_regressor_node(X=self.X_train, y=self.y_train, subset_sample_indices=np.arange(n_samples), min_samples_leaf=self.min_samples_leaf, max_depth=self.max_depth)
+
+        if self.splitter == 'hist':
+            if bin_mapper is None:
+                bin_mapper = histogram_bin_mapper(max_bins=self.max_bins).fit(self.X_train)
+            if X_binned is None:
+                X_binned = bin_mapper.transform(self.X_train)
+            # one boosting step from the mean: the gradients of 0.5 * (y - ŷ)^2 at ŷ = mean(y)
+            y_mean = self.y_train.mean()
+            with _feature_thread_pool(self.n_jobs) as thread_pool:
+                self.tree_, _ = _grow_histogram_tree(X_binned=X_binned, bin_mapper=bin_mapper, gradients=-(self.y_train - y_mean), hessians=np.ones(shape=(n_samples,)), max_depth=self.max_depth, min_samples_leaf=self.min_samples_leaf, grow_policy=self.grow_policy, thread_pool=thread_pool)
+            self.tree_.value += y_mean
+            self.X_train, self.y_train = None, None
+            return self
+
+        if self.grow_policy == 'level_wise':
+            with _feature_thread_pool(self.n_jobs) as thread_pool:
+                self.tree_ = self._grow_level_wise(X=self.X_train, y=self.y_train, thread_pool=thread_pool)
+            self.X_train, self.y_train = None, None
+            return self
+
+        with _feature_thread_pool(self.n_jobs) as thread_pool:
+            self.DT_root_node = decision_tree_regressor_node(X=self.X_train, y=self.y_train, subset_sample_indices=np.arange(n_samples), min_samples_leaf=self.min_samples_leaf, max_depth=self.max_depth, thread_pool=thread_pool)
+        self.tree_ = decision_tree_arrays.from_nodes(root_node=self.DT_root_node,
+                                                     split_of=lambda node: None if node.is_leaf_node else (node.best_split_feature_index, node.best_split_feature_value),
+                                                     value_of=lambda node: node.predicted_value)
+        # the fitted nodes no longer need the training data
+        stack = [self.DT_root_node]
+        while stack:
+            node = stack.pop()
+            node.X, node.y, node.subset_sample_indices, node.thread_pool = None, None, None, None
+            if not node.is_leaf_node:
+                stack.extend([node.left, node.right])
+        self.X_train, self.y_train = None, None
         return self
-  
+
+    def _grow_level_wise(self, X, y, thread_pool=None):
+        """
+        Grows the tree one depth at a time, straight into a decision_tree_arrays: each feature is sorted once by (node, x) per level,
+        and swept as in decision_tree_regressor_node.find_best_split_value_of_feature(), which gives the same splits (and ties).
+        """
+        n_samples, n_features = X.shape
+        sample_indices = np.arange(n_samples)
+        feature, threshold, left, right, value = [], [], [], [], []
+
+        level = [(0, n_samples, -1, False)] # (start, end, parent node, is the left child)
+        depth = 0
+        while level:
+            nodes_to_split = [] # (node, start, end)
+            for start, end, parent_i, is_left_child in level:
+                node_i = len(feature)
+                if parent_i >= 0:
+                    (left if is_left_child else right)[parent_i] = node_i
+                feature.append(-1)
+                threshold.append(np.nan)
+                left.append(-1)
+                right.append(-1)
+                value.append(np.mean(y[sample_indices[start:end]]))
+                if self.max_depth is None or depth < self.max_depth:
+                    nodes_to_split.append((node_i, start, end))
+            if not nodes_to_split:
+                break
+
+            n_segments = len(nodes_to_split)
+            positions, segment_ids = _segment_positions([(start, end) for _, start, end in nodes_to_split])
+            segment_starts, segment_lengths = _segment_starts_and_lengths(segment_ids, n_segments)
+            rows = sample_indices[positions]
+            # centering each node on its mean keeps sum(y^2) - sum(y)^2 / n numerically stable; variances are unaffected
+            y_centered = y[rows] - np.array([value[node_i] for node_i, _, _ in nodes_to_split])[segment_ids]
+
+            def find_best_split_values_of_feature(feature_index):
+                x = X[rows, feature_index]
+                sorted_indices = np.lexsort((x, segment_ids)) # by node, then by x (stable)
+                x_sorted = x[sorted_indices]
+                y_sorted = y_centered[sorted_indices]
+
+                last_positions = np.flatnonzero(np.append((x_sorted[1:] != x_sorted[:-1]) | (segment_ids[1:] != segment_ids[:-1]), True))
+                first_positions = np.append(0, last_positions[:-1] + 1)
+                candidate_segment_ids = segment_ids[last_positions]
+                n_samples_in_left_node  = last_positions + 1 - segment_starts[candidate_segment_ids]
+                n_samples_in_right_node = segment_lengths[candidate_segment_ids] - n_samples_in_left_node
+                is_candidate = (n_samples_in_left_node >= self.min_samples_leaf) & (n_samples_in_right_node >= self.min_samples_leaf)
+
+                left_node_sum, right_node_sum = _segment_sums_at(y_sorted, last_positions, candidate_segment_ids, segment_starts, segment_lengths)
+                left_node_squared_sum, right_node_squared_sum = _segment_sums_at(y_sorted ** 2, last_positions, candidate_segment_ids, segment_starts, segment_lengths)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    after_split_purity_score = (left_node_squared_sum - left_node_sum ** 2 / n_samples_in_left_node) + (right_node_squared_sum - right_node_sum ** 2 / n_samples_in_right_node)
+                after_split_purity_score = np.where(is_candidate, np.maximum(after_split_purity_score, 0), float('inf'))
+
+                # ties go to the value that appears first in the rows of the node (the rows of a segment are in increasing order)
+                first_rows = rows[sorted_indices[first_positions]]
+                best_score, best_candidates = _first_minimum_per_segment(after_split_purity_score, candidate_segment_ids, n_segments, tie_keys=first_rows)
+                return best_score, x_sorted[last_positions[best_candidates]]
+
+            best_split_feature_index = np.zeros(shape=(n_segments,), dtype=np.intp)
+            best_split_feature_value = np.zeros(shape=(n_segments,))
+            best_after_split_purity_score = np.full(shape=(n_segments,), fill_value=float('inf'))
+            map_over_features = map if thread_pool is None else thread_pool.map
+            for feature_index, (after_split_purity_score, split_feature_value) in enumerate(map_over_features(find_best_split_values_of_feature, range(n_features))):
+                is_better = after_split_purity_score < best_after_split_purity_score
+                best_split_feature_index[is_better], best_split_feature_value[is_better], best_after_split_purity_score[is_better] = feature_index, split_feature_value[is_better], after_split_purity_score[is_better]
+            is_leaf_node = best_after_split_purity_score == float('inf')
+
+            go_left = (X[rows, best_split_feature_index[segment_ids]] <= best_split_feature_value[segment_ids]) | is_leaf_node[segment_ids]
+            n_left = _partition_segments(sample_indices, positions, segment_ids, go_left, n_segments)
+
+            level = []
+            for k, (node_i, start, end) in enumerate(nodes_to_split):
+                if is_leaf_node[k]:
+                    continue
+                feature[node_i], threshold[node_i] = best_split_feature_index[k], best_split_feature_value[k]
+                level.append((start, start + n_left[k], node_i, True))
+                level.append((start + n_left[k], end, node_i, False))
+            depth += 1
+
+        return decision_tree_arrays(feature=feature, threshold=threshold, left=left, right=right, value=value)
+
+    def apply(self, X):
+        """
+        returns the index (in self.tree_) of the leaf node that each row of X ends up in
+        """
+        return self.tree_.apply(X)
+
     def predict(self, X):
         X_test = X
         if type(X_test) in [pd.DataFrame, pd.Series]:
             X_test = X_test.to_numpy()
-        return self.DT_root_node.predict(X_test)
+        return self.tree_.value[self.tree_.apply(X_test)]
+
+    def compile(self, batch=False):
+        """
+        Returns a prediction function generated from the fitted tree, cached until the next fit:
+            - batch=False: f(x) of one row x, nested if/else, for low-latency scoring
+            - batch=True: f(X) of a 2-D array, the same as predict(X)
+        """
+        key = ('predict', batch)
+        if key not in self.tree_.compiled_functions:
+            self.tree_.compiled_functions[key] = self.tree_.compile(leaf_outputs=self.tree_.value, batch=batch)
+        return self.tree_.compiled_functions[key]
         
 
 def decision_tree_regressor(*args, **kwargs):
@@ -817,7 +2002,7 @@ def demo_from_scratch(question_type="classification"):
         feature_names = df.columns.drop('MEDV')
         X, y = df[feature_names], df['MEDV']
 
-        for model in [decision_tree_regressor_from_scratch(min_samples_leaf=5), decision_tree_regressor(min_samples_leaf=5)]:
+        for model in [decision_tree_regressor_from_scratch(min_samples_leaf=5), decision_tree_regressor_from_scratch(min_samples_leaf=5, grow_policy='level_wise'), decision_tree_regressor_from_scratch(min_samples_leaf=5, splitter='hist'), decision_tree_regressor(min_samples_leaf=5)]:
             print(f"------ model: {repr(model)} ------")
             model.fit(X, y)
             y_pred = model.predict(X)
@@ -853,6 +2038,44 @@ def demo_from_scratch(question_type="classification"):
         plot_confusion_matrix(y_true=y_test, y_pred=DT_model.predict(X_test), y_classes=y_classes)
         plot_ROC_and_PR_curves(fitted_model=DT_model, X=X_test, y_true=y_test, y_pred_score=y_pred_score[:,1], model_name = 'DT from scratch')
 
+        # more than two classes: one tree for the 3 species, rather than one per species
+        data = public_dataset(name="iris")
+        X = data[['sepal length (cm)', 'sepal width (cm)', 'petal length (cm)', 'petal width (cm)']]
+        y = data['target'].map({0: 'setosa', 1: 'versicolor', 2: 'virginica'})
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.25, random_state=123)
+        DT_model = decision_tree_classifier_from_scratch(impurity_measure=impurity_measure, max_depth = 3).fit(X_train, y_train)
+        print(DT_model.order(type="Preorder")['curr'])
+        print(f"\nAccuracy in predicting the iris species in the testing set: {DT_model.score(X_test, y_test)}")
+
+
+def demo_compile(max_depth=6, number=2000):
+    """
+    Benchmarks the latency of compile()'d trees against predict(), for a one-row and a 1k-row request
+    """
+    import timeit
+    from ..datasets import public_dataset
+
+    data = public_dataset('Social_Network_Ads')
+    X, y = data[['Age', 'EstimatedSalary']].to_numpy(dtype=float), data['Purchased'].to_numpy()
+    df = public_dataset(name="boston")
+    X_boston, y_boston = df.drop(columns='MEDV').to_numpy(dtype=float), df['MEDV'].to_numpy()
+
+    for model_name, model, X_requests in [('decision_tree_classifier_from_scratch', decision_tree_classifier_from_scratch(max_depth=max_depth).fit(X, y), X),
+                                          ('decision_tree_regressor_from_scratch', decision_tree_regressor_from_scratch(max_depth=max_depth).fit(X_boston, y_boston), X_boston)]:
+        X_1k = X_requests[np.arange(1000) % len(X_requests)]
+        x_row, x_row_list = X_requests[:1], X_requests[0].tolist()
+        predict_row, predict_batch = model.compile(), model.compile(batch=True)
+        if not (np.array_equal(predict_batch(X_1k), model.predict(X_1k)) and predict_row(x_row_list) == model.predict(x_row)[0]):
+            raise ValueError('the compiled tree does not predict the same as the fitted tree')
+
+        print(f"\n{model_name}(max_depth={max_depth}): {model.tree_.n_nodes} nodes; mean latency per request over {number} requests:")
+        print(f"1 row,     predict():                {timeit.timeit(lambda: model.predict(x_row),    number=number) / number * 1e6:8.1f} µs")
+        print(f"1 row,     compile()'d if/else:      {timeit.timeit(lambda: predict_row(x_row_list), number=number) / number * 1e6:8.1f} µs")
+        print(f"1000 rows, predict():                {timeit.timeit(lambda: model.predict(X_1k),     number=number) / number * 1e6:8.1f} µs")
+        print(f"1000 rows, compile(batch=True)'d:    {timeit.timeit(lambda: predict_batch(X_1k),     number=number) / number * 1e6:8.1f} µs")
+        print(f"1000 rows, compile()'d if/else loop: {timeit.timeit(lambda: [predict_row(x) for x in X_1k.tolist()], number=max(number // 100, 1)) / max(number // 100, 1) * 1e6:8.1f} µs")
+
+
 #
 # References
 #
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+
+# Author: Daniel Yang <daniel.yj.yang@gmail.com>
+#
+# License: BSD 3 clause
+
+import numpy as np
+import pandas as pd
+
+from ._segments import _segment_positions, _partition_segments
+
+
+class histogram_bin_mapper(object):
+    """
+    Quantizes each feature into at most max_bins (<= 255) bins, so that X is stored as a uint8 matrix of bin codes.
+
+    bin_thresholds_[j]: the increasing upper edges of the bins of feature j; x goes to bin b = the number of edges < x,
+    so that x <= bin_thresholds_[j][b] if and only if its bin is <= b, i.e., a split on the bins is a split on the raw values.
+    With at most max_bins distinct values, the edges are the midpoints between them.
+    """
+
+    def __init__(self, max_bins=255):
+        if not 2 <= max_bins <= 255:
+            raise ValueError('max_bins must be between 2 and 255')
+        self.max_bins = max_bins
+        self.bin_thresholds_ = None
+        self.n_bins_ = None
+
+    def fit(self, X):
+        if type(X) in [pd.DataFrame, pd.Series]:
+            X = X.to_numpy()
+        self.bin_thresholds_ = []
+        for feature_i in range(X.shape[1]):
+            x_distinct_values = np.unique(X[:, feature_i])
+            if len(x_distinct_values) <= self.max_bins:
+                bin_thresholds = (x_distinct_values[:-1] + x_distinct_values[1:]) / 2
+            else:
+                bin_thresholds = np.unique(np.percentile(X[:, feature_i], np.linspace(0, 100, self.max_bins + 1)[1:-1]))
+            self.bin_thresholds_.append(bin_thresholds)
+        self.n_bins_ = max(len(bin_thresholds) for bin_thresholds in self.bin_thresholds_) + 1
+        return self
+
+    def transform(self, X):
+        if type(X) in [pd.DataFrame, pd.Series]:
+            X = X.to_numpy()
+        X_binned = np.empty(shape=X.shape, dtype=np.uint8)
+        for feature_i, bin_thresholds in enumerate(self.bin_thresholds_):
+            X_binned[:, feature_i] = np.searchsorted(bin_thresholds, X[:, feature_i], side='left')
+        return X_binned
+
+    def fit_transform(self, X):
+        return self.fit(X).transform(X)
+
+    def bin_threshold(self, feature_i, bin_i):
+        """
+        the raw x cutoff value equivalent to the split 'bin <= bin_i' of feature feature_i
+        """
+        return self.bin_thresholds_[feature_i][bin_i]
+
+
+def _build_histograms(X_binned, sample_indices, stats, n_bins, features_indices=None, thread_pool=None, n_features_per_task=8):
+    """
+    stats: (n_samples, n_stats) per-row quantities, e.g., class weights, or gradients, hessians, and counts
+    Returns their sums per (feature, bin) over the rows in sample_indices, of shape (n_features, n_bins, n_stats).
+    thread_pool: if not None, chunks of n_features_per_task features are built in parallel
+    """
+    if thread_pool is not None:
+        if features_indices is None:
+            features_indices = np.arange(X_binned.shape[1])
+        if len(features_indices) > n_features_per_task:
+            features_chunks = np.array_split(features_indices, int(np.ceil(len(features_indices) / n_features_per_task)))
+            return np.concatenate(list(thread_pool.map(lambda features_chunk: _build_histograms(X_binned, sample_indices, stats, n_bins, features_chunk), features_chunks)), axis=0)
+
+    codes = X_binned[sample_indices]
+    if features_indices is not None:
+        codes = codes[:, features_indices]
+    n_features = codes.shape[1]
+    flat_bins = (codes + np.arange(n_features) * n_bins).ravel()
+    histograms = np.empty(shape=(n_features * n_bins, stats.shape[1]))
+    for stat_i in range(stats.shape[1]):
+        histograms[:, stat_i] = np.bincount(flat_bins, weights=np.repeat(stats[sample_indices, stat_i], n_features), minlength=n_features * n_bins)
+    return histograms.reshape(n_features, n_bins, stats.shape[1])
+
+
+def _build_histograms_of_nodes(X_binned, sample_indices, segments, stats, n_bins, features_indices=None, thread_pool=None, n_features_per_task=8):
+    """
+    The histograms of many nodes at once, e.g., of a level, in one bincount per stat (the bins of node k are offset by k * n_features * n_bins).
+    segments: the [start, end) of each node in sample_indices
+    Returns an array of shape (n_nodes, n_features, n_bins, n_stats).
+    """
+    if thread_pool is not None:
+        if features_indices is None:
+            features_indices = np.arange(X_binned.shape[1])
+        if len(features_indices) > n_features_per_task:
+            features_chunks = np.array_split(features_indices, int(np.ceil(len(features_indices) / n_features_per_task)))
+            return np.concatenate(list(thread_pool.map(lambda features_chunk: _build_histograms_of_nodes(X_binned, sample_indices, segments, stats, n_bins, features_chunk), features_chunks)), axis=1)
+
+    positions, segment_ids = _segment_positions(segments)
+    rows = sample_indices[positions]
+    codes = X_binned[rows]
+    if features_indices is not None:
+        codes = codes[:, features_indices]
+    n_nodes, n_features = len(segments), codes.shape[1]
+    flat_bins = (codes + (segment_ids[:, np.newaxis] * n_features + np.arange(n_features)) * n_bins).ravel()
+    histograms = np.empty(shape=(n_nodes * n_features * n_bins, stats.shape[1]))
+    for stat_i in range(stats.shape[1]):
+        histograms[:, stat_i] = np.bincount(flat_bins, weights=np.repeat(stats[rows, stat_i], n_features), minlength=n_nodes * n_features * n_bins)
+    return histograms.reshape(n_nodes, n_features, n_bins, stats.shape[1])
+
+
+def _sibling_histograms(parent_histograms, child_histograms, count_stats=()):
+    """
+    The histograms of the other child: the parent's minus this child's (of one node, or of nodes stacked along a leading axis).
+    count_stats: pairs of (count stat index, float stat index); a float stat is set to 0 wherever its count is 0 (rounding residue).
+    """
+    sibling_histograms = parent_histograms - child_histograms
+    for count_stat_i, float_stat_i in count_stats:
+        sibling_histograms[..., float_stat_i] = np.where(sibling_histograms[..., count_stat_i] == 0, 0.0, sibling_histograms[..., float_stat_i])
+    return sibling_histograms
+
+
+def _grow_histogram_tree(X_binned, bin_mapper, gradients, hessians, sample_indices=None, max_depth=None, max_leaf_nodes=None, min_samples_leaf=1, l2_regularization=0.0, grow_policy='depth_first', thread_pool=None):
+    """
+    Grows a regression tree on binned X from per-row gradients and hessians, as in gradient boosting
+    (plain regression is gradients = -(y - mean(y)) and hessians = 1).
+
+    Each node keeps per-(feature, bin) histograms of [gradient, hessian, count], from whose cumulative sums every split 'bin <= b' is scored:
+        gain = G_left^2 / (H_left + l2) + G_right^2 / (H_right + l2) - G^2 / (H + l2)
+    and a leaf predicts -G / (H + l2). Only the smaller child's histograms are built from its rows.
+
+    grow_policy:
+        - 'depth_first': one node at a time, from an explicit stack; the nodes are numbered in pre-order
+        - 'level_wise': all the nodes of a level at a time, in one histogram pass and one stable partition per level;
+                        the splits are the same as depth-first, but the nodes are numbered level by level
+        - 'best_first': the open node with the largest gain is split next, up to max_leaf_nodes leaves;
+                        the same splits as depth-first if max_leaf_nodes is None, numbered in the order they are made
+
+    max_leaf_nodes: the maximum number of leaves, only with grow_policy='best_first' (None = unlimited)
+
+    thread_pool: if not None, the histograms of a node are built over chunks of features in parallel
+
+    Returns:
+        - tree: a decision_tree_arrays with raw-x thresholds
+        - leaf_indices: the leaf of every row of X_binned (-1 for rows not in sample_indices)
+    """
+    from ._decision_tree import decision_tree_arrays
+
+    if grow_policy not in ['depth_first', 'level_wise', 'best_first']:
+        raise ValueError('grow_policy must be depth_first, level_wise, or best_first')
+    if max_leaf_nodes is not None and grow_policy != 'best_first':
+        raise ValueError("max_leaf_nodes requires grow_policy='best_first'")
+    if sample_indices is None:
+        sample_indices = np.arange(X_binned.shape[0])
+    sample_indices = np.array(sample_indices, dtype=np.intp) # a private copy, partitioned in place below
+    stats = np.column_stack((gradients, hessians, np.ones(shape=(X_binned.shape[0],))))
+    n_bins = bin_mapper.n_bins_
+
+    def leaf_value(total_stats):
+        return -total_stats[0] / (total_stats[1] + l2_regularization)
+
+    def find_best_splits(histograms):
+        """
+        histograms: shape (n_nodes, n_features, n_bins, 3)
+        Returns the best (feature, bin) of each node, whether it has a valid split, and its gain
+        """
+        total_stats = histograms[:, 0].sum(axis=1)[:, np.newaxis, np.newaxis, :]
+        left_stats = np.cumsum(histograms, axis=2)
+        right_stats = total_stats - left_stats
+        with np.errstate(divide='ignore', invalid='ignore'):
+            gain = (left_stats[..., 0] ** 2 / (left_stats[..., 1] + l2_regularization)
+                    + right_stats[..., 0] ** 2 / (right_stats[..., 1] + l2_regularization)
+                    - total_stats[..., 0] ** 2 / (total_stats[..., 1] + l2_regularization))
+        gain = np.where((left_stats[..., 2] >= max(min_samples_leaf, 1)) & (right_stats[..., 2] >= max(min_samples_leaf, 1)), gain, -np.inf)
+        best_cells = np.argmax(gain.reshape(len(gain), -1), axis=1)
+        best_feature_i, best_bin_i = np.unravel_index(best_cells, gain.shape[1:])
+        best_gain = gain.reshape(len(gain), -1)[np.arange(len(gain)), best_cells]
+        return best_feature_i, best_bin_i, best_gain != -np.inf, best_gain
+
+    feature, threshold, left, right, value = [], [], [], [], []
+    leaf_indices = np.full(shape=(X_binned.shape[0],), fill_value=-1, dtype=np.intp)
+
+    def add_node(start, end, parent_i, is_left_child):
+        node_i = len(feature)
+        if parent_i >= 0:
+            (left if is_left_child else right)[parent_i] = node_i
+        feature.append(-1)
+        threshold.append(np.nan)
+        left.append(-1)
+        right.append(-1)
+        value.append(leaf_value(stats[sample_indices[start:end]].sum(axis=0)))
+        return node_i
+
+    def can_be_split(start, end, depth):
+        return (max_depth is None or depth < max_depth) and (end - start) >= 2 * min_samples_leaf
+
+    if grow_policy == 'depth_first':
+        stack = [(0, len(sample_indices), 0, -1, False, None)] # (start, end, depth, parent, is left child, histograms)
+        while stack:
+            start, end, depth, parent_i, is_left_child, histograms = stack.pop()
+            node_sample_indices = sample_indices[start:end]
+            node_i = add_node(start, end, parent_i, is_left_child)
+
+            has_split = False
+            if can_be_split(start, end, depth):
+                if histograms is None:
+                    histograms = _build_histograms(X_binned, node_sample_indices, stats, n_bins, thread_pool=thread_pool)
+                best_feature_i, best_bin_i, has_split, _ = (values[0] for values in find_best_splits(histograms[np.newaxis]))
+            if not has_split:
+                leaf_indices[node_sample_indices] = node_i
+                continue
+
+            feature[node_i], threshold[node_i] = best_feature_i, bin_mapper.bin_threshold(best_feature_i, best_bin_i)
+            go_left = X_binned[node_sample_indices, best_feature_i] <= best_bin_i
+            n_left = int(go_left.sum())
+            sample_indices[start:end] = np.concatenate((node_sample_indices[go_left], node_sample_indices[~go_left]))
+
+            left_histograms, right_histograms = None, None
+            if max_depth is None or depth + 1 < max_depth:
+                if n_left <= (end - start - n_left):
+                    left_histograms = _build_histograms(X_binned, sample_indices[start:start + n_left], stats, n_bins, thread_pool=thread_pool)
+                    right_histograms = _sibling_histograms(histograms, left_histograms, count_stats=((2, 0), (2, 1)))
+                else:
+                    right_histograms = _build_histograms(X_binned, sample_indices[start + n_left:end], stats, n_bins, thread_pool=thread_pool)
+                    left_histograms = _sibling_histograms(histograms, right_histograms, count_stats=((2, 0), (2, 1)))
+            stack.append((start + n_left, end, depth + 1, node_i, False, right_histograms))
+            stack.append((start, start + n_left, depth + 1, node_i, True, left_histograms))
+
+    elif grow_policy == 'best_first':
+        import heapq
+        from itertools import count
+        heap = [] # (-gain, order of arrival, start, end, depth, node, best feature, best bin, histograms)
+        order_of_arrival = count()
+
+        def make_node(start, end, depth, parent_i, is_left_child, histograms):
+            node_i = add_node(start, end, parent_i, is_left_child)
+            if can_be_split(start, end, depth):
+                if histograms is None:
+                    histograms = _build_histograms(X_binned, sample_indices[start:end], stats, n_bins, thread_pool=thread_pool)
+                best_feature_i, best_bin_i, has_split, best_gain = (values[0] for values in find_best_splits(histograms[np.newaxis]))
+                if has_split:
+                    heapq.heappush(heap, (-best_gain, next(order_of_arrival), start, end, depth, node_i, best_feature_i, best_bin_i, histograms))
+                    return
+            leaf_indices[sample_indices[start:end]] = node_i
+
+        make_node(0, len(sample_indices), 0, -1, False, None)
+        n_leaves = 1
+        while heap and (max_leaf_nodes is None or n_leaves < max_leaf_nodes):
+            _, _, start, end, depth, node_i, best_feature_i, best_bin_i, histograms = heapq.heappop(heap)
+            node_sample_indices = sample_indices[start:end]
+            feature[node_i], threshold[node_i] = best_feature_i, bin_mapper.bin_threshold(best_feature_i, best_bin_i)
+            go_left = X_binned[node_sample_indices, best_feature_i] <= best_bin_i
+            n_left = int(go_left.sum())
+            sample_indices[start:end] = np.concatenate((node_sample_indices[go_left], node_sample_indices[~go_left]))
+
+            left_histograms, right_histograms = None, None
+            if max_depth is None or depth + 1 < max_depth:
+                if n_left <= (end - start - n_left):
+                    left_histograms = _build_histograms(X_binned, sample_indices[start:start + n_left], stats, n_bins, thread_pool=thread_pool)
+                    right_histograms = _sibling_histograms(histograms, left_histograms, count_stats=((2, 0), (2, 1)))
+                else:
+                    right_histograms = _build_histograms(X_binned, sample_indices[start + n_left:end], stats, n_bins, thread_pool=thread_pool)
+                    left_histograms = _sibling_histograms(histograms, right_histograms, count_stats=((2, 0), (2, 1)))
+            make_node(start, start + n_left, depth + 1, node_i, True, left_histograms)
+            make_node(start + n_left, end, depth + 1, node_i, False, right_histograms)
+            n_leaves += 1 # a leaf became two
+        # the nodes still waiting to be split stay leaves
+        for _, _, start, end, _, node_i, _, _, _ in heap:
+            leaf_indices[sample_indices[start:end]] = node_i
+
+    else:
+        level = [(0, len(sample_indices), -1, False)] # (start, end, parent node, is the left child)
+        level_histograms = None # those of the nodes in level, stacked along axis 0
+        depth = 0
+        while level:
+            nodes_to_split = [] # (node, start, end, position in level)
+            for level_i, (start, end, parent_i, is_left_child) in enumerate(level):
+                node_i = add_node(start, end, parent_i, is_left_child)
+                if can_be_split(start, end, depth):
+                    nodes_to_split.append((node_i, start, end, level_i))
+                else:
+                    leaf_indices[sample_indices[start:end]] = node_i
+            if not nodes_to_split:
+                break
+
+            segments = np.array([(start, end) for _, start, end, _ in nodes_to_split], dtype=np.intp)
+            if level_histograms is None:
+                histograms = _build_histograms_of_nodes(X_binned, sample_indices, segments, stats, n_bins, thread_pool=thread_pool)
+            else:
+                histograms = level_histograms[[level_i for _, _, _, level_i in nodes_to_split]]
+            best_feature_i, best_bin_i, has_split, _ = find_best_splits(histograms)
+
+            # the rows of all the nodes are partitioned together; those of the nodes without a split stay as they are
+            positions, segment_ids = _segment_positions(segments)
+            go_left = (X_binned[sample_indices[positions], best_feature_i[segment_ids]] <= best_bin_i[segment_ids]) | ~has_split[segment_ids]
+            n_left = _partition_segments(sample_indices, positions, segment_ids, go_left, len(segments))
+
+            next_level, smaller_children, larger_children = [], [], []
+            for k, (node_i, start, end, _) in enumerate(nodes_to_split):
+                if not has_split[k]:
+                    leaf_indices[sample_indices[start:end]] = node_i
+                    continue
+                feature[node_i], threshold[node_i] = best_feature_i[k], bin_mapper.bin_threshold(best_feature_i[k], best_bin_i[k])
+                left_is_smaller = n_left[k] <= (end - start - n_left[k])
+                smaller_children.append((start, start + n_left[k]) if left_is_smaller else (start + n_left[k], end))
+                larger_children.append((k, len(next_level) + int(left_is_smaller)))
+                next_level.append((start, start + n_left[k], node_i, True))
+                next_level.append((start + n_left[k], end, node_i, False))
+
+            # the histograms of the next level; only the smaller children's are built from their rows
+            level_histograms = None
+            if next_level and (max_depth is None or depth + 1 < max_depth):
+                smaller_histograms = _build_histograms_of_nodes(X_binned, sample_indices, np.array(smaller_children, dtype=np.intp), stats, n_bins, thread_pool=thread_pool)
+                parent_positions = [k for k, _ in larger_children]
+                larger_histograms = _sibling_histograms(histograms[parent_positions], smaller_histograms, count_stats=((2, 0), (2, 1)))
+                level_histograms = np.empty(shape=(len(next_level),) + histograms.shape[1:])
+                larger_positions = np.array([level_i for _, level_i in larger_children], dtype=np.intp)
+                level_histograms[larger_positions] = larger_histograms
+                level_histograms[larger_positions ^ 1] = smaller_histograms
+            level = next_level
+            depth += 1
+
+    tree = decision_tree_arrays(feature=feature, threshold=threshold, left=left, right=right, value=value)
+    return tree, leaf_indices
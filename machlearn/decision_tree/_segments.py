@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+# Author: Daniel Yang <daniel.yj.yang@gmail.com>
+#
+# License: BSD 3 clause
+
+import numpy as np
+
+
+# The tree builders keep a single array of sample indices, in which every node owns a segment [start:end).
+# The helpers below work on many segments at once, so that a whole level of nodes can be processed in one pass.
+
+def _segment_positions(segments):
+    """
+    segments: an array of shape (n_segments, 2) of [start, end) ranges in the sample-index array
+    Returns (positions, segment_ids): the positions covered by the segments, in segment order, and the segment of each
+    """
+    segments = np.asarray(segments, dtype=np.intp).reshape(-1, 2)
+    lengths = segments[:, 1] - segments[:, 0]
+    segment_ids = np.repeat(np.arange(len(segments)), lengths)
+    offsets = np.append(0, np.cumsum(lengths)[:-1])
+    positions = np.arange(lengths.sum()) + np.repeat(segments[:, 0] - offsets, lengths)
+    return positions, segment_ids
+
+
+def _partition_segments(sample_indices, positions, segment_ids, go_left, n_segments):
+    """
+    Partitions every segment of sample_indices in place into [rows going left | rows going right], in one stable sort;
+    the rows keep their order on either side, as with a node-by-node partition.
+    Returns the number of rows going left in each segment.
+    """
+    order = np.lexsort((~go_left, segment_ids))
+    sample_indices[positions] = sample_indices[positions][order]
+    return np.bincount(segment_ids[go_left], minlength=n_segments)
+
+
+def _segment_starts_and_lengths(segment_ids, n_segments):
+    """
+    the offset and length of each segment within the concatenation of all the segments
+    """
+    lengths = np.bincount(segment_ids, minlength=n_segments)
+    return np.append(0, np.cumsum(lengths)[:-1]), lengths
+
+
+def _segment_sums_at(values, last_positions, candidate_segment_ids, segment_starts, segment_lengths):
+    """
+    values: per-row values, concatenated by segment; of shape (n_rows,), or (n_rows, n_columns), e.g., per class
+    Returns the sums of values in each segment up to (and including) last_positions, and those of the rest of the segment.
+    """
+    cumsum = np.concatenate((np.zeros(shape=(1,) + values.shape[1:], dtype=values.dtype), np.cumsum(values, axis=0)))
+    left_sums = cumsum[last_positions + 1] - cumsum[segment_starts[candidate_segment_ids]]
+    segment_sums = cumsum[segment_starts + segment_lengths] - cumsum[segment_starts]
+    return left_sums, segment_sums[candidate_segment_ids] - left_sums
+
+
+def _first_minimum_per_segment(values, candidate_segment_ids, n_segments, tie_keys=None):
+    """
+    values: a score per candidate; candidate_segment_ids is nondecreasing, and every segment has a candidate
+    Returns the lowest value in each segment, and the index of its candidate: the first one in ties,
+    or the one with the lowest of tie_keys (distinct within a segment)
+    """
+    first_candidates = np.searchsorted(candidate_segment_ids, np.arange(n_segments))
+    segment_minimums = np.minimum.reduceat(values, first_candidates)
+    if tie_keys is None:
+        tie_keys = np.arange(len(values))
+    keys = np.where(values == segment_minimums[candidate_segment_ids], tie_keys, np.iinfo(np.intp).max)
+    best_keys = np.minimum.reduceat(keys, first_candidates)
+    return segment_minimums, np.flatnonzero(keys == best_keys[candidate_segment_ids])
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+# Author: Daniel Yang <daniel.yj.yang@gmail.com>
+#
+# License: BSD 3 clause
+
+import numpy as np
+
+
+# scipy.sparse input for the from-scratch trees. X is kept as CSR while fitting, so that the stored
+# (nonzero) entries of a node's rows are gathered in O(nnz of these rows); the rows at 0 in a node
+# are then handled as one block, whose class counts are the node's minus those of its nonzero rows.
+
+def _is_sparse(X):
+    from scipy import sparse
+    return sparse.issparse(X)
+
+
+def _to_csr(X):
+    """
+    a CSR copy of X, with float values and no explicitly stored zeros
+    """
+    X = X.tocsr(copy=True).astype(float)
+    X.eliminate_zeros()
+    return X
+
+
+def _stored_entries_by_feature(X_csr, rows):
+    """
+    The stored entries of X_csr in rows, grouped by feature: (positions in rows, values, feature_starts),
+    where the entries of feature f are [feature_starts[f]:feature_starts[f + 1]].
+    Costs O(nnz of these rows), whatever the length of the columns.
+    """
+    starts, lengths = X_csr.indptr[rows], np.diff(X_csr.indptr)[rows]
+    positions = np.repeat(np.arange(len(rows)), lengths)
+    entries = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    features = X_csr.indices[entries]
+    order = np.argsort(features, kind='stable')
+    feature_starts = np.concatenate(([0], np.cumsum(np.bincount(features, minlength=X_csr.shape[1]))))
+    return positions[order], X_csr.data[entries[order]], feature_starts
+
+
+def _values_at(X, row_indices, feature_indices):
+    """
+    X[row_indices[k], feature_indices[k]] for every k (feature_indices may be a single feature),
+    for a dense array or a scipy.sparse matrix
+    """
+    if _is_sparse(X):
+        if len(row_indices) == 0:
+            return np.zeros(shape=(0,))
+        feature_indices = np.broadcast_to(feature_indices, np.shape(row_indices))
+        return np.asarray(X[row_indices, feature_indices], dtype=float).ravel()
+    return X[row_indices, feature_indices]
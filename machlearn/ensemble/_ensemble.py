@@ -7,7 +7,7 @@
 import numpy as np
 import pandas as pd
 
-from sklearn.ensemble import BaggingClassifier, RandomForestClassifier, AdaBoostClassifier, GradientBoostingClassifier, VotingClassifier
+from sklearn.ensemble import BaggingClassifier, RandomForestClassifier, ExtraTreesClassifier, AdaBoostClassifier, GradientBoostingClassifier, VotingClassifier
 from sklearn.ensemble import GradientBoostingRegressor
 
 # Reference:
@@ -23,7 +23,56 @@ from sklearn.ensemble import GradientBoostingRegressor
 
 #######################################################################################################################################
 
-from ..decision_tree import decision_tree_classifier_from_scratch
+from ..decision_tree import decision_tree_classifier_from_scratch, decision_stump_classifier_from_scratch, histogram_bin_mapper
+from ..decision_tree._decision_tree import decision_tree_arrays, decision_forest_arrays, additive_tree_model, _feature_thread_pool, _encode_class_labels, _dominant_class_codes
+from ..decision_tree._histogram import _grow_histogram_tree
+from ..decision_tree._sparse import _is_sparse
+from ..decision_tree._categorical import _check_categorical_features
+from ..utils import effective_n_jobs
+from ..utils._callbacks import _callback_list, _early_stopping_monitor
+
+
+def _fit_a_forest_tree(X, y, tree_params, bin_mapper, tree_seed, tree_annotation=None):
+    """
+    Fits one tree of a random forest on rows and features drawn from np.random.default_rng(tree_seed).
+    X: X_train (possibly a memory map, or a scipy.sparse CSR matrix), or X_train_binned if bin_mapper is not None
+    tree_params: n_rows_to_sample, n_features_to_sample, bootstrap, classes (those of the whole forest),
+                 and the keyword arguments of decision_tree_classifier_from_scratch
+
+    Returns the fitted tree, and its in-bag rows as a bitset (np.packbits of a mask over the rows of X)
+    """
+    tree_params = dict(tree_params)
+    n_rows_to_sample, n_features_to_sample, bootstrap, classes = tree_params.pop('n_rows_to_sample'), tree_params.pop('n_features_to_sample'), tree_params.pop('bootstrap'), tree_params.pop('classes')
+    random_generator = np.random.default_rng(tree_seed)
+    if bootstrap:
+        rows_indices = random_generator.integers(0, X.shape[0], size=n_rows_to_sample) # with replacement
+    else:
+        rows_indices = random_generator.permutation(X.shape[0])[:n_rows_to_sample]
+    features_indices = list(random_generator.permutation(X.shape[1])[:n_features_to_sample])
+    this_DT = decision_tree_classifier_from_scratch(features_indices_actually_used = features_indices, random_state = random_generator, annotation = tree_annotation, **tree_params)
+    if bin_mapper is not None:
+        this_DT.fit( X = None, y = y[rows_indices], X_binned = np.asarray(X[rows_indices,:]), bin_mapper = bin_mapper, classes = classes )
+    else:
+        this_DT.fit( X = X[rows_indices,:] if _is_sparse(X) else np.asarray(X[rows_indices,:]), y = y[rows_indices], classes = classes )
+    is_in_bag = np.zeros(shape=(X.shape[0],), dtype=bool)
+    is_in_bag[rows_indices] = True
+    return this_DT, np.packbits(is_in_bag)
+
+
+# the X of a worker process of a forest fit with n_jobs != 1, opened once per worker from the file written by fit()
+# (a memory-mapped .npy, or the .npz of a sparse X_train), rather than pickled once per tree
+_forest_worker_state = {}
+
+def _fit_a_forest_tree_in_worker(X_path, y, tree_params, bin_mapper, tree_seed, tree_annotation):
+    if _forest_worker_state.get('X_path') != X_path:
+        if X_path.endswith('.npz'):
+            from scipy import sparse
+            X = sparse.load_npz(X_path)
+        else:
+            X = np.load(X_path, mmap_mode='r')
+        _forest_worker_state.update(X_path=X_path, X=X)
+    return _fit_a_forest_tree(_forest_worker_state['X'], y, tree_params, bin_mapper, tree_seed, tree_annotation)
+
 
 class random_forest_classifier_from_scratch(object):
     """
@@ -47,7 +96,7 @@ class random_forest_classifier_from_scratch(object):
         In the case of classification, we can take the majority (mode) of the class voted by each tree.
     """
 
-    def __init__(self, n_trees = 100, n_features='sqrt', sample_size_factor=1.0, max_depth=10, impurity_measure='entropy', verbose=False):
+    def __init__(self, n_trees = 100, n_features='sqrt', sample_size_factor=1.0, bootstrap=False, max_depth=10, impurity_measure='entropy', splitter='best', max_bins=255, oob_score=False, warm_start=False, n_jobs=1, random_state=1, categorical_features=None, callbacks=None, verbose=False):
         """
         n_features: this is where feature (X.col) bagging happens; the number of features sampled and passed onto to each tree. It can be:
             - 'sqrt': square root of total features #
@@ -56,8 +105,40 @@ class random_forest_classifier_from_scratch(object):
             - None: max_features
         
         sample_size_factor: this is where sample (X.row) bagging happens; it will draw sample_size_factor * X.shape[0] rows. max. = 1.0
+
+        bootstrap: whether the rows are drawn with replacement (a bootstrap sample)
+
+        splitter: 'best', 'hist', or 'random', as in decision_tree_classifier_from_scratch;
+                  with 'hist', X_train is binned once in fit() for all the trees (see also extra_trees_classifier_from_scratch)
+
+        oob_score: whether fit() computes the out-of-bag estimates, from the rows of X_train that each tree did not see:
+            - oob_decision_function_: the class probabilities of each row, averaged over its out-of-bag trees (NaN if none)
+            - oob_score_: the accuracy of oob_decision_function_, over the rows with at least one out-of-bag tree
+            Rows are out of bag only with bootstrap=True or sample_size_factor < 1.0; fit() raises a ValueError otherwise. The in-bag rows of each tree are in in_bag_bitsets_.
+
+        warm_start: if True, fit() on a fitted forest keeps its trees and only adds new ones, up to n_trees (see staged_score())
+
+        n_jobs: the number of worker processes fitting the trees (-1 = all the CPUs), which share X_train through a memory-mapped file
+
+        X may also be a scipy.sparse matrix (with splitter='best' or 'random'), which is kept as CSR, without densifying it
+        (see decision_tree_classifier_from_scratch.fit()).
+
+        random_state: the seed of a np.random.SeedSequence, from which each tree spawns its own generator; the forest does not depend on n_jobs
+
+        categorical_features: as in decision_tree_classifier_from_scratch (only with splitter='best' or 'random')
+
+        callbacks: a list of machlearn.utils.callback, called after every tree; one returning True stops the forest there
         """
+        self.callbacks = callbacks
         self.n_trees = n_trees
+        self.bootstrap = bootstrap
+        self.oob_score = oob_score
+        self.oob_score_ = None
+        self.oob_decision_function_ = None
+        self.warm_start = warm_start
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.categorical_features = categorical_features
 
         self.n_features = n_features
         self.n_features_to_sample = None
@@ -69,20 +150,44 @@ class random_forest_classifier_from_scratch(object):
 
         self.max_depth = max_depth
         self.impurity_measure = impurity_measure
+        self.splitter = splitter
+        self.max_bins = max_bins
         self.verbose = verbose
         self.X_train = None
         self.y_train = None
+        self.X_train_binned = None
+        self.bin_mapper = None
         self.trees = []
         self.fitted = False
     
     def fit(self, X, y):
+        """
+        y: two or more classes, encoded once into classes_, against which every tree is fit.
+
+        With warm_start=True and a fitted forest, only the new trees are fit (on the same X and y as before), from the next
+        random streams of the same SeedSequence, i.e., the forest is the same as if fit with this n_trees at once.
+        """
+        if self.warm_start and self.fitted:
+            return self._fit_more_trees()
+
         ### init
         self.X_train = X
         self.y_train = y
+        columns = self.X_train.columns if type(self.X_train) == pd.DataFrame else None
         if type(self.X_train) in [pd.DataFrame, pd.Series]:
             self.X_train = self.X_train.to_numpy()
+        elif _is_sparse(self.X_train):
+            if self.splitter == 'hist':
+                raise ValueError("sparse X requires splitter='best' or 'random'")
+            self.X_train = self.X_train.tocsr()
         if type(self.y_train) in [pd.DataFrame, pd.Series]:
             self.y_train = self.y_train.to_numpy()
+        self.classes_, _ = _encode_class_labels(self.y_train) # every tree has these classes_, even if some are absent from its rows
+        if self.categorical_features is not None:
+            if self.splitter == 'hist' or _is_sparse(self.X_train):
+                raise ValueError("categorical_features requires splitter='best' or 'random', and a dense X")
+            # validated once here, and passed on to the trees as column indices
+            self.categorical_features_, _ = _check_categorical_features(self.categorical_features, self.X_train, n_features=self.X_train.shape[1], columns=columns)
 
         ### for X.col
         total_features_n = self.X_train.shape[1]
@@ -99,27 +204,152 @@ class random_forest_classifier_from_scratch(object):
         ### for X_train.row
         total_samples_n = self.X_train.shape[0]
         self.n_rows_to_sample = int(total_samples_n * self.sample_size_factor)
+        if self.oob_score and not self.bootstrap and self.n_rows_to_sample >= total_samples_n:
+            raise ValueError("oob_score requires bootstrap=True or sample_size_factor < 1.0, or no row is out of bag")
 
-        ### train each tree
-        np.random.seed(1)
-        self.trees = [self.fit_a_single_decision_tree(tree_annotation=f"{i}") for i in range(self.n_trees)]
+        ### bin X_train once for all the trees
+        if self.splitter == 'hist':
+            self.bin_mapper = histogram_bin_mapper(max_bins=self.max_bins).fit(self.X_train)
+            self.X_train_binned = self.bin_mapper.transform(self.X_train)
 
+        ### train each tree, from its own random stream
+        self.seed_sequence = np.random.SeedSequence(self.random_state)
+        self.tree_seeds = []
+        self.trees = []
+        self.in_bag_bitsets_ = np.zeros(shape=(0, (total_samples_n + 7) // 8), dtype=np.uint8)
+        return self._fit_more_trees()
+
+    def _fit_more_trees(self):
+        """
+        fits the trees len(self.trees) to n_trees - 1; tree i draws from the i-th child of self.seed_sequence
+        """
+        if self.n_trees < len(self.trees):
+            raise ValueError(f"n_trees={self.n_trees} must be at least the {len(self.trees)} trees already fit, with warm_start=True")
+        new_tree_seeds = self.seed_sequence.spawn(self.n_trees - len(self.trees))
+        new_tree_annotations = [f"{i}" for i in range(len(self.trees), self.n_trees)]
+        callbacks = _callback_list(self.callbacks)
+        if callbacks:
+            callbacks.on_fit_begin(self, self.n_rows_to_sample)
+        if new_tree_seeds:
+            fitted_trees = self._fit_trees(new_tree_seeds, new_tree_annotations, callbacks)
+            self.tree_seeds += new_tree_seeds[:len(fitted_trees)]
+            self.trees += [this_DT for this_DT, _ in fitted_trees]
+            self.in_bag_bitsets_ = np.concatenate((self.in_bag_bitsets_, [in_bag_bitset for _, in_bag_bitset in fitted_trees]))
+            if len(fitted_trees) < len(new_tree_seeds): # stopped by a callback; a warm start continues from the next stream
+                self.seed_sequence = np.random.SeedSequence(self.random_state, n_children_spawned=len(self.trees))
+
+        # all the trees in one set of node arrays, for prediction, and the class that each node votes for
+        self.forest_ = decision_forest_arrays.from_trees([this_DT.tree_ for this_DT in self.trees])
+        self.forest_node_votes_ = _dominant_class_codes(self.forest_.value)
+        if self.oob_score:
+            self._compute_oob_score()
+        if callbacks:
+            callbacks.on_fit_end(self)
         self.fitted = True
         return self # return the fitted estimator
 
-    def fit_a_single_decision_tree(self, tree_annotation=None):
-        rows_indices     = list(np.random.permutation(self.X_train.shape[0])[:self.n_rows_to_sample])
-        features_indices = list(np.random.permutation(self.X_train.shape[1])[:self.n_features_to_sample])
-        this_DT = decision_tree_classifier_from_scratch(max_depth = self.max_depth, impurity_measure = self.impurity_measure, features_indices_actually_used = features_indices, annotation = tree_annotation, verbose = self.verbose)
-        this_DT.fit( X = self.X_train[rows_indices,:], y = self.y_train[rows_indices] )
-        return this_DT
+    def _fit_trees(self, tree_seeds, tree_annotations, callbacks):
+        """
+        Returns a list of (tree, in-bag bitset), one per tree seed, or fewer if a callback asked to stop
+        """
+        def collect(fitted_trees_in_order):
+            fitted_trees = []
+            for fitted_tree in fitted_trees_in_order:
+                fitted_trees.append(fitted_tree)
+                if callbacks and callbacks.on_iteration_end(self, len(self.trees) + len(fitted_trees) - 1):
+                    break
+            return fitted_trees
+
+        n_workers = min(effective_n_jobs(self.n_jobs), len(tree_seeds))
+        if n_workers == 1:
+            return collect(self.fit_a_single_decision_tree(tree_annotation=tree_annotation, tree_seed=tree_seed, return_in_bag_bitset=True) for tree_seed, tree_annotation in zip(tree_seeds, tree_annotations))
+        else:
+            import os
+            import tempfile
+            import functools
+            from concurrent.futures import ProcessPoolExecutor
+            with tempfile.TemporaryDirectory() as temp_dir:
+                if _is_sparse(self.X_train):
+                    from scipy import sparse
+                    X_path = os.path.join(temp_dir, 'X_train.npz')
+                    sparse.save_npz(X_path, self.X_train)
+                else:
+                    X_path = os.path.join(temp_dir, 'X_train.npy')
+                    np.save(X_path, self.X_train_binned if self.splitter == 'hist' else self.X_train)
+                fit_a_tree = functools.partial(_fit_a_forest_tree_in_worker, X_path, self.y_train, self._tree_params(), self.bin_mapper)
+                with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                    futures = [executor.submit(fit_a_tree, tree_seed, tree_annotation) for tree_seed, tree_annotation in zip(tree_seeds, tree_annotations)]
+                    fitted_trees = collect(future.result() for future in futures)
+                    for future in futures: # the trees not yet started, if a callback asked to stop
+                        future.cancel()
+                    return fitted_trees
+
+    def _sum_leaf_probabilities(self, X, tree_mask=None, max_pairs_per_chunk=2**20):
+        """
+        an array of shape (n_rows, n_classes): each row's class probabilities summed over the trees (only where tree_mask, of shape (n_rows, n_trees), is True);
+        in chunks of at most max_pairs_per_chunk (row, tree) pairs
+        """
+        n_rows = X.shape[0]
+        summed = np.zeros(shape=(n_rows, len(self.classes_)))
+        chunk_size = max(max_pairs_per_chunk // max(len(self.trees), 1), 1)
+        for chunk_start in range(0, n_rows, chunk_size):
+            leaf_probabilities = self.forest_.value[self.forest_.apply(X[chunk_start:chunk_start + chunk_size])] # shape (chunk_size, n_trees, n_classes)
+            if tree_mask is None:
+                summed[chunk_start:chunk_start + chunk_size] = leaf_probabilities.sum(axis=1)
+            else:
+                summed[chunk_start:chunk_start + chunk_size] = np.einsum('ntc,nt->nc', leaf_probabilities, tree_mask[chunk_start:chunk_start + chunk_size])
+        return summed
+
+    def _compute_oob_score(self):
+        """
+        one batched pass of X_train through the forest, averaging each row's class probabilities over its out-of-bag trees
+        """
+        total_samples_n = self.X_train.shape[0]
+        is_out_of_bag = ~np.unpackbits(self.in_bag_bitsets_, axis=1, count=total_samples_n).astype(bool).T # (n_samples, n_trees)
+        n_out_of_bag_trees = is_out_of_bag.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.oob_decision_function_ = self._sum_leaf_probabilities(self.X_train, tree_mask=is_out_of_bag) / n_out_of_bag_trees[:, np.newaxis]
+        has_oob_prediction = n_out_of_bag_trees > 0
+        oob_y_pred = self.classes_[np.argmax(np.nan_to_num(self.oob_decision_function_), axis=1)] # the first class in the case of a tie
+        self.oob_score_ = np.mean(oob_y_pred[has_oob_prediction] == self.y_train[has_oob_prediction]) if has_oob_prediction.any() else np.nan
+
+    def _tree_params(self):
+        return {'n_rows_to_sample': self.n_rows_to_sample, 'n_features_to_sample': self.n_features_to_sample, 'bootstrap': self.bootstrap,
+                'classes': self.classes_, 'max_depth': self.max_depth, 'impurity_measure': self.impurity_measure, 'splitter': self.splitter, 'max_bins': self.max_bins, 'verbose': self.verbose,
+                'categorical_features': self.categorical_features_ if self.categorical_features is not None else None}
+
+    def fit_a_single_decision_tree(self, tree_annotation=None, tree_seed=None, return_in_bag_bitset=False):
+        """
+        tree_seed: a np.random.SeedSequence (or an int) for the rows and features of this tree; None = fresh entropy
+        return_in_bag_bitset: whether to return (the tree, the bitset of its in-bag rows), rather than only the tree
+        """
+        if tree_seed is None:
+            tree_seed = np.random.SeedSequence()
+        X = self.X_train_binned if self.splitter == 'hist' else self.X_train
+        this_DT, in_bag_bitset = _fit_a_forest_tree(X, self.y_train, self._tree_params(), self.bin_mapper if self.splitter == 'hist' else None, tree_seed, tree_annotation)
+        return (this_DT, in_bag_bitset) if return_in_bag_bitset else this_DT
+
+    def _count_votes(self, X_test):
+        """
+        an array of shape (n_rows, n_classes): the number of trees voting for each class, through self.forest_
+        """
+        votes = self.forest_node_votes_[self.forest_.apply(X_test)] # shape (n_rows, n_trees)
+        n_rows, n_classes = votes.shape[0], len(self.classes_)
+        return np.bincount((np.arange(n_rows)[:, np.newaxis] * n_classes + votes).ravel(), minlength=n_rows * n_classes).reshape(n_rows, n_classes)
 
     def predict(self, X_test):
-        from scipy.stats import mode
-        return mode([this_DT.predict(X_test) for this_DT in self.trees], axis=0).mode[0]
+        """
+        the majority vote of the trees (the smaller class label in the case of a tie)
+        """
+        return self.classes_[np.argmax(self._count_votes(X_test), axis=1)]
 
     def predict_proba(self, X_test):
-        return np.mean([this_DT.predict_proba(X_test) for this_DT in self.trees], axis=0)
+        """
+        the class probabilities averaged over the trees, in the order of classes_
+        """
+        if type(X_test) in [pd.DataFrame, pd.Series]:
+            X_test = X_test.to_numpy()
+        return self._sum_leaf_probabilities(X_test) / len(self.trees)
 
     def score(self, X_test, y_test):
         if type(X_test) in [pd.DataFrame, pd.Series]:
@@ -134,10 +364,26 @@ class random_forest_classifier_from_scratch(object):
     def score_of_individual_trees(self, X_test, y_test):
         return np.array([this_DT.score(X_test, y_test) for this_DT in self.trees])
 
+    def staged_score(self, X_test, y_test):
+        """
+        the accuracy of the majority vote of the first 1, 2, ..., n_trees trees, from one batched pass through the forest,
+        e.g., to pick how many trees to grow with warm_start=True
+        """
+        if type(X_test) in [pd.DataFrame, pd.Series]:
+            X_test = X_test.to_numpy()
+        if type(y_test) in [pd.DataFrame, pd.Series]:
+            y_test = y_test.to_numpy()
+        votes = self.forest_node_votes_[self.forest_.apply(X_test)] # shape (n_rows, n_trees)
+        n_votes = np.cumsum(votes[:, :, np.newaxis] == np.arange(len(self.classes_)), axis=1) # [:, k, c]: first k+1 trees, class c
+        y_pred = self.classes_[np.argmax(n_votes, axis=2)]
+        return np.mean(y_pred == y_test[:, np.newaxis], axis=0)
+
     def print_debugging_info(self):
         if self.fitted:
-            print(f"Number of features to sample (with replacement) from X to train each tree: {self.n_features_to_sample}")
-            print(f"Number of rows to sample (with replacement) from X to train each tree: {self.n_rows_to_sample}")
+            print(f"Number of features to sample (without replacement) from X to train each tree: {self.n_features_to_sample}")
+            print(f"Number of rows to sample ({'with' if self.bootstrap else 'without'} replacement) from X to train each tree: {self.n_rows_to_sample}")
+            if self.oob_score:
+                print(f"Out-of-bag accuracy: {self.oob_score_:.3f}")
 
 
 
@@ -159,16 +405,18 @@ class bagging_classifier_from_scratch(random_forest_classifier_from_scratch):
 
     Bagging stands for "B"ootstrap "Agg"regation.
 
-    The idea is to create subsets of data, chosen randomly with replacement, from the training sample, and then to average all the predictions from different trees.
+    The idea is to create random subsets of the training sample (with replacement if bootstrap=True, as in the original bagging), and then to average all the predictions from different trees.
     Because of reduced variance, the averaged prediction is usually more robust than a single decision tree.
    """
-    def __init__(self, n_trees = 100, sample_size_factor=1.0, max_depth=10, impurity_measure='entropy', verbose=False):
+    def __init__(self, n_trees = 100, sample_size_factor=1.0, bootstrap=False, max_depth=10, impurity_measure='entropy', splitter='best', max_bins=255, oob_score=False, warm_start=False, n_jobs=1, random_state=1, categorical_features=None, callbacks=None, verbose=False):
         """
             bagging is basically random_forest with "n_features=None"
 
             sample_size_factor: this is where sample (X.row) bagging happens; it will draw sample_size_factor * X.shape[0] rows. max. = 1.0
+
+            bootstrap, oob_score, warm_start, categorical_features, callbacks: as in random_forest_classifier_from_scratch
         """
-        super().__init__(n_trees = n_trees, n_features=None, sample_size_factor = sample_size_factor, max_depth = max_depth, impurity_measure = impurity_measure, verbose = verbose)
+        super().__init__(n_trees = n_trees, n_features=None, sample_size_factor = sample_size_factor, bootstrap = bootstrap, oob_score = oob_score, warm_start = warm_start, max_depth = max_depth, impurity_measure = impurity_measure, splitter = splitter, max_bins = max_bins, n_jobs = n_jobs, random_state = random_state, categorical_features = categorical_features, callbacks = callbacks, verbose = verbose)
 
 
 def bagging_classifier(*args, **kwargs):
@@ -178,12 +426,60 @@ def bagging_classifier(*args, **kwargs):
     return BaggingClassifier(*args, **kwargs)
 
 
+#######################################################################################################################################
+
+
+class extra_trees_classifier_from_scratch(random_forest_classifier_from_scratch):
+    """
+    Extremely randomized trees (Geurts, Ernst, & Wehenkel, 2006): a random forest whose trees draw one cutoff per feature
+    uniformly between its min and max in the node, and keep the best of these across the sampled features.
+
+    Lower variance (for a slightly higher bias), and faster trees, as no feature is sorted. By default, no bootstrap.
+    """
+    def __init__(self, n_trees = 100, n_features='sqrt', sample_size_factor=1.0, bootstrap=False, max_depth=10, impurity_measure='entropy', oob_score=False, warm_start=False, n_jobs=1, random_state=1, categorical_features=None, callbacks=None, verbose=False):
+        """
+            extra trees is basically random_forest with "splitter='random'"
+
+            n_features, sample_size_factor, bootstrap, oob_score, warm_start, n_jobs, categorical_features, callbacks:
+                as in random_forest_classifier_from_scratch
+
+            random_state: as in random_forest_classifier_from_scratch, which also seeds the cutoffs of each tree
+        """
+        super().__init__(n_trees = n_trees, n_features = n_features, sample_size_factor = sample_size_factor, bootstrap = bootstrap, oob_score = oob_score, warm_start = warm_start, max_depth = max_depth, impurity_measure = impurity_measure, splitter = 'random', n_jobs = n_jobs, random_state = random_state, categorical_features = categorical_features, callbacks = callbacks, verbose = verbose)
+
+
+def extra_trees_classifier(*args, **kwargs):
+    """
+    same as in extra_trees_classifier_from_scratch()
+    """
+    return ExtraTreesClassifier(*args, **kwargs)
+
+
 #######################################################################################################################################
 
 from ..logistic_regression import logistic_regression_classifier
 from ..kNN import kNN_classifier 
 from ..SVM import SVM_classifier
 
+def _validation_split(X, y, eval_set, validation_fraction, random_state, stratify=False):
+    """
+    Returns X_train, y_train, X_val, y_val: either eval_set = (X_val, y_val) as given, along with all of X and y,
+    or a random validation_fraction of the rows of X and y held out (stratified on y for a classifier)
+    """
+    if eval_set is not None:
+        X_val, y_val = eval_set
+        if type(X_val) in [pd.DataFrame, pd.Series]:
+            X_val = X_val.to_numpy()
+        if type(y_val) in [pd.DataFrame, pd.Series]:
+            y_val = y_val.to_numpy()
+        return X, y, X_val, y_val
+    if not 0 < validation_fraction < 1:
+        raise ValueError('validation_fraction must be between 0 and 1')
+    from sklearn.model_selection import train_test_split
+    X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=validation_fraction, random_state=random_state, stratify=y if stratify else None)
+    return X_train, y_train, X_val, y_val
+
+
 class adaptive_boosting_classifier_from_scratch(object):
     """
     The idea of boosting: one is weak, together is strong, iterative training leads to the best model.
@@ -203,10 +499,21 @@ class adaptive_boosting_classifier_from_scratch(object):
         - Trees grown: Boosting is sequentially, RF is independently
         - Final votes: Boosting is weighted, RF is equal
     """
-    def __init__(self, max_iter=50, verbose=False, weak_learner = "DT"):
+    def __init__(self, max_iter=50, verbose=False, weak_learner = "DT", n_iter_no_change=None, validation_fraction=0.1, tol=1e-4, random_state=1, callbacks=None):
         """
         weak_learner = "DT", "log_reg"
+
+        n_iter_no_change, validation_fraction, tol, random_state: early stopping, as in gradient_boosting_regressor_from_scratch,
+        on the exponential loss mean(exp(-y * F(x))) of the weighted vote F(x); the validation set is stratified on y
+
+        callbacks: a list of machlearn.utils.callback, called after every iteration with the weighted error of its weak learner
         """
+        self.callbacks = callbacks
+        self.n_iter_no_change = n_iter_no_change
+        self.validation_fraction = validation_fraction
+        self.tol = tol
+        self.random_state = random_state
+        self.validation_loss_history = []
         self.max_iter = max_iter
         self.X_train = None
         self.y_train = None
@@ -215,11 +522,15 @@ class adaptive_boosting_classifier_from_scratch(object):
         self.y_class0_value = None
         self.y_class1_value = None
         self.y_classes_value_conversion_dict = {}
+        self.additive_model_ = None
         if weak_learner not in ["DT", "log_reg",]:
             raise ValueError('must be either DT or log_reg')
         self.weak_learner = weak_learner
 
-    def fit(self, X, y):
+    def fit(self, X, y, eval_set=None):
+        """
+        eval_set: as in gradient_boosting_regressor_from_scratch.fit()
+        """
 
         ### init
         self.X_train = X
@@ -228,6 +539,9 @@ class adaptive_boosting_classifier_from_scratch(object):
             self.X_train = self.X_train.to_numpy()
         if type(self.y_train) in [pd.DataFrame, pd.Series]:
             self.y_train = self.y_train.to_numpy()
+        X_val = None
+        if self.n_iter_no_change is not None or eval_set is not None:
+            self.X_train, self.y_train, X_val, y_val = _validation_split(self.X_train, self.y_train, eval_set, self.validation_fraction, self.random_state, stratify=True)
         total_samples_n = self.X_train.shape[0]
 
         ### check
@@ -240,6 +554,12 @@ class adaptive_boosting_classifier_from_scratch(object):
         self.y_classes_value_conversion_dict = {self.y_class0_value: -1, self.y_class1_value: 1}
         if [self.y_class0_value, self.y_class1_value] != [-1, 1]:  # Target values should be ±1
             self.y_train = np.where(self.y_train == self.y_class0_value, -1, 1)
+        self.validation_loss_history = []
+        if X_val is not None:
+            y_val = np.where(y_val == self.y_class0_value, -1, 1)
+            F_val = np.zeros(shape=(len(y_val),)) # the weighted vote of the weak learners so far
+            self.validation_loss_history.append(np.mean(np.exp(-y_val * F_val)))
+            monitor = _early_stopping_monitor(self.n_iter_no_change, self.tol, initial_loss=self.validation_loss_history[0])
         
         ### initialize
         # self.sample_weights_all_iter is a just collection of same weight on each iteration, but not used directly in computation of boosting
@@ -251,17 +571,28 @@ class adaptive_boosting_classifier_from_scratch(object):
         # A. uniform weights for iteration(iter_i=0)
         self.all_iters_sample_weights[:, 0] = np.ones(shape=(total_samples_n,)) / total_samples_n 
 
+        # X_train and y_train never change across the iterations, only the sample weights do,
+        # so the columns are argsorted and y is encoded once for all the decision stumps
+        if self.weak_learner == "DT":
+            X_train_sorted_indices = decision_stump_classifier_from_scratch.presort(self.X_train)
+            y_train_classes, y_train_encoded = _encode_class_labels(self.y_train)
+
         ### B. learning iterations
+        callbacks = _callback_list(self.callbacks)
+        if callbacks:
+            callbacks.on_fit_begin(self, total_samples_n)
         for iter_i in range(self.max_iter):
             # 1. find a weak learner via a base estimator, which will be used to minimize curr_error
             curr_iter_same_weight = self.all_iters_sample_weights[:, iter_i]
             if self.weak_learner == "DT":
-                this_weak_learner = decision_tree_classifier_from_scratch(max_depth=1, verbose=self.verbose)
+                # the same as decision_tree_classifier_from_scratch(max_depth=1), but reusing the presorted columns
+                this_weak_learner = decision_stump_classifier_from_scratch()
+                this_weak_learner.fit(X=self.X_train, y=y_train_encoded, sample_weight=curr_iter_same_weight, sorted_indices=X_train_sorted_indices, encoded_classes=y_train_classes) # sample_weight=curr_iter_same_weight is the key here
             if self.weak_learner == "log_reg":
                 this_weak_learner = logistic_regression_classifier(C=1e9, solver='liblinear')
+                this_weak_learner.fit(X=self.X_train, y=self.y_train, sample_weight=curr_iter_same_weight)
             #this_weak_learner = kNN_classifier() # TypeError: fit() got an unexpected keyword argument 'sample_weight'
             #this_weak_learner = SVM_classifier() # ValueError: ndarray is not C-contiguous
-            this_weak_learner.fit(X=self.X_train, y=self.y_train, sample_weight=curr_iter_same_weight) # sample_weight=curr_iter_same_weight is the key here
             y_pred = this_weak_learner.predict(self.X_train)  
             curr_error = curr_iter_same_weight[y_pred != self.y_train].sum() # calculate error and weak_learner weight from weak learner prediction
 
@@ -282,11 +613,50 @@ class adaptive_boosting_classifier_from_scratch(object):
             self.weak_learners_voting_weights[iter_i] = this_weak_learner_voting_weight
             self.errors[iter_i] = curr_error
 
+            stop = False
+            if X_val is not None:
+                F_val += this_weak_learner_voting_weight * this_weak_learner.predict(X_val)
+                self.validation_loss_history.append(np.mean(np.exp(-y_val * F_val)))
+                stop = monitor.update(self.validation_loss_history[-1])
+            if callbacks:
+                validation_logs = {'validation_loss': self.validation_loss_history[-1]} if X_val is not None else {}
+                stop = callbacks.on_iteration_end(self, iter_i, error=curr_error, **validation_logs) or stop
+            if stop:
+                break
+
+        self.n_iter_ = iter_i + 1 if self.max_iter > 0 else 0
+        self.best_n_iter_ = self.n_iter_
+        if self.n_iter_no_change is not None:
+            # only the weak learners up to the lowest validation loss are kept
+            self.best_n_iter_ = monitor.best_n_iter
+            if self.verbose:
+                print(f"early stopping: {self.n_iter_} iterations run, the first {self.best_n_iter_} kept (validation loss = {monitor.best_loss:.4f})")
+        self.weak_learners = self.weak_learners[:self.best_n_iter_]
+        self.weak_learners_voting_weights = self.weak_learners_voting_weights[:self.best_n_iter_]
+        self.errors = self.errors[:self.best_n_iter_]
+        self.all_iters_sample_weights = self.all_iters_sample_weights[:, :self.best_n_iter_]
+
+        self.additive_model_ = self.export_additive_model() if self.weak_learner == "DT" else None
+        if callbacks:
+            callbacks.on_fit_end(self)
         self.fitted = True
         return self
+
+    def export_additive_model(self):
+        """
+        packs the decision stumps and their voting weights into an additive_tree_model whose leaves vote ±1
+        """
+        if self.weak_learner != "DT":
+            raise ValueError('only decision stumps can be packed into an additive_tree_model')
+        # the same vote as predict() of each stump
+        stumps = [decision_tree_arrays(feature=this_weak_learner.tree_.feature, threshold=this_weak_learner.tree_.threshold, left=this_weak_learner.tree_.left, right=this_weak_learner.tree_.right,
+                                       value=np.where(this_weak_learner.tree_.value[:, 1] >= 0.50, 1.0, -1.0)) for this_weak_learner in self.weak_learners]
+        return additive_tree_model(trees=stumps, tree_weights=self.weak_learners_voting_weights)
     
     def predict(self, X_test):
         # C. the final predictions as the weighted majority vote of the weak learner's predictions
+        if self.additive_model_ is not None:
+            return np.sign(self.additive_model_.decision_function(X_test)) ### Target values should be ±1
         weak_learners_y_preds = np.array([this_weak_learner.predict(X_test) for this_weak_learner in self.weak_learners])
         return np.sign(np.dot(self.weak_learners_voting_weights, weak_learners_y_preds)) ### Target values should be ±1
 
@@ -342,9 +712,226 @@ class gradient_boosting_classifier_from_scratch(object):
     2. Careful tuning of hyperparameters required
 
     GBM: Gradient Boosting Machines, including XGBOOST
+
+    Here, the model is a raw score F(x), built up from regression trees fit to the gradients of the log-loss:
+        - 2 classes: one tree per epoch; p = sigmoid(F), gradient = p - y, hessian = p * (1 - p)
+        - K > 2 classes: K trees per epoch (softmax); gradient_k = p_k - [y == k], hessian_k = p_k * (1 - p_k)
+    Each leaf takes one Newton step, -sum(gradients) / (sum(hessians) + l2_regularization).
     """
-    def __init__(self):
-        pass
+    def __init__(self, max_iter=100, learning_rate=0.1, max_depth=3, max_leaf_nodes=None, min_samples_leaf=5, splitter='hist', max_bins=255, l2_regularization=0.0,
+                 n_iter_no_change=None, validation_fraction=0.1, tol=1e-4, random_state=1, n_jobs=1, callbacks=None, verbose=False):
+        """
+        learning_rate: the shrinkage applied to each tree's contribution to the raw scores
+
+        splitter: how each tree is fit
+            - 'hist': X is binned once, and every tree is grown from per-bin histograms of the gradients and hessians
+            - 'best': a decision_tree_regressor_from_scratch fit to the negative gradients, whose leaves are set to the Newton steps
+
+        max_depth, max_leaf_nodes, min_samples_leaf, max_bins, l2_regularization, n_jobs:
+            as in gradient_boosting_regressor_from_scratch
+
+        n_iter_no_change, validation_fraction, tol, random_state: early stopping on the validation log-loss,
+        as in gradient_boosting_regressor_from_scratch; the validation set is stratified on y
+
+        callbacks: as in gradient_boosting_regressor_from_scratch, with the training log-loss as loss
+        """
+        if splitter not in ['best', 'hist']:
+            raise ValueError('splitter must be either best or hist')
+        if max_leaf_nodes is not None:
+            if splitter != 'hist':
+                raise ValueError("max_leaf_nodes requires splitter='hist'")
+            if max_leaf_nodes < 2:
+                raise ValueError('max_leaf_nodes must be at least 2')
+        self.max_iter = max_iter
+        self.learning_rate = learning_rate
+        self.max_depth = max_depth
+        self.max_leaf_nodes = max_leaf_nodes
+        self.min_samples_leaf = min_samples_leaf
+        self.splitter = splitter
+        self.max_bins = max_bins
+        self.l2_regularization = l2_regularization
+        self.n_iter_no_change = n_iter_no_change
+        self.validation_fraction = validation_fraction
+        self.tol = tol
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+        self.callbacks = callbacks
+        self.verbose = verbose
+        self.trees_ = [] # one list of trees per epoch (1 for 2 classes, K for K classes)
+        self.loss_history = []
+        self.validation_loss_history = []
+        self.fitted = False
+
+    @staticmethod
+    def _raw_scores_to_proba(raw_scores):
+        """
+        raw_scores: shape (n_samples, 1) for 2 classes, or (n_samples, K)
+        Returns the class probabilities, shape (n_samples, n_classes)
+        """
+        if raw_scores.shape[1] == 1:
+            p1 = 1 / (1 + np.exp(-raw_scores[:, 0]))
+            return np.column_stack((1 - p1, p1))
+        exp_scores = np.exp(raw_scores - raw_scores.max(axis=1, keepdims=True)) # shifted, against overflow
+        return exp_scores / exp_scores.sum(axis=1, keepdims=True)
+
+    def _fit_a_tree(self, X, X_binned, gradients, hessians, thread_pool):
+        """
+        Returns the tree (with the Newton step in every leaf) and the leaf that each training row ended up in
+        """
+        if self.splitter == 'hist':
+            return _grow_histogram_tree(X_binned=X_binned, bin_mapper=self.bin_mapper, gradients=gradients, hessians=hessians, max_depth=self.max_depth,
+                                        max_leaf_nodes=self.max_leaf_nodes, min_samples_leaf=self.min_samples_leaf, l2_regularization=self.l2_regularization,
+                                        grow_policy='depth_first' if self.max_leaf_nodes is None else 'best_first', thread_pool=thread_pool)
+        this_weak_learner = decision_tree_regressor_from_scratch(max_depth=self.max_depth, min_samples_leaf=self.min_samples_leaf, n_jobs=self.n_jobs)
+        this_weak_learner.fit(X, -gradients)
+        tree, leaf_indices = this_weak_learner.tree_, this_weak_learner.apply(X)
+        leaf_gradients = np.bincount(leaf_indices, weights=gradients, minlength=tree.n_nodes)
+        leaf_hessians = np.bincount(leaf_indices, weights=hessians, minlength=tree.n_nodes)
+        is_leaf = tree.left == -1
+        tree.value[is_leaf] = -leaf_gradients[is_leaf] / (leaf_hessians[is_leaf] + self.l2_regularization)
+        return tree, leaf_indices
+
+    def fit(self, X, y, eval_set=None):
+        """
+        eval_set: as in gradient_boosting_regressor_from_scratch.fit()
+        """
+        if type(X) in [pd.DataFrame, pd.Series]:
+            X = X.to_numpy()
+        if type(y) in [pd.DataFrame, pd.Series]:
+            y = y.to_numpy()
+        X_val = None
+        if self.n_iter_no_change is not None or eval_set is not None:
+            X, y, X_val, y_val = _validation_split(X, y, eval_set, self.validation_fraction, self.random_state, stratify=True)
+        self.classes_, y_encoded = np.unique(y, return_inverse=True)
+        n_classes = len(self.classes_)
+        if n_classes < 2:
+            raise ValueError('y must have at least 2 classes')
+        y_one_hot = np.eye(n_classes)[y_encoded] if n_classes > 2 else y_encoded[:, np.newaxis].astype(float)
+
+        # F0: the log-odds (2 classes) or the log of the prior (K classes) of each class
+        class_priors = np.bincount(y_encoded, minlength=n_classes) / len(y_encoded)
+        self.raw_score0_ = np.log(class_priors[1:] / class_priors[0]) if n_classes == 2 else np.log(class_priors)
+        self.train_raw_scores_ = np.tile(self.raw_score0_, (len(y_encoded), 1)) # updated in place by each new tree
+
+        X_binned = None
+        if self.splitter == 'hist':
+            from ..decision_tree import histogram_bin_mapper
+            self.bin_mapper = histogram_bin_mapper(max_bins=self.max_bins).fit(X)
+            X_binned = self.bin_mapper.transform(X) # binned once, for all the epochs
+
+        self.trees_ = []
+        self.loss_history = []
+        self.validation_loss_history = []
+        if X_val is not None:
+            y_val_encoded = np.searchsorted(self.classes_, y_val)
+            if np.any(self.classes_[np.minimum(y_val_encoded, n_classes - 1)] != y_val):
+                raise ValueError('y_val has classes not in y')
+            val_raw_scores = np.tile(self.raw_score0_, (len(y_val), 1)) # updated by each new tree
+            self.validation_loss_history.append(self._log_loss(y_val_encoded, self._raw_scores_to_proba(val_raw_scores)))
+            monitor = _early_stopping_monitor(self.n_iter_no_change, self.tol, initial_loss=self.validation_loss_history[0])
+        callbacks = _callback_list(self.callbacks)
+        if callbacks:
+            callbacks.on_fit_begin(self, len(y_encoded))
+        with _feature_thread_pool(self.n_jobs) as thread_pool:
+            for epoch_i in range(self.max_iter):
+                proba = self._raw_scores_to_proba(self.train_raw_scores_)
+                if n_classes == 2:
+                    proba = proba[:, 1:]
+                gradients = proba - y_one_hot
+                hessians = np.maximum(proba * (1 - proba), 1e-16) # floored, so that a pure leaf does not divide by 0
+                these_trees = []
+                for k in range(self.train_raw_scores_.shape[1]):
+                    this_tree, leaf_indices = self._fit_a_tree(X, X_binned, gradients[:, k], hessians[:, k], thread_pool)
+                    these_trees.append(this_tree)
+                    self.train_raw_scores_[:, k] += self.learning_rate * this_tree.value[leaf_indices]
+                self.trees_.append(these_trees)
+                self.loss_history.append(self._log_loss(y_encoded, self._raw_scores_to_proba(self.train_raw_scores_)))
+                if self.verbose:
+                    print(f"epoch #{epoch_i:3d}: log-loss = {self.loss_history[-1]:.4f}")
+                stop = False
+                if X_val is not None:
+                    for k, this_tree in enumerate(these_trees):
+                        val_raw_scores[:, k] += self.learning_rate * this_tree.value[this_tree.apply(X_val)]
+                    self.validation_loss_history.append(self._log_loss(y_val_encoded, self._raw_scores_to_proba(val_raw_scores)))
+                    stop = monitor.update(self.validation_loss_history[-1])
+                if callbacks:
+                    validation_logs = {'validation_loss': self.validation_loss_history[-1]} if X_val is not None else {}
+                    stop = callbacks.on_iteration_end(self, epoch_i, loss=self.loss_history[-1], **validation_logs) or stop
+                if stop:
+                    break
+        self.n_iter_ = len(self.trees_)
+        self.best_n_iter_ = len(self.trees_)
+        if self.n_iter_no_change is not None:
+            # only the epochs up to the lowest validation loss are kept (train_raw_scores_ are still those of all n_iter_ epochs)
+            self.best_n_iter_ = monitor.best_n_iter
+            self.trees_ = self.trees_[:self.best_n_iter_]
+            if self.verbose:
+                print(f"early stopping: {self.n_iter_} epochs run, the first {self.best_n_iter_} kept (validation log-loss = {monitor.best_loss:.4f})")
+        self.additive_model_ = self.export_additive_model()
+        if callbacks:
+            callbacks.on_fit_end(self)
+        self.fitted = True
+        return self
+
+    def export_additive_model(self):
+        """
+        packs all the trees into an additive_tree_model of the raw scores (one output per class for K > 2 classes)
+        """
+        n_raw_scores = len(self.raw_score0_)
+        trees = [this_tree for these_trees in self.trees_ for this_tree in these_trees]
+        return additive_tree_model(trees=trees, tree_weights=np.full(shape=(len(trees),), fill_value=self.learning_rate),
+                                   tree_outputs=None if n_raw_scores == 1 else np.tile(np.arange(n_raw_scores), len(self.trees_)),
+                                   intercept=self.raw_score0_[0] if n_raw_scores == 1 else self.raw_score0_)
+
+    @staticmethod
+    def _log_loss(y_encoded, proba):
+        return -np.mean(np.log(np.clip(proba[np.arange(len(y_encoded)), y_encoded], 1e-15, None)))
+
+    def _staged_raw_scores(self, X_test):
+        """
+        yields the raw scores after each epoch, each epoch adding its trees to those of the previous one
+        """
+        if type(X_test) in [pd.DataFrame, pd.Series]:
+            X_test = X_test.to_numpy()
+        raw_scores = np.tile(self.raw_score0_, (len(X_test), 1))
+        for these_trees in self.trees_:
+            for k, this_tree in enumerate(these_trees):
+                raw_scores[:, k] += self.learning_rate * this_tree.value[this_tree.apply(X_test)]
+            yield raw_scores
+
+    def decision_function(self, X_test):
+        """
+        the raw scores F(x): shape (n_samples,) of log-odds for 2 classes, or (n_samples, K)
+        """
+        return self.additive_model_.decision_function(X_test)
+
+    def predict_proba(self, X_test):
+        raw_scores = self.decision_function(X_test)
+        return self._raw_scores_to_proba(raw_scores.reshape(len(raw_scores), -1))
+
+    def staged_predict_proba(self, X_test):
+        """
+        yields the class probabilities after each epoch; the whole sequence costs one pass over the trees
+        """
+        for raw_scores in self._staged_raw_scores(X_test):
+            yield self._raw_scores_to_proba(raw_scores)
+
+    def predict(self, X_test):
+        return self.classes_[np.argmax(self.predict_proba(X_test), axis=1)]
+
+    def score(self, X_test, y_test):
+        if type(y_test) in [pd.DataFrame, pd.Series]:
+            y_test = y_test.to_numpy()
+        return np.mean(self.predict(X_test) == y_test)
+
+    def plot_loss_history(self):
+        import matplotlib.pyplot as plt
+        plt.figure(figsize=(5, 5))
+        plt.plot(range(1, len(self.loss_history) + 1), self.loss_history, label='GBM Training Loss')
+        plt.legend(loc=1)
+        plt.xlabel("Training Epoch #")
+        plt.ylabel("Log-loss")
+        plt.show()
 
 
 def gradient_boosting_classifier(*args, **kwargs):
@@ -389,11 +976,76 @@ class gradient_boosting_regressor_from_scratch(object):
 
     Instead, in GBM, the algo adds new models to descend the gradient (residuals) only.
     """
-    def __init__(self, max_iter=300, learning_rate=0.1):
+    def __init__(self, max_iter=300, learning_rate=0.1, max_depth=1, max_leaf_nodes=None, min_samples_leaf=5, splitter='best', max_bins=255, l2_regularization=0.0,
+                 sampling='uniform', subsample=1.0, top_rate=0.2, other_rate=0.1,
+                 n_iter_no_change=None, validation_fraction=0.1, tol=1e-4, random_state=1, n_jobs=1, callbacks=None, verbose=False):
+        """
+        learning_rate: the shrinkage applied to each weak learner's contribution to ŷ
+
+        max_depth, min_samples_leaf: of each weak learner (a regression tree); max_depth=1 is a decision stump
+
+        splitter: how each weak learner is fit
+            - 'best': a decision_tree_regressor_from_scratch on the raw X
+            - 'hist': X is binned once for all the epochs (at most max_bins bins per feature), and the splits are scored
+                      from per-bin histograms of the gradients and hessians (with l2_regularization on the leaf values);
+                      ŷ is updated from the leaf of each training row, rather than by predicting X again
+
+        max_leaf_nodes: the maximum number of leaves of each weak learner, grown best-first; only with splitter='hist'
+
+        sampling: the rows each weak learner is grown on (only with splitter='hist'); ŷ is still updated on all the rows
+            - 'uniform': a random subsample fraction of the rows, without replacement (subsample=1.0 = all the rows)
+            - 'goss': gradient-based one-side sampling; the top_rate fraction of the rows with the largest |gradient|,
+                      and a random other_rate fraction of the rest, scaled up by (1 - top_rate) / other_rate
+
+        n_iter_no_change: if not None, the training stops once the validation loss has not decreased by more than tol
+                          for n_iter_no_change epochs, and the model is truncated to its lowest epoch (best_n_iter_).
+                          The validation set is the eval_set of fit(), or else a held-out validation_fraction of the rows of X.
+
+        n_jobs: the number of threads over which the features of a node are scored (-1 = all the CPUs)
+
+        callbacks: a list of machlearn.utils.callback (e.g., progress_logger, checkpoint, early_stopping), called after every epoch
+                   with the training loss (and validation_loss, if any); one returning True stops the training there
+
+        verbose: whether to print the progress of every epoch; a progress_logger callback prints less often
+        """
+        if splitter not in ['best', 'hist']:
+            raise ValueError('splitter must be either best or hist')
+        if max_leaf_nodes is not None:
+            if splitter != 'hist':
+                raise ValueError("max_leaf_nodes requires splitter='hist'")
+            if max_leaf_nodes < 2:
+                raise ValueError('max_leaf_nodes must be at least 2')
+        if sampling not in ['uniform', 'goss']:
+            raise ValueError('sampling must be either uniform or goss')
+        if not 0 < subsample <= 1:
+            raise ValueError('subsample must be in (0, 1]')
+        if sampling == 'goss' and not (0 <= top_rate and 0 < other_rate and top_rate + other_rate <= 1):
+            raise ValueError('top_rate and other_rate must be fractions, with other_rate > 0 and top_rate + other_rate <= 1')
+        if (sampling == 'goss' or subsample < 1) and splitter != 'hist':
+            raise ValueError("row sampling requires splitter='hist'")
         self.max_iter = max_iter
         self.learning_rate = learning_rate
+        self.max_depth = max_depth
+        self.max_leaf_nodes = max_leaf_nodes
+        self.min_samples_leaf = min_samples_leaf
+        self.splitter = splitter
+        self.max_bins = max_bins
+        self.l2_regularization = l2_regularization
+        self.sampling = sampling
+        self.subsample = subsample
+        self.top_rate = top_rate
+        self.other_rate = other_rate
+        self.n_iter_no_change = n_iter_no_change
+        self.validation_fraction = validation_fraction
+        self.tol = tol
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+        self.callbacks = callbacks
+        self.verbose = verbose
         self.weak_learners = []
+        self.trees_ = [] # the decision_tree_arrays of the weak learners, in the order they were added
         self.loss_history = []
+        self.validation_loss_history = []
 
     def _y_pred(self):
         """
@@ -417,32 +1069,125 @@ class gradient_boosting_regressor_from_scratch(object):
         """
         return -(y - y_hat)
 
-    def fit(self, X, y):
+    def _sample_rows(self, rng, gradients):
+        """
+        Returns the sorted rows to grow the next weak learner on, and the multipliers of their gradients and hessians
+        (None if all 1), or (None, None) for all the rows
+        """
+        n_samples = len(gradients)
+        if self.sampling == 'goss':
+            n_top, n_other = int(self.top_rate * n_samples), max(int(self.other_rate * n_samples), 1)
+            is_top = np.zeros(shape=(n_samples,), dtype=bool)
+            if n_top > 0:
+                is_top[np.argpartition(-np.abs(gradients), n_top - 1)[:n_top]] = True # O(n), no full sort
+            other_rows = rng.choice(np.flatnonzero(~is_top), size=min(n_other, n_samples - n_top), replace=False)
+            multipliers = np.ones(shape=(n_samples,))
+            multipliers[other_rows] = (1 - self.top_rate) / self.other_rate
+            return np.sort(np.concatenate((np.flatnonzero(is_top), other_rows))), multipliers
+        if self.subsample < 1:
+            return np.sort(rng.choice(n_samples, size=max(int(self.subsample * n_samples), 1), replace=False)), None
+        return None, None
+
+    def fit(self, X, y, eval_set=None):
+        """
+        eval_set: (X_val, y_val), on which the validation loss is monitored (for early stopping with n_iter_no_change;
+                  otherwise only recorded in validation_loss_history)
+        """
+        if type(X) in [pd.DataFrame, pd.Series]:
+            X = X.to_numpy()
+        if type(y) in [pd.DataFrame, pd.Series]:
+            y = y.to_numpy()
+        rng = np.random.default_rng(self.random_state)
+        X_val = None
+        if self.n_iter_no_change is not None or eval_set is not None:
+            X, y, X_val, y_val = _validation_split(X, y, eval_set, self.validation_fraction, self.random_state)
+        self.weak_learners = []
+        self.trees_ = []
+        self.loss_history = []
+        self.validation_loss_history = []
         y_hat = np.array([y.mean()]*len(y)) # use average as the starting point for y_pred
         self.y_hat0_scalar = y.mean() # F0, feature
         loss = self._loss(y, y_hat).mean()
         self.loss_history.append(loss) # MSE/0.5
-        for epoch_i in range(self.max_iter):
-            # why is it called pseudo_residuals? I think it's because it's like the residuals from regression: y - y_hat, but it's actually from the gradient of the loss function, but from regression.
-            pseudo_residuals = -self._loss_gradient(y, y_hat)  # y - y_hat
-            print(f"epoch #{epoch_i:3d}: before adding a new weak learner, y[100] = {y[100]:.3f}, y_hat[100] = {y_hat[100]:.3f}, pseudo_residuals[100] = y - ŷ = {pseudo_residuals[100]:.3f}") # the index 100 is picked randomly
-            this_weak_learner = decision_tree_regressor_from_scratch(max_depth=1)
-            this_weak_learner.fit(X, pseudo_residuals) # The goal of each new weak learner is to try to explain the remaining residuals; thus the residual should get smaller over time, as the remaing part that is still left to be explained becomes smaller over time.
-            self.weak_learners.append(this_weak_learner)
-            # GB builds an additive model in a forward stage-wise fashion
-            # https://www.quora.com/Why-does-GBM-use-regression-on-pseudo-residuals
-            y_hat += self.learning_rate * this_weak_learner.predict(X)  # update ŷ to minimize y - ŷ
-            print("a new weak learner had been added to try to account for the remaining residuals, and that weak learner's contribution had been added to improve ŷ to get closer to y so that residuals get closer to 0.")
-            loss = self._loss(y, y_hat).mean()
-            self.loss_history.append(loss)
-        return
+        if X_val is not None:
+            y_val_hat = np.full(shape=(len(y_val),), fill_value=self.y_hat0_scalar) # updated by each new weak learner
+            self.validation_loss_history.append(self._loss(y_val, y_val_hat).mean())
+            monitor = _early_stopping_monitor(self.n_iter_no_change, self.tol, initial_loss=self.validation_loss_history[0])
+        if self.splitter == 'hist':
+            self.bin_mapper = histogram_bin_mapper(max_bins=self.max_bins).fit(X)
+            X_binned = self.bin_mapper.transform(X) # binned once, for all the epochs
+            hessians = np.ones(shape=(len(y),)) # the second derivative of 0.5 * (y - ŷ)^2 with respect to ŷ
+        row_i = min(100, len(y) - 1) # the row whose progress is printed with verbose=True
+        callbacks = _callback_list(self.callbacks)
+        if callbacks:
+            callbacks.on_fit_begin(self, len(y))
+        with _feature_thread_pool(self.n_jobs) as thread_pool:
+            for epoch_i in range(self.max_iter):
+                # why is it called pseudo_residuals? I think it's because it's like the residuals from regression: y - y_hat, but it's actually from the gradient of the loss function, but from regression.
+                pseudo_residuals = -self._loss_gradient(y, y_hat)  # y - y_hat
+                if self.verbose:
+                    print(f"epoch #{epoch_i:3d}: before adding a new weak learner, y[{row_i}] = {y[row_i]:.3f}, y_hat[{row_i}] = {y_hat[row_i]:.3f}, pseudo_residuals[{row_i}] = y - ŷ = {pseudo_residuals[row_i]:.3f}")
+                if self.splitter == 'hist':
+                    # each leaf predicts -G/(H + l2), the mean pseudo-residual when l2 = 0
+                    sample_indices, multipliers = self._sample_rows(rng, pseudo_residuals)
+                    gradients, these_hessians = -pseudo_residuals, hessians
+                    if multipliers is not None:
+                        gradients, these_hessians = gradients * multipliers, hessians * multipliers
+                    this_tree, leaf_indices = _grow_histogram_tree(X_binned=X_binned, bin_mapper=self.bin_mapper, gradients=gradients, hessians=these_hessians, sample_indices=sample_indices,
+                                                                   max_depth=self.max_depth, max_leaf_nodes=self.max_leaf_nodes, min_samples_leaf=self.min_samples_leaf,
+                                                                   l2_regularization=self.l2_regularization, grow_policy='depth_first' if self.max_leaf_nodes is None else 'best_first',
+                                                                   thread_pool=thread_pool)
+                    if sample_indices is not None:
+                        # only the rows the tree was not grown on are routed from the root
+                        unsampled_rows = np.flatnonzero(leaf_indices == -1)
+                        leaf_indices[unsampled_rows] = this_tree._route(X, node_indices=np.zeros(shape=(len(unsampled_rows),), dtype=np.intp), row_indices=unsampled_rows)
+                    self.trees_.append(this_tree)
+                    y_hat += self.learning_rate * this_tree.value[leaf_indices] # in place, without predicting X again
+                else:
+                    this_weak_learner = decision_tree_regressor_from_scratch(max_depth=self.max_depth, min_samples_leaf=self.min_samples_leaf, n_jobs=self.n_jobs)
+                    this_weak_learner.fit(X, pseudo_residuals) # The goal of each new weak learner is to try to explain the remaining residuals; thus the residual should get smaller over time, as the remaing part that is still left to be explained becomes smaller over time.
+                    self.weak_learners.append(this_weak_learner)
+                    self.trees_.append(this_weak_learner.tree_)
+                    # GB builds an additive model in a forward stage-wise fashion
+                    # https://www.quora.com/Why-does-GBM-use-regression-on-pseudo-residuals
+                    y_hat += self.learning_rate * this_weak_learner.predict(X)  # update ŷ to minimize y - ŷ
+                if self.verbose:
+                    print("a new weak learner had been added to try to account for the remaining residuals, and that weak learner's contribution had been added to improve ŷ to get closer to y so that residuals get closer to 0.")
+                loss = self._loss(y, y_hat).mean()
+                self.loss_history.append(loss)
+                stop = False
+                if X_val is not None:
+                    y_val_hat += self.learning_rate * self.trees_[-1].value[self.trees_[-1].apply(X_val)]
+                    self.validation_loss_history.append(self._loss(y_val, y_val_hat).mean())
+                    stop = monitor.update(self.validation_loss_history[-1])
+                if callbacks:
+                    validation_logs = {'validation_loss': self.validation_loss_history[-1]} if X_val is not None else {}
+                    stop = callbacks.on_iteration_end(self, epoch_i, loss=loss, **validation_logs) or stop
+                if stop:
+                    break
+        self.n_iter_ = len(self.trees_)
+        self.best_n_iter_ = len(self.trees_)
+        if self.n_iter_no_change is not None:
+            # only the weak learners up to the lowest validation loss are kept
+            self.best_n_iter_ = monitor.best_n_iter
+            self.trees_ = self.trees_[:self.best_n_iter_]
+            self.weak_learners = self.weak_learners[:self.best_n_iter_]
+            if self.verbose:
+                print(f"early stopping: {self.n_iter_} epochs run, the first {self.best_n_iter_} kept (validation loss = {monitor.best_loss:.4f})")
+        self.additive_model_ = self.export_additive_model()
+        if callbacks:
+            callbacks.on_fit_end(self)
+        return self
+
+    def export_additive_model(self):
+        """
+        packs all the weak learners, each weighted by learning_rate, into an additive_tree_model
+        """
+        return additive_tree_model(trees=self.trees_, tree_weights=np.full(shape=(len(self.trees_),), fill_value=self.learning_rate), intercept=self.y_hat0_scalar)
 
     def predict(self, X_test):
-        y_hat = np.array([self.y_hat0_scalar]*len(X_test)) # again, use the previous average as the starting point for y_pred
-        for this_weak_learner in self.weak_learners:
-            # GB builds an additive model in a forward stage-wise fashion
-            y_hat += self.learning_rate * this_weak_learner.predict(X_test)
-        return y_hat
+        # again, use the previous average as the starting point for y_pred; GB builds an additive model in a forward stage-wise fashion
+        return self.additive_model_.decision_function(X_test)
 
     def plot_loss_history(self):
         import matplotlib.pyplot as plt
@@ -466,7 +1211,8 @@ def _demo(dataset):
 
     if dataset == 'boston':
         # regressor example
-        GBM = gradient_boosting_regressor_from_scratch(max_iter=100)
+        from ..utils import progress_logger
+        GBM = gradient_boosting_regressor_from_scratch(max_iter=100, callbacks=[progress_logger(every=20)])
         from ..datasets import public_dataset
         df = public_dataset(name="boston")
         print(f"{df.head()}\n")
@@ -481,6 +1227,11 @@ def _demo(dataset):
         RMSE, R_squared = evaluate_continuous_prediction(y_test, GBM.predict(X_test))
         print(f"R_squared = {R_squared:.3f}, RMSE = {RMSE:.3f}")
 
+        print("\nThe histogram engine bins X once, and grows each weak learner from per-bin gradient/hessian sums:")
+        GBM_hist = gradient_boosting_regressor_from_scratch(max_iter=100, splitter='hist', max_depth=3).fit(X_train, y_train)
+        RMSE, R_squared = evaluate_continuous_prediction(y_test, GBM_hist.predict(X_test))
+        print(f"R_squared = {R_squared:.3f}, RMSE = {RMSE:.3f}")
+
     if dataset == 'Social_Network_Ads':
         from ..datasets import public_dataset
         data = public_dataset('Social_Network_Ads')
@@ -557,10 +1308,18 @@ def _demo(dataset):
         RF.fit(X_train,y_train)
         print(f"\nUse random_forest_classifier_from_scratch(n_trees=10, max_depth=2). Accuracy: {RF.score(X_test,y_test):.3f}")
 
+        ET = extra_trees_classifier_from_scratch(n_trees=10, max_depth=2)
+        ET.fit(X_train,y_train)
+        print(f"\nUse extra_trees_classifier_from_scratch(n_trees=10, max_depth=2). Accuracy: {ET.score(X_test,y_test):.3f}")
+
         AB = adaptive_boosting_classifier_from_scratch(max_iter=10)
         AB.fit(X_train, y_train)
         print(f"\nUse adaptive_boosting_classifier_from_scratch(max_iter=10). Accuracy: {AB.score(X_test,y_test):.3f}")
 
+        GBM = gradient_boosting_classifier_from_scratch(max_iter=10, max_depth=2)
+        GBM.fit(X_train, y_train)
+        print(f"\nUse gradient_boosting_classifier_from_scratch(max_iter=10, max_depth=2). Accuracy: {GBM.score(X_test,y_test):.3f}")
+
         ###################################################
 
         print("\ngenerate n_samples=10000")
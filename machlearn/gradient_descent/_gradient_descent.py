@@ -12,7 +12,11 @@ import torch.nn as nn
 
 class batch_gradient_descent(object):
 
-    def __init__(self, learning_rate=0.01, num_iter=100000, verbose=False, use_simplified_cost=False):
+    def __init__(self, learning_rate=0.01, num_iter=100000, verbose=False, use_simplified_cost=False, callbacks=None):
+        """
+        callbacks: a list of machlearn.utils.callback, called after every epoch with its cost as loss;
+                   one returning True stops the descent there, and the histories are cut to the epochs run
+        """
         super().__init__()
         self.X = None
         self.y = None
@@ -24,6 +28,7 @@ class batch_gradient_descent(object):
         self.num_iter = num_iter
         self.verbose = verbose
         self.use_simplified_cost = use_simplified_cost
+        self.callbacks = callbacks
         self.n_features = None
 
     # the following three functions are the core of BGD:
@@ -60,6 +65,11 @@ class batch_gradient_descent(object):
         self.cost_history = np.zeros(shape = self.num_iter)
         self.gradient_history = np.zeros(shape = (self.num_iter, self.n_features))
 
+        from ..utils._callbacks import _callback_list
+        callbacks = _callback_list(self.callbacks)
+        if callbacks:
+            callbacks.on_fit_begin(self, self.X.shape[0])
+
         # Note:
         # Batch gradient descent means that we calculate the error for each example in the training dataset, but update the model only after the entire training set has been evaluated.
         # One cycle through the entire training set is called a training epoch.
@@ -86,6 +96,15 @@ class batch_gradient_descent(object):
             if(self.verbose == True and epoch % 10000 == 0):
                 print(f"#epoch: {epoch}, cost: {self.cost:f}\n")
 
+            if callbacks and callbacks.on_iteration_end(self, epoch, loss=float(self.cost)):
+                self.theta_history = self.theta_history[:epoch+1]
+                self.cost_history = self.cost_history[:epoch+1]
+                self.gradient_history = self.gradient_history[:epoch+1]
+                break
+
+        if callbacks:
+            callbacks.on_fit_end(self)
+
     def predict_prob(self, X):
         pass
 
@@ -102,7 +121,7 @@ class batch_gradient_descent(object):
         import matplotlib.pyplot as plt
         # construct a figure that plots the loss over time
         plt.figure(figsize=(3, 3))
-        plt.plot(np.arange(0, self.num_iter), self.cost_history) #, label='BGD Training Loss')
+        plt.plot(np.arange(0, len(self.cost_history)), self.cost_history) #, label='BGD Training Loss')
         #plt.legend(loc=1)
         plt.xlabel("Training Epoch/Iteration #")
         plt.ylabel("Error/Cost/Loss, J(θ)")
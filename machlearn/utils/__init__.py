@@ -4,9 +4,16 @@
 #
 # License: BSD 3 clause
 
-from ._utils import convert_to_numpy_ndarray, convert_to_list, demo
+from ._utils import convert_to_numpy_ndarray, convert_to_list, effective_n_jobs, demo
+from ._callbacks import callback, progress_logger, timing_histogram, checkpoint, early_stopping
 
 # this is for "from <package_name>.utils import *"
 __all__ = ["convert_to_numpy_ndarray",
            "convert_to_list",
+           "effective_n_jobs",
+           "callback",
+           "progress_logger",
+           "timing_histogram",
+           "checkpoint",
+           "early_stopping",
            "demo",]
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+# Author: Daniel Yang <daniel.yj.yang@gmail.com>
+#
+# License: BSD 3 clause
+
+import os
+import pickle
+import time
+
+import numpy as np
+
+
+class callback(object):
+    """
+    The base class of the training callbacks, passed as callbacks=[...] to the from-scratch boosters and forests,
+    and to batch_gradient_descent.
+
+    Override any of:
+        - on_fit_begin(estimator, n_rows): before the first iteration, with the number of training rows
+        - on_iteration_end(estimator, logs): after every iteration (a boosting round, an epoch, or a tree); return True to stop there
+        - on_fit_end(estimator, logs): after the last iteration, with the logs of that iteration
+
+    logs is a dict of:
+        - iteration: the index of the iteration, from 0
+        - elapsed_time: the seconds since the fit began; iteration_time: the seconds spent on this iteration
+        - rows_per_second: the training rows processed per second in this iteration
+        - whatever the learner reports, e.g., loss, validation_loss, or error
+    """
+
+    def on_fit_begin(self, estimator, n_rows):
+        pass
+
+    def on_iteration_end(self, estimator, logs):
+        return False
+
+    def on_fit_end(self, estimator, logs):
+        pass
+
+
+class _callback_list(object):
+    """
+    Dispatches to the callbacks of a learner, and times its iterations.
+    It is falsy without callbacks, so that a learner can skip it with 'if callbacks: ...'.
+    """
+
+    def __init__(self, callbacks=None):
+        self.callbacks = list(callbacks) if callbacks is not None else []
+        self.logs = {}
+
+    def __bool__(self):
+        return len(self.callbacks) > 0
+
+    def on_fit_begin(self, estimator, n_rows):
+        self.n_rows = n_rows
+        self.fit_start_time = self.last_time = time.perf_counter()
+        self.logs = {}
+        for this_callback in self.callbacks:
+            this_callback.on_fit_begin(estimator, n_rows)
+
+    def on_iteration_end(self, estimator, iteration, **learner_logs):
+        """
+        returns True if any callback asks to stop; every callback still sees the iteration
+        """
+        now = time.perf_counter()
+        iteration_time, self.last_time = now - self.last_time, now
+        self.logs = dict(iteration=iteration, elapsed_time=now - self.fit_start_time, iteration_time=iteration_time,
+                         rows_per_second=self.n_rows / iteration_time if iteration_time > 0 else float('inf'), **learner_logs)
+        stop = False
+        for this_callback in self.callbacks:
+            stop = bool(this_callback.on_iteration_end(estimator, self.logs)) or stop
+        return stop
+
+    def on_fit_end(self, estimator):
+        for this_callback in self.callbacks:
+            this_callback.on_fit_end(estimator, self.logs)
+
+
+class _early_stopping_monitor(object):
+    """
+    Tracks a loss over the iterations of a learner: best_n_iter, the number of iterations with the lowest loss so far
+    (by more than tol), and whether n_iter_no_change iterations have passed since then.
+    initial_loss: the loss before the first iteration, so that the best can be none of them
+    """
+
+    def __init__(self, n_iter_no_change, tol, initial_loss=float('inf')):
+        self.n_iter_no_change = n_iter_no_change
+        self.tol = tol
+        self.best_loss = initial_loss
+        self.best_n_iter = 0
+        self.n_iter = 0
+
+    def update(self, loss):
+        """
+        records the loss after one more iteration, and returns True if the learner should stop
+        """
+        self.n_iter += 1
+        if loss < self.best_loss - self.tol:
+            self.best_loss, self.best_n_iter = loss, self.n_iter
+        return self.n_iter_no_change is not None and self.n_iter - self.best_n_iter >= self.n_iter_no_change
+
+
+class progress_logger(callback):
+    """
+    Prints the logs every `every` iterations (and after the last one), through print_function (e.g., a logging.Logger's info)
+    """
+
+    def __init__(self, every=1, print_function=print):
+        self.every = every
+        self.print_function = print_function
+
+    def _print(self, logs):
+        learner_logs = ', '.join(f"{key} = {value:.4f}" for key, value in logs.items() if key not in ['iteration', 'elapsed_time', 'iteration_time', 'rows_per_second'])
+        self.print_function(f"iteration #{logs['iteration']}: {learner_logs + ', ' if learner_logs else ''}elapsed = {logs['elapsed_time']:.3f}s, {logs['rows_per_second']:,.0f} rows/s")
+
+    def on_iteration_end(self, estimator, logs):
+        if (logs['iteration'] + 1) % self.every == 0:
+            self._print(logs)
+        return False
+
+    def on_fit_end(self, estimator, logs):
+        if logs and (logs['iteration'] + 1) % self.every != 0:
+            self._print(logs)
+
+
+class timing_histogram(callback):
+    """
+    Records the seconds of every iteration in iteration_times; see histogram() and summary()
+    """
+
+    def __init__(self):
+        self.iteration_times = []
+
+    def on_fit_begin(self, estimator, n_rows):
+        self.iteration_times = []
+
+    def on_iteration_end(self, estimator, logs):
+        self.iteration_times.append(logs['iteration_time'])
+        return False
+
+    def histogram(self, bins=10):
+        """
+        returns (counts, bin_edges), as np.histogram()
+        """
+        return np.histogram(self.iteration_times, bins=bins)
+
+    def summary(self):
+        iteration_times = np.array(self.iteration_times)
+        if iteration_times.size == 0:
+            return {}
+        return {'n_iterations': iteration_times.size, 'total': iteration_times.sum(), 'mean': iteration_times.mean(), 'median': np.median(iteration_times),
+                'p95': np.percentile(iteration_times, 95), 'max': iteration_times.max()}
+
+
+class checkpoint(callback):
+    """
+    Pickles the estimator to path every `every` iterations, and after the last one.
+    The file is written to path + '.tmp' and then renamed, so that path always holds a complete checkpoint.
+    """
+
+    def __init__(self, path, every=10):
+        self.path = path
+        self.every = every
+
+    def _save(self, estimator):
+        with open(self.path + '.tmp', 'wb') as f:
+            pickle.dump(estimator, f)
+        os.replace(self.path + '.tmp', self.path)
+
+    def on_iteration_end(self, estimator, logs):
+        if (logs['iteration'] + 1) % self.every == 0:
+            self._save(estimator)
+        return False
+
+    def on_fit_end(self, estimator, logs):
+        if not logs or (logs['iteration'] + 1) % self.every != 0: # unless the last iteration was just saved
+            self._save(estimator)
+
+
+class early_stopping(callback):
+    """
+    Stops the learner once logs[monitor] (e.g., 'loss' or 'validation_loss') has not decreased by more than tol
+    for n_iter_no_change iterations; unlike the boosters' own n_iter_no_change, all the iterations run are kept.
+    """
+
+    def __init__(self, monitor='loss', n_iter_no_change=10, tol=1e-4):
+        self.monitor = monitor
+        self.n_iter_no_change = n_iter_no_change
+        self.tol = tol
+
+    def on_fit_begin(self, estimator, n_rows):
+        self.monitor_ = _early_stopping_monitor(self.n_iter_no_change, self.tol)
+
+    def on_iteration_end(self, estimator, logs):
+        if self.monitor not in logs:
+            raise ValueError(f"{self.monitor} is not reported by {type(estimator).__name__}, whose logs have: {list(logs.keys())}")
+        return self.monitor_.update(logs[self.monitor])
@@ -35,6 +35,23 @@ def convert_to_list(X):
     raise TypeError(f"Unknown type of X: {type_X}")
 
 
+def effective_n_jobs(n_jobs=1):
+    """
+    The number of workers that n_jobs asks for:
+        - 1 or None: serial
+        - -1: all the CPUs; -2: all the CPUs but one, and so on
+        - a positive integer: that many workers
+    """
+    if n_jobs is None:
+        return 1
+    if n_jobs == 0:
+        raise ValueError("n_jobs cannot be 0")
+    if n_jobs < 0:
+        import os
+        return max(os.cpu_count() + 1 + n_jobs, 1)
+    return int(n_jobs)
+
+
 def demo():
     """
     This function provides a demo of selected functions in this module.
@@ -11,6 +11,8 @@ DT.demo_from_scratch(question_type="regression")
 
 DT.demo_metrics()
 
+DT.demo_compile()
+
 DT.demo(dataset = "iris", classifier_func = "decision_tree")
 DT.demo(dataset = "bank_note_authentication", classifier_func = "decision_tree")
 
@@ -19,3 +21,142 @@ DT.demo(dataset = "Social_Network_Ads", classifier_func = "random_forest")
 DT.demo(dataset = "Social_Network_Ads", classifier_func = "bagging")
 DT.demo(dataset = "Social_Network_Ads", classifier_func = "AdaBoost")
 DT.demo(dataset = "Social_Network_Ads", classifier_func = "GBM")
+
+import numpy as np
+from scipy import sparse
+from sklearn.datasets import make_classification
+
+# sparse X: the same tree, and the same predictions, as from the dense X
+X, y = make_classification(n_samples=300, n_features=8, n_informative=4, random_state=1)
+X[np.abs(X) < 1.0] = 0.0
+tree_dense = DT.decision_tree_classifier_from_scratch(max_depth=5).fit(X, y)
+tree_sparse = DT.decision_tree_classifier_from_scratch(max_depth=5).fit(sparse.csr_matrix(X), y)
+arrays_dense, arrays_sparse = tree_dense.tree_, tree_sparse.tree_
+assert np.array_equal(arrays_dense.feature, arrays_sparse.feature) and np.array_equal(arrays_dense.threshold, arrays_sparse.threshold, equal_nan=True)
+assert np.array_equal(tree_sparse.predict(sparse.csr_matrix(X)), tree_dense.predict(X))
+print(f"decision tree on sparse X: {sparse.csr_matrix(X).nnz} stored entries, accuracy = {np.mean(tree_sparse.predict(sparse.csr_matrix(X)) == y):.3f}")
+
+# categorical features: a 0/1 feature splits as the numeric one does; with more categories, compile(batch=True) and grow_policy='level_wise' agree with predict()
+X_binary = np.column_stack((X[:, :4], (X[:, 4] > 0).astype(float)))
+tree_numeric = DT.decision_tree_classifier_from_scratch(max_depth=4).fit(X_binary, y)
+tree_categorical = DT.decision_tree_classifier_from_scratch(max_depth=4, categorical_features=[4]).fit(X_binary, y)
+assert np.array_equal(tree_categorical.predict(X_binary), tree_numeric.predict(X_binary))
+X_codes = np.column_stack((X[:, :4], np.digitize(X[:, 4], [-1.5, -0.5, 0.5, 1.5]), np.digitize(X[:, 5], [-1.0, 0.0, 1.0])))
+tree_categorical = DT.decision_tree_classifier_from_scratch(max_depth=5, categorical_features=[4, 5]).fit(X_codes, y)
+tree_level_wise = DT.decision_tree_classifier_from_scratch(max_depth=5, categorical_features=[4, 5], grow_policy='level_wise').fit(X_codes, y)
+assert np.array_equal(tree_categorical.compile(batch=True)(X_codes), tree_categorical.predict(X_codes))
+assert np.array_equal(tree_level_wise.predict(X_codes), tree_categorical.predict(X_codes))
+print(f"decision tree with categorical features: accuracy = {np.mean(tree_categorical.predict(X_codes) == y):.3f}")
+
+# the presorted decision stump: the split and leaves of decision_tree_classifier_from_scratch(max_depth=1), and it always splits an impure root
+stump = DT.decision_stump_classifier_from_scratch().fit(X, y)
+tree_depth1 = DT.decision_tree_classifier_from_scratch(max_depth=1).fit(X, y)
+assert stump.tree_.feature[0] == tree_depth1.tree_.feature[0] and np.isclose(stump.tree_.threshold[0], tree_depth1.tree_.threshold[0])
+assert np.allclose(stump.predict_proba(X), tree_depth1.predict_proba(X))
+stump = DT.decision_stump_classifier_from_scratch().fit(np.array([[0.0], [0.0], [1.0]]), np.array([0, 1, 1]), sample_weight=np.array([1.0, 1.0, 10.0]))
+assert stump.tree_.feature[0] == 0 and np.isclose(stump.tree_.threshold[0], 0.5)
+
+# the sorted sweep: the best cutoff of a feature is the one found by scoring every distinct x value one at a time
+X, y = make_classification(n_samples=200, n_features=6, n_informative=3, random_state=2)
+x, sample_weight = np.round(X[:, 0], 1), np.random.default_rng(0).uniform(0.5, 2.0, size=len(y))
+def weighted_entropy(rows):
+    return DT.Entropy([sample_weight[rows & (y == 0)].sum(), sample_weight[rows & (y == 1)].sum()])
+x_values = np.unique(x)
+impurities = [(np.sum(x <= x_value) * weighted_entropy(x <= x_value) + np.sum(x > x_value) * weighted_entropy(x > x_value)) / len(y) for x_value in x_values]
+x_cutoff_value, best_impurity, _, _ = DT.decision_tree_classifier_from_scratch().find_best_split_in_one_specific_feature(x, y, sample_weight=sample_weight)
+assert np.isclose(best_impurity, min(impurities)) and x_values[np.argmin(impurities)] < x_cutoff_value < x_values[np.argmin(impurities) + 1]
+
+# the prefix-sum variance sweep: the root split of a regression stump is the one found by scoring every feature and x value one at a time
+X_reg = np.random.default_rng(1).normal(size=(150, 3))
+y_reg = X_reg[:, 1] ** 2 + 0.5 * X_reg[:, 2] + np.random.default_rng(2).normal(scale=0.1, size=150)
+scores = np.array([[np.inf if min(np.sum(x <= x_value), np.sum(x > x_value)) < 5 else np.var(y_reg[x <= x_value]) * np.sum(x <= x_value) + np.var(y_reg[x > x_value]) * np.sum(x > x_value)
+                    for x_value in np.sort(x)] for x in X_reg.T])
+stump = DT.decision_tree_regressor_from_scratch(max_depth=1, min_samples_leaf=5).fit(X_reg, y_reg)
+best_feature_i, best_value_i = np.unravel_index(np.argmin(scores), scores.shape)
+assert stump.tree_.feature[0] == best_feature_i and stump.tree_.threshold[0] == np.sort(X_reg[:, best_feature_i])[best_value_i]
+
+# the flat arrays: a whole batch routed through tree_ ends up in the same leaves as each row walking down the fitted nodes
+tree = DT.decision_tree_classifier_from_scratch(max_depth=6).fit(X, y)
+assert np.allclose(tree.predict_proba(X), np.array([tree._predict(X_row, proba=True) for X_row in X]))
+regressor = DT.decision_tree_regressor_from_scratch(max_depth=4).fit(X_reg, y_reg)
+assert np.allclose(regressor.predict(X_reg), [regressor.DT_root_node.predict_row(X_row) for X_row in X_reg])
+
+# the index partition: each child of the root is split as a tree fit on a copy of its rows would split its root,
+# and every split node has two children, each reached by some of the training rows
+arrays = tree.tree_
+goes_left = X[:, arrays.feature[0]] <= arrays.threshold[0]
+for child_i, child_rows in [(arrays.left[0], goes_left), (arrays.right[0], ~goes_left)]:
+    tree_of_child = DT.decision_tree_classifier_from_scratch(max_depth=1).fit(X[child_rows], y[child_rows])
+    assert arrays.feature[child_i] == tree_of_child.tree_.feature[0] and np.isclose(arrays.threshold[child_i], tree_of_child.tree_.threshold[0])
+    assert tree.find_best_split_across_all_features(X, y, sample_indices=np.flatnonzero(child_rows))[:3] == tree_of_child.find_best_split_across_all_features(X[child_rows], y[child_rows])[:3]
+assert np.array_equal(arrays.left == -1, arrays.right == -1)
+assert set(np.flatnonzero(arrays.left == -1)) == set(tree.apply(X))
+
+# the histogram splitter: on integer-valued X, with fewer distinct values than max_bins, binning loses nothing,
+# so splitter='hist' grows the same trees as splitter='best' (up to thresholds between values that a node does not hold)
+X_int = np.round(X * 3)
+tree_best = DT.decision_tree_classifier_from_scratch(max_depth=5).fit(X_int, y)
+tree_hist = DT.decision_tree_classifier_from_scratch(max_depth=5, splitter='hist').fit(X_int, y)
+assert np.array_equal(tree_hist.tree_.feature, tree_best.tree_.feature) and np.array_equal(tree_hist.apply(X_int), tree_best.apply(X_int))
+X_reg_int = np.round(X_reg * 3)
+regressor_best = DT.decision_tree_regressor_from_scratch(max_depth=4).fit(X_reg_int, y_reg)
+regressor_hist = DT.decision_tree_regressor_from_scratch(max_depth=4, splitter='hist').fit(X_reg_int, y_reg)
+assert np.allclose(regressor_hist.predict(X_reg_int), regressor_best.predict(X_reg_int))
+# sibling subtraction: the histograms of one child are those of its parent minus those of the other child
+from machlearn.decision_tree._histogram import _build_histograms, _sibling_histograms
+bin_mapper = DT.histogram_bin_mapper().fit(X_int)
+X_binned, stats = bin_mapper.transform(X_int), np.column_stack((y == 0, y == 1, sample_weight * (y == 0), sample_weight * (y == 1)))
+left_rows, right_rows = np.flatnonzero(X_int[:, 1] <= 0), np.flatnonzero(X_int[:, 1] > 0)
+parent_histograms, left_histograms = _build_histograms(X_binned, np.arange(len(y)), stats, bin_mapper.n_bins_), _build_histograms(X_binned, left_rows, stats, bin_mapper.n_bins_)
+assert np.allclose(_sibling_histograms(parent_histograms, left_histograms, count_stats=((0, 2), (1, 3))), _build_histograms(X_binned, right_rows, stats, bin_mapper.n_bins_))
+tree_best = DT.decision_tree_classifier_from_scratch(max_depth=5).fit(X_int, y, sample_weight=sample_weight)
+tree_hist = DT.decision_tree_classifier_from_scratch(max_depth=5, splitter='hist').fit(X_int, y, sample_weight=sample_weight)
+assert np.array_equal(tree_hist.tree_.feature, tree_best.tree_.feature) and np.array_equal(tree_hist.apply(X_int), tree_best.apply(X_int))
+
+# the features of a node scored over 2 threads: the same trees as from 1 thread
+for n_jobs in [2, -1]:
+    assert np.array_equal(DT.decision_tree_classifier_from_scratch(max_depth=6, n_jobs=n_jobs).fit(X, y).apply(X), tree.apply(X))
+    assert np.array_equal(DT.decision_tree_regressor_from_scratch(max_depth=4, n_jobs=n_jobs).fit(X_reg, y_reg).predict(X_reg), regressor.predict(X_reg))
+
+# level-wise growth: the same trees as depth-first growth (numbered level by level), on unweighted data
+tree_level_wise = DT.decision_tree_classifier_from_scratch(max_depth=6, grow_policy='level_wise').fit(X, y)
+assert tree_level_wise.tree_.n_nodes == tree.tree_.n_nodes and np.allclose(tree_level_wise.predict_proba(X), tree.predict_proba(X))
+regressor_level_wise = DT.decision_tree_regressor_from_scratch(max_depth=4, grow_policy='level_wise').fit(X_reg, y_reg)
+assert regressor_level_wise.tree_.n_nodes == regressor.tree_.n_nodes and np.allclose(regressor_level_wise.predict(X_reg), regressor.predict(X_reg))
+
+# best-first growth: the same tree as depth-first growth without a leaf budget, and max_leaf_nodes leaves with one;
+# every split decreases the impurity by at least min_impurity_decrease, as (node rows / all rows) * (node impurity - weighted children impurity)
+tree_best_first = DT.decision_tree_classifier_from_scratch(max_depth=6, grow_policy='best_first').fit(X, y)
+assert tree_best_first.tree_.n_nodes == tree.tree_.n_nodes and np.allclose(tree_best_first.predict_proba(X), tree.predict_proba(X))
+assert np.sum(DT.decision_tree_classifier_from_scratch(max_depth=6, grow_policy='best_first', max_leaf_nodes=8).fit(X, y).tree_.left == -1) == 8
+for grow_policy in ['depth_first', 'level_wise', 'best_first']:
+    arrays = DT.decision_tree_classifier_from_scratch(max_depth=6, grow_policy=grow_policy, min_impurity_decrease=0.01).fit(X, y).tree_
+    rows_of_node = {0: np.ones(shape=(len(y),), dtype=bool)}
+    for node_i in np.flatnonzero(arrays.left != -1): # children always come after their parent
+        goes_left = X[:, arrays.feature[node_i]] <= arrays.threshold[node_i]
+        rows_of_node[arrays.left[node_i]], rows_of_node[arrays.right[node_i]] = rows_of_node[node_i] & goes_left, rows_of_node[node_i] & ~goes_left
+    entropy = {node_i: DT.Entropy(np.bincount(y[rows], minlength=2)) * rows.sum() / len(y) for node_i, rows in rows_of_node.items()}
+    assert all(entropy[node_i] - entropy[arrays.left[node_i]] - entropy[arrays.right[node_i]] >= 0.01 for node_i in np.flatnonzero(arrays.left != -1))
+    assert np.sum(arrays.left == -1) < np.sum(tree.tree_.left == -1)
+
+# the vectorized impurities: a matrix of class counts gives, row by row, the impurities of each of its rows
+class_sums = np.array([[194, 106], [3, 0], [0, 0], [2.5, 2.5], [1, 7]])
+p = class_sums / np.maximum(class_sums.sum(axis=1, keepdims=True), 1)
+assert np.allclose(DT.Entropy(class_sums), [DT.Entropy(row) for row in class_sums]) and np.allclose(DT.Entropy(class_sums), -np.sum(np.where(p > 0, p * np.log2(np.where(p > 0, p, 1)), 0), axis=1))
+assert np.allclose(DT.Gini_impurity(class_sums), [DT.Gini_impurity(row) for row in class_sums]) and np.allclose(DT.Gini_impurity(class_sums)[[0, 1, 3, 4]], 1 - np.sum(p ** 2, axis=1)[[0, 1, 3, 4]])
+# the class labels, encoded once at fit: labels other than 0 and 1 give the same tree
+tree_labels = DT.decision_tree_classifier_from_scratch(max_depth=6).fit(X, np.where(y == 1, 'yes', 'no'))
+assert np.array_equal(tree_labels.predict(X), np.where(tree.predict(X) == 1, 'yes', 'no'))
+
+# multiclass: one tree for the 3 classes, whose root split is the one found by scoring every feature and cutoff one at a time,
+# and whose leaves hold the class frequencies of their training rows
+X3, y3 = make_classification(n_samples=300, n_features=6, n_informative=4, n_classes=3, random_state=1)
+X3 = np.round(X3, 1)
+def split_entropy(x, x_value):
+    return (np.sum(x <= x_value) * DT.Entropy(np.bincount(y3[x <= x_value], minlength=3)) + np.sum(x > x_value) * DT.Entropy(np.bincount(y3[x > x_value], minlength=3))) / len(y3)
+_, best_feature_i, best_x_value = min((split_entropy(x, x_value), feature_i, x_value) for feature_i, x in enumerate(X3.T) for x_value in np.unique(x)[:-1])
+tree3 = DT.decision_tree_classifier_from_scratch(max_depth=5).fit(X3, y3)
+assert tree3.tree_.feature[0] == best_feature_i and best_x_value < tree3.tree_.threshold[0] < np.min(X3[X3[:, best_feature_i] > best_x_value, best_feature_i])
+leaves = tree3.apply(X3)
+assert np.allclose(tree3.predict_proba(X3), np.array([np.bincount(y3[leaves == leaf], minlength=3) / np.sum(leaves == leaf) for leaf in leaves]))
+print(f"decision tree with 3 classes: accuracy = {np.mean(tree3.predict(X3) == y3):.3f}")
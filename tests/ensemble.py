@@ -4,8 +4,121 @@
 #
 # License: BSD 3 clause
 
+import numpy as np
+from sklearn.datasets import make_classification
+
 from machlearn import ensemble
 
 ensemble.demo("randomly_generated")
 ensemble.demo("Social_Network_Ads")
 ensemble.demo("boston")
+
+X, y = make_classification(n_samples=300, n_features=6, n_informative=4, random_state=1)
+
+# out-of-bag estimates: the class probabilities averaged over the trees for which each row is out of bag
+RF = ensemble.random_forest_classifier_from_scratch(n_trees=10, bootstrap=True, oob_score=True, max_depth=5).fit(X, y)
+is_out_of_bag = ~np.unpackbits(RF.in_bag_bitsets_, axis=1, count=len(y)).astype(bool)
+trees_proba = np.array([tree.predict_proba(X) for tree in RF.trees])
+has_oob = is_out_of_bag.any(axis=0)
+oob_proba = np.einsum('tnc,tn->nc', trees_proba, is_out_of_bag)[has_oob] / is_out_of_bag.sum(axis=0)[has_oob, np.newaxis]
+assert np.allclose(oob_proba, RF.oob_decision_function_[has_oob])
+assert np.allclose(RF.predict_proba(X), trees_proba.mean(axis=0))
+print(f"random forest: oob_score_ = {RF.oob_score_:.3f}")
+
+# warm start: growing a 5-tree forest to 10 trees gives the same forest as fitting 10 trees at once
+RF_warm = ensemble.random_forest_classifier_from_scratch(n_trees=5, warm_start=True, max_depth=5).fit(X, y)
+RF_warm.n_trees = 10
+RF_warm.fit(X, y)
+RF_cold = ensemble.random_forest_classifier_from_scratch(n_trees=10, max_depth=5).fit(X, y)
+assert np.allclose(RF_warm.predict_proba(X), RF_cold.predict_proba(X))
+assert np.isclose(RF_cold.staged_score(X, y)[-1], RF_cold.score(X, y))
+
+# gradient boosting classifier: the last staged probabilities are those of the packed additive model, for 2 and 3 classes
+X3, y3 = make_classification(n_samples=300, n_features=6, n_informative=4, n_classes=3, random_state=1)
+for X_k, y_k in [(X, y), (X3, y3)]:
+    GBM = ensemble.gradient_boosting_classifier_from_scratch(max_iter=20).fit(X_k, y_k)
+    staged_proba = list(GBM.staged_predict_proba(X_k))
+    assert len(staged_proba) == 20 and np.allclose(staged_proba[-1], GBM.predict_proba(X_k))
+    print(f"gradient boosting classifier ({len(GBM.classes_)} classes): accuracy = {GBM.score(X_k, y_k):.3f}")
+
+# callbacks: the checkpoint holds the fitted forest, and a booster stopped early is the same as one fit for that many epochs
+import os
+import pickle
+import tempfile
+from machlearn.utils import checkpoint, early_stopping, timing_histogram
+with tempfile.TemporaryDirectory() as temp_dir:
+    timer = timing_histogram()
+    RF = ensemble.random_forest_classifier_from_scratch(n_trees=10, max_depth=5, callbacks=[checkpoint(os.path.join(temp_dir, 'RF.pkl'), every=3), timer]).fit(X, y)
+    with open(os.path.join(temp_dir, 'RF.pkl'), 'rb') as f:
+        assert np.allclose(pickle.load(f).predict_proba(X), RF.predict_proba(X))
+    assert timer.summary()['n_iterations'] == 10
+GBM_stopped = ensemble.gradient_boosting_classifier_from_scratch(max_iter=50, callbacks=[early_stopping(monitor='loss', n_iter_no_change=2, tol=0.05)]).fit(X, y)
+GBM_short = ensemble.gradient_boosting_classifier_from_scratch(max_iter=len(GBM_stopped.trees_)).fit(X, y)
+assert len(GBM_stopped.trees_) < 50 and np.allclose(GBM_stopped.predict_proba(X), GBM_short.predict_proba(X))
+
+# extra trees: the same forest whatever n_jobs, and its predict_proba is the mean of its splitter='random' trees
+ET = ensemble.extra_trees_classifier_from_scratch(n_trees=8, max_depth=4).fit(X, y)
+ET_parallel = ensemble.extra_trees_classifier_from_scratch(n_trees=8, max_depth=4, n_jobs=2).fit(X, y)
+assert np.allclose(ET.predict_proba(X), ET_parallel.predict_proba(X))
+assert np.allclose(ET.predict_proba(X), np.mean([tree.predict_proba(X) for tree in ET.trees], axis=0))
+print(f"extra trees: accuracy = {ET.score(X, y):.3f}")
+
+# per-tree random streams: with a fixed random_state, the same forest from 1 or 2 worker processes,
+# each tree being the one fit from its own child of SeedSequence(random_state)
+RF = ensemble.random_forest_classifier_from_scratch(n_trees=6, bootstrap=True, max_depth=5, random_state=3).fit(X, y)
+RF_parallel = ensemble.random_forest_classifier_from_scratch(n_trees=6, bootstrap=True, max_depth=5, random_state=3, n_jobs=2).fit(X, y)
+assert np.array_equal(RF_parallel.in_bag_bitsets_, RF.in_bag_bitsets_) and np.allclose(RF_parallel.predict_proba(X), RF.predict_proba(X))
+tree_seeds = np.random.SeedSequence(3).spawn(6)
+assert all(np.array_equal(RF.fit_a_single_decision_tree(tree_seed=tree_seeds[tree_i]).apply(X), RF.trees[tree_i].apply(X)) for tree_i in range(6))
+assert not np.array_equal(ensemble.random_forest_classifier_from_scratch(n_trees=6, bootstrap=True, max_depth=5, random_state=4).fit(X, y).in_bag_bitsets_, RF.in_bag_bitsets_)
+
+# the forest-wide prediction: the leaves, votes, and probabilities of one batched pass (in chunks of any size) are those of the trees one by one
+RF3 = ensemble.random_forest_classifier_from_scratch(n_trees=7, max_depth=5, sample_size_factor=0.7).fit(X3, y3)
+trees_leaves = np.column_stack([tree.apply(X3) for tree in RF3.trees])
+assert np.array_equal(RF3.forest_.apply(X3, max_pairs_per_chunk=50) - RF3.forest_.roots, trees_leaves)
+trees_votes = np.array([tree.predict(X3) for tree in RF3.trees])
+assert np.array_equal(RF3.predict(X3), [np.argmax(np.bincount(votes, minlength=3)) for votes in trees_votes.T])
+assert np.allclose(RF3.predict_proba(X3), np.mean([tree.predict_proba(X3) for tree in RF3.trees], axis=0))
+assert np.allclose(RF3._sum_leaf_probabilities(X3, max_pairs_per_chunk=50), RF3._sum_leaf_probabilities(X3))
+
+# the histogram GBM engine: on integer-valued X, whose bins lose nothing, the same depth-1 model as the exact engine
+from sklearn.datasets import make_regression
+X_reg, y_reg = make_regression(n_samples=300, n_features=5, n_informative=3, noise=5.0, random_state=1)
+X_reg = np.round(X_reg * 4)
+GBM_exact = ensemble.gradient_boosting_regressor_from_scratch(max_iter=30).fit(X_reg, y_reg)
+GBM_hist = ensemble.gradient_boosting_regressor_from_scratch(max_iter=30, splitter='hist').fit(X_reg, y_reg)
+assert np.allclose(GBM_hist.predict(X_reg), GBM_exact.predict(X_reg)) and np.allclose(GBM_hist.loss_history, GBM_exact.loss_history)
+
+# early stopping: the boosters keep their first best_n_iter_ epochs, the same as boosters fit for that many epochs
+X_val, y_val = X_reg[:100], y_reg[:100]
+GBM_stopped = ensemble.gradient_boosting_regressor_from_scratch(max_iter=300, splitter='hist', max_depth=3, n_iter_no_change=5).fit(X_reg[100:], y_reg[100:], eval_set=(X_val, y_val))
+assert GBM_stopped.n_iter_ < 300 and GBM_stopped.best_n_iter_ == np.argmin(GBM_stopped.validation_loss_history) and len(GBM_stopped.trees_) == GBM_stopped.best_n_iter_
+GBM_short = ensemble.gradient_boosting_regressor_from_scratch(max_iter=GBM_stopped.best_n_iter_, splitter='hist', max_depth=3).fit(X_reg[100:], y_reg[100:])
+assert np.allclose(GBM_stopped.predict(X_val), GBM_short.predict(X_val))
+y_signed = 2 * y - 1 # AdaBoost takes y in {-1, 1}
+AdaBoost_stopped = ensemble.adaptive_boosting_classifier_from_scratch(max_iter=200, n_iter_no_change=5).fit(X[100:], y_signed[100:], eval_set=(X[:100], y_signed[:100]))
+AdaBoost_short = ensemble.adaptive_boosting_classifier_from_scratch(max_iter=AdaBoost_stopped.best_n_iter_).fit(X[100:], y_signed[100:])
+assert AdaBoost_stopped.best_n_iter_ < 200 and np.allclose(AdaBoost_stopped.additive_model_.decision_function(X), AdaBoost_short.additive_model_.decision_function(X))
+
+# row sampling: GOSS keeping all the rows (top_rate + other_rate = 1, so the others are not scaled up), or subsample=1.0,
+# grows the same model as no sampling; a subsample of the rows is reproducible from random_state
+GBM_hist = ensemble.gradient_boosting_regressor_from_scratch(max_iter=30, splitter='hist', max_depth=3).fit(X_reg, y_reg)
+GBM_goss = ensemble.gradient_boosting_regressor_from_scratch(max_iter=30, splitter='hist', max_depth=3, sampling='goss', top_rate=0.5, other_rate=0.5).fit(X_reg, y_reg)
+GBM_full = ensemble.gradient_boosting_regressor_from_scratch(max_iter=30, splitter='hist', max_depth=3, subsample=1.0).fit(X_reg, y_reg)
+assert np.allclose(GBM_goss.predict(X_reg), GBM_hist.predict(X_reg)) and np.allclose(GBM_full.predict(X_reg), GBM_hist.predict(X_reg))
+for sampling_params in [{'subsample': 0.5}, {'sampling': 'goss'}]:
+    GBM_sampled = ensemble.gradient_boosting_regressor_from_scratch(max_iter=30, splitter='hist', max_depth=3, random_state=5, **sampling_params).fit(X_reg, y_reg)
+    GBM_sampled_again = ensemble.gradient_boosting_regressor_from_scratch(max_iter=30, splitter='hist', max_depth=3, random_state=5, **sampling_params).fit(X_reg, y_reg)
+    assert np.allclose(GBM_sampled.predict(X_reg), GBM_sampled_again.predict(X_reg)) and not np.allclose(GBM_sampled.predict(X_reg), GBM_hist.predict(X_reg))
+    assert GBM_sampled.loss_history[-1] < 0.5 * GBM_sampled.loss_history[0]
+
+# the additive model: F(X) in one batched pass, in chunks of any size, is the intercept plus the weighted leaf values of the trees one by one
+additive_model = GBM_hist.additive_model_
+trees_values = np.array([tree.value[tree.apply(X_reg)] for tree in GBM_hist.trees_])
+assert np.allclose(additive_model.decision_function(X_reg), GBM_hist.y_hat0_scalar + GBM_hist.learning_rate * trees_values.sum(axis=0))
+assert np.allclose(additive_model.decision_function(X_reg, max_pairs_per_chunk=64), additive_model.decision_function(X_reg))
+AdaBoost = ensemble.adaptive_boosting_classifier_from_scratch(max_iter=20).fit(X, y_signed)
+stumps_votes = np.array([np.where(stump.predict(X) == 1, 1.0, -1.0) for stump in AdaBoost.weak_learners])
+assert np.allclose(AdaBoost.additive_model_.decision_function(X), np.dot(AdaBoost.weak_learners_voting_weights, stumps_votes))
+GBM3 = ensemble.gradient_boosting_classifier_from_scratch(max_iter=10).fit(X3, y3)
+assert np.allclose(GBM3.additive_model_.decision_function(X3, max_pairs_per_chunk=64), list(GBM3._staged_raw_scores(X3))[-1])